@@ -1,25 +1,114 @@
 import os
+import json
+import time
+import queue
 import secrets
+import re
+import math
+import itertools
 import hashlib
 import base64
+import ipaddress
 import requests
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify, stream_with_context, g
 from flask_cors import CORS
 from dotenv import load_dotenv
 
-# Загружаем переменные окружения
+# Загружаем переменные окружения до импорта модулей, которые читают настройки
 load_dotenv()
 
+from spotify_client import get_client, SPOTIFY_TOKEN_URL
+from player_stream import player_hub
+from concurrency import get_executor, get_background_executor, SingleFlight, UPSTREAM_WAIT_TIMEOUT
+from concurrent.futures import TimeoutError as FutureTimeout
+from cache import response_cache, cache_key, CACHE_POLICIES
+from token_manager import UserToken, token_from_response
+from scheduler import RateLimited, NORMAL, BACKGROUND
+from search_index import search_indexes, index_body, LIBRARY_SOURCES
+from paging import fetch_page, iter_pages, PageError, PAGE_CONCURRENCY
+from playlist_store import playlist_store
+from catalog_loader import artist_loader, album_loader
+from pages import artist_summary, related_artist, album_summary, track_summary, album_page
+from recommendations import (recommendations_store, recommendations_job, compute as compute_recommendations,
+                             COMPUTE_REQUESTS as RECOMMENDATIONS_REQUESTS)
+from projection import response_shape, InvalidFields
+from session_store import SessionStore, ServerSession, ServerSessionInterface
+from player_commands import player_commands
+from metrics import worker_metrics, render as render_metrics, METRICS_TOKEN
+from assets import asset_manifest, DIST_DIR
+from listening_history import history_store, history_ingester
+from prefetch import prefetcher, PREFETCH_PLAYLISTS, PREFETCH_ARTISTS
+
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', secrets.token_hex(32))
 CORS(app)
 
+# Сессии хранятся на сервере, в cookie - только ID.
+# SESSION_BACKEND=cookie - прежняя подписанная cookie Flask со всеми данными
+if os.getenv('SESSION_BACKEND', 'server') == 'server':
+    app.session_interface = ServerSessionInterface(SessionStore())
+
+# Адреса статики в шаблонах: собранные файлы с хэшем содержимого (python assets.py)
+app.jinja_env.globals['asset_url'] = asset_manifest.url
+
 # Spotify API конфигурация
 SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
 SPOTIFY_REDIRECT_URI = os.getenv('SPOTIFY_REDIRECT_URI')
 SPOTIFY_AUTH_URL = 'https://accounts.spotify.com/authorize'
-SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
-SPOTIFY_API_BASE = 'https://api.spotify.com/v1'
+
+# SSE: период keepalive комментариев и максимальная длительность одного потока
+# (браузер переподключается сам, а sync воркер не занят бесконечно)
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_MAX_SECONDS = int(os.getenv('PLAYER_STREAM_MAX_SECONDS', '300'))
+# Открытый поток занимает sync воркер целиком, а через timeout gunicorn убивает
+# такой воркер, поэтому поток есть только у async (gevent) воркеров; в sync
+# режиме страница опрашивает /api/currently-playing
+PLAYER_STREAM_ENABLED = os.getenv('GOATMUSIC_WORKER_MODE', 'sync') == 'async'
+
+# Фоновые обновления устаревших записей кэша: не больше одного на ключ
+revalidate_flight = SingleFlight()
+# Промахи кэша по одному ключу (прогрев после входа и bootstrap) - один запрос к Spotify
+fetch_flight = SingleFlight()
+# Рекомендации на месте считаются один раз на пользователя, сколько бы запросов их ни ждало
+recommendations_flight = SingleFlight()
+# Одинаковые одновременные поисковые запросы идут в Spotify одним вызовом
+search_flight = SingleFlight()
+
+# Загрузка треков плейлиста: одна на плейлист и snapshot, сколько бы вкладок ни открыло его
+playlist_flight = SingleFlight()
+
+# Поля плейлиста без треков: по ним видно snapshot_id, а треки берутся из хранилища
+PLAYLIST_FIELDS = ('id,name,description,uri,href,public,collaborative,snapshot_id,'
+                   'images,owner(id,display_name,uri),followers(total),external_urls')
+
+# ID каталога Spotify (base62). Неверный ID испортил бы общий пакет других запросов
+SPOTIFY_ID_RE = re.compile(r'^[0-9A-Za-z]{22}$')
+# Сколько ID можно запросить у /api/artists и /api/albums за раз
+CATALOG_MAX_IDS = 100
+
+# Составные страницы: сколько альбомов и похожих исполнителей показывать
+PAGE_ALBUMS_LIMIT = 20
+PAGE_RELATED_LIMIT = 10
+# Запросов к Spotify на страницу исполнителя: сам исполнитель и три секции
+ARTIST_PAGE_REQUESTS = 4
+
+# Статистика прослушиваний: окно по умолчанию (дней) и размер топов
+STATS_DEFAULT_DAYS = 28
+STATS_DEFAULT_LIMIT = 10
+STATS_MAX_LIMIT = 50
+STATS_MAX_DAYS = 3650
+
+# Типы результатов поиска, которые можно запросить у /api/search
+SEARCH_TYPES = {'track', 'artist', 'album', 'playlist'}
+
+# Секции первой отрисовки dashboard: имя -> (путь Spotify API, параметры, ошибка)
+BOOTSTRAP_SECTIONS = {
+    'profile': ('/me', None, 'Failed to fetch profile'),
+    'playlists': ('/me/playlists', None, 'Failed to fetch playlists'),
+    'recently_played': ('/me/player/recently-played', {'limit': 20}, 'Failed to fetch recently played'),
+    'liked_tracks': ('/me/tracks', {'limit': 50}, 'Failed to fetch liked tracks'),
+    'currently_playing': ('/me/player/currently-playing', None, 'Failed to fetch currently playing'),
+}
 
 # Scopes для доступа к Spotify API
 SCOPES = [
@@ -47,6 +136,226 @@ def generate_code_challenge(code_verifier):
     code_challenge = base64.urlsafe_b64encode(sha256_hash).decode('utf-8').rstrip('=')
     return code_challenge
 
+def user_token():
+    """Токены текущей сессии (один объект на запрос)"""
+    if 'user_token' not in g:
+        g.user_token = UserToken.from_session(session)
+    return g.user_token
+
+@app.before_request
+def start_request_metrics():
+    """Замер маршрута: метка - шаблон правила, а не путь, чтобы серий было конечное число"""
+    g.metrics_route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.metrics_started = worker_metrics.request_started(g.metrics_route)
+
+@app.after_request
+def finish_request_metrics(response):
+    """Регистрируется первым и поэтому выполняется последним: видит итоговый код (304)"""
+    if 'metrics_started' in g:
+        worker_metrics.request_finished(g.metrics_route, request.method, response.status_code, g.metrics_started)
+        g.metrics_finished = True
+    return response
+
+@app.teardown_request
+def close_request_metrics(error=None):
+    """Для потоков выполняется после закрытия потока: in-flight включает открытые SSE"""
+    if 'metrics_started' in g:
+        if 'metrics_finished' not in g:
+            # Необработанное исключение: after_request не вызывался
+            worker_metrics.request_finished(g.metrics_route, request.method, 500, g.metrics_started)
+        worker_metrics.request_closed(g.metrics_route)
+
+@app.after_request
+def save_refreshed_token(response):
+    """Сохраняет в сессию токен, обновленный во время запроса"""
+    token = g.get('user_token')
+    if token is not None and token.changed:
+        token.save(session)
+    return response
+
+@app.after_request
+def add_validators(response):
+    """Сильный ETag для JSON ответов /api/*; при совпадении If-None-Match - 304 без тела
+
+    ETag считается по уже спроецированному телу, поэтому разные fields дают разные ETag
+    """
+    if (request.method == 'GET' and request.path.startswith('/api/') and response.status_code == 200
+            and response.mimetype == 'application/json' and not response.is_streamed):
+        if 'ETag' not in response.headers:
+            response.add_etag()
+        response.headers.setdefault('Cache-Control', 'private, no-cache')
+        response.make_conditional(request)
+    return response
+
+@app.after_request
+def cache_built_assets(response):
+    """Собранная статика меняет имя вместе с содержимым: браузер кэширует ее навсегда
+
+    Нужно, когда статику отдает сам Flask; за nginx те же заголовки ставит location /static/dist/
+    """
+    if request.path.startswith(f'{app.static_url_path}/{DIST_DIR}/') and response.status_code == 200:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def not_modified(etag):
+    """304 без тела, пока данные у браузера не изменились"""
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def background_token(user_id):
+    """Токен для загрузок, которые продолжатся после ответа: действующий и без
+    refresh token, чтобы фоновая задача не обновляла его в обход сессии"""
+    return detached_token(user_token(), user_id)
+
+def detached_token(token, user_id=None):
+    """Копия token без refresh token (и вне запроса, где нет сессии)"""
+    return UserToken(token.get(), None, token.expires_at, user_id or token.user_id)
+
+def spotify_api(method, path, **kwargs):
+    """Запрос к Spotify API от имени текущего пользователя через общий пул соединений"""
+    return get_client().request(method, path, token=user_token(), **kwargs)
+
+def current_user_id():
+    """Spotify ID текущего пользователя (запрашивается один раз на сессию)"""
+    user_id = session.get('user_id')
+    if user_id is None:
+        response = spotify_api('GET', '/me')
+        if response.status_code != 200:
+            return None
+        profile = response.json()
+        user_id = profile.get('id')
+        session['user_id'] = user_id
+        user_token().user_id = user_id
+        session['country'] = profile.get('country')
+        # Профиль уже получен - сразу кладем его в кэш
+        response_cache.set('profile', cache_key('profile', 'default', user_id), response.content)
+    return user_id
+
+def user_market():
+    """Страна пользователя для запросов каталога"""
+    current_user_id()
+    return session.get('country') or 'from_token'
+
+def revalidate(resource, key, token, path, params=None):
+    """Фоновое обновление устаревшей записи кэша (один запрос на ключ)"""
+    def refresh():
+        response = get_client().get(path, token=token, params=params, priority=BACKGROUND)
+        if response.status_code == 200:
+            response_cache.set(resource, key, response.content)
+
+    def run():
+        try:
+            revalidate_flight.do(key, refresh)
+        except (requests.RequestException, RateLimited):
+            # Spotify все еще недоступен - попробуем при следующем обращении
+            pass
+
+    get_executor().submit(run)
+
+def normalize_query(query):
+    """Поисковый запрос без лишних пробелов и регистра (Spotify их не различает)"""
+    return ' '.join(query.split()).casefold()
+
+def update_search_index(user_id, resource, body):
+    """Дополняет локальный поисковый индекс пользователя в фоне"""
+    if user_id is None or resource not in LIBRARY_SOURCES:
+        return
+    get_executor().submit(index_body, search_indexes.get(user_id), resource, body)
+
+def library_index(user_id):
+    """Поисковый индекс пользователя, заполненный из кэша при первом обращении в воркере"""
+    index = search_indexes.get(user_id)
+    if not index.seeded:
+        index.seeded = True
+        body = response_cache.backend.get(cache_key('liked_tracks', 'default', user_id))
+        if body is not None:
+            index_body(index, 'liked_tracks', body)
+    return index
+
+def cached_get(resource, ident, token, user_id, path, params=None, priority=NORMAL):
+    """GET к Spotify через кэш ответов: (тело, код ответа, состояние кэша)
+
+    Состояние кэша - HIT, MISS или STALE. Если Spotify недоступен, отдается
+    последний удачный ответ, а обновление уходит в фон
+    """
+    key = None
+    if CACHE_POLICIES[resource].scope == 'catalog' or user_id is not None:
+        key = cache_key(resource, ident, user_id)
+        body = response_cache.get(resource, key)
+        if body is not None:
+            return body, 200, 'HIT'
+    
+    def fetch():
+        return get_client().get(path, token=token, params=params, priority=priority)
+    
+    try:
+        response = fetch_flight.do(key, fetch) if key is not None else fetch()
+    except (requests.RequestException, RateLimited):
+        stale = response_cache.get_stale(resource, key) if key is not None else None
+        if stale is None:
+            raise
+        # Обновление уходит в фон и переживет запрос
+        revalidate(resource, key, detached_token(token, user_id), path, params)
+        return stale, 200, 'STALE'
+    if response.status_code >= 500 and key is not None:
+        stale = response_cache.get_stale(resource, key)
+        if stale is not None:
+            return stale, 200, 'STALE'
+    if response.status_code != 200:
+        return None, response.status_code, 'MISS'
+    if key is not None:
+        response_cache.set(resource, key, response.content)
+    update_search_index(user_id, resource, response.content)
+    if resource == 'liked_tracks' and user_id is not None:
+        get_executor().submit(recommendations_job.liked_tracks_seen, user_id, response.content)
+    if resource == 'recently_played' and user_id is not None:
+        get_executor().submit(history_ingester.played, user_id, response.content)
+    return response.content, 200, 'MISS'
+
+def json_body(body, cache_status='MISS'):
+    """Ответ с готовым JSON телом без повторной сериализации"""
+    return Response(body, mimetype='application/json', headers={'X-Cache': cache_status})
+
+def json_with(body, name, value):
+    """Добавляет поле с готовым JSON значением в JSON объект body"""
+    body = body.rstrip()[:-1].rstrip()
+    separator = b'' if body.endswith(b'{') else b','
+    return body + separator + b'"%s":' % name.encode() + value + b'}'
+
+def cached_response(resource, ident, path, params=None, error='Request failed', priority=NORMAL):
+    """Ответ маршрута из кэша или из Spotify"""
+    shape = shape_for(resource)
+    user_id = current_user_id() if CACHE_POLICIES[resource].scope == 'user' else None
+    body, status, cache_status = cached_get(resource, ident, user_token(), user_id, path, params, priority)
+    if body is None:
+        return jsonify({'error': error}), status
+    return json_body(shape.body(body), cache_status)
+
+def shape_for(resource):
+    """Форма ответа маршрута: параметр fields или форма ресурса по умолчанию"""
+    return response_shape(resource, request.args.get('fields'))
+
+@app.errorhandler(requests.RequestException)
+def handle_upstream_error(error):
+    """Spotify не ответил за отведенный таймаут или соединение оборвалось"""
+    app.logger.warning('Spotify API request failed: %s', error)
+    return jsonify({'error': 'Spotify API unavailable'}), 502
+
+@app.errorhandler(InvalidFields)
+def handle_invalid_fields(error):
+    """Параметр fields не разбирается"""
+    return jsonify({'error': f'Invalid fields: {error}'}), 400
+
+@app.errorhandler(RateLimited)
+def handle_rate_limited(error):
+    """Лимит запросов к Spotify исчерпан: браузер повторит запрос позже"""
+    retry_after = max(1, math.ceil(error.retry_after))
+    response = jsonify({'error': 'Rate limited', 'retry_after': retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
 @app.route('/')
 def index():
     """Главная страница"""
@@ -101,15 +410,28 @@ def callback():
         'code_verifier': code_verifier
     }
     
-    response = requests.post(SPOTIFY_TOKEN_URL, data=token_data)
+    response = get_client().post(SPOTIFY_TOKEN_URL, data=token_data)
     
     if response.status_code == 200:
-        token_info = response.json()
+        token = token_from_response(response.json())
         
-        # Сохраняем токены в сессии
-        session['access_token'] = token_info['access_token']
-        session['refresh_token'] = token_info.get('refresh_token')
-        session['token_expires_at'] = token_info.get('expires_in', 3600)
+        # Сохраняем токены в сессии (время истечения - абсолютное).
+        # После входа у сессии новый ID - защита от фиксации сессии
+        if isinstance(session._get_current_object(), ServerSession):
+            session.regenerate()
+        session['access_token'] = token['access_token']
+        session['refresh_token'] = token['refresh_token']
+        session['token_expires_at'] = token['expires_at']
+        
+        # ID пользователя - часть ключей кэша, поэтому профиль запрашивается сразу;
+        # остальные секции dashboard загружаются в фоне, пока браузер идет по редиректу
+        try:
+            user_id = current_user_id()
+        except (requests.RequestException, RateLimited):
+            # Прогрев необязателен: dashboard загрузит все сам
+            user_id = None
+        if user_id is not None:
+            warm_up(background_token(user_id), user_id, user_market())
         
         return redirect(url_for('dashboard'))
     else:
@@ -129,13 +451,7 @@ def get_profile():
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    response = requests.get(f"{SPOTIFY_API_BASE}/me", headers=headers)
-    
-    if response.status_code == 200:
-        return jsonify(response.json())
-    else:
-        return jsonify({'error': 'Failed to fetch profile'}), response.status_code
+    return cached_response('profile', 'default', '/me', error='Failed to fetch profile')
 
 @app.route('/api/playlists')
 def get_playlists():
@@ -143,37 +459,61 @@ def get_playlists():
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    response = requests.get(f"{SPOTIFY_API_BASE}/me/playlists", headers=headers)
-    
-    if response.status_code == 200:
-        return jsonify(response.json())
-    else:
-        return jsonify({'error': 'Failed to fetch playlists'}), response.status_code
+    return cached_response('playlists', 'default', '/me/playlists', error='Failed to fetch playlists',
+                           priority=BACKGROUND)
 
 @app.route('/api/search')
 def search():
-    """Поиск по Spotify"""
+    """Поиск: мгновенно по библиотеке пользователя, по каталогу - через Spotify
+
+    scope=library - только локальный индекс (для typeahead),
+    scope=all (по умолчанию) - результаты Spotify и совпадения из библиотеки в library
+    """
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    query = request.args.get('q', '')
+    query = normalize_query(request.args.get('q', ''))
     if not query:
         return jsonify({'error': 'Query parameter required'}), 400
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
+    scope = request.args.get('scope', 'all')
+    if scope not in ['all', 'library']:
+        return jsonify({'error': 'Invalid search scope'}), 400
+    
+    types = sorted(set(request.args.get('type', 'track,artist,album').split(',')))
+    if not set(types) <= SEARCH_TYPES:
+        return jsonify({'error': 'Invalid search type'}), 400
+    types = ','.join(types)
+    
+    shape = shape_for('search')
+    user_id = current_user_id()
+    library = library_index(user_id).search(query) if user_id else {}
+    library = shape.apply({kind: {'items': items} for kind, items in library.items()})
+    if scope == 'library':
+        return jsonify(library)
+    
+    market = user_market()
     params = {
         'q': query,
-        'type': 'track,artist,album',
+        'type': types,
+        'market': market,
         'limit': 20
     }
     
-    response = requests.get(f"{SPOTIFY_API_BASE}/search", headers=headers, params=params)
+    # Результаты каталога общие для всех пользователей с той же страной
+    ident = f"{market}:{types}:{query}"
+    token = user_token()
+    body, status, cache_status = search_flight.do(
+        cache_key('search', ident),
+        lambda: cached_get('search', ident, token, None, '/search', params))
     
-    if response.status_code == 200:
-        return jsonify(response.json())
-    else:
-        return jsonify({'error': 'Search failed'}), response.status_code
+    if body is None:
+        return jsonify({'error': 'Search failed'}), status
+    
+    # Проекция результатов каталога запоминается: популярные запросы не разбираются повторно
+    body = shape.body(body)
+    library = json.dumps(library, separators=(',', ':')).encode('utf-8')
+    return json_body(json_with(body, 'library', library), cache_status)
 
 @app.route('/api/currently-playing')
 def get_currently_playing():
@@ -181,75 +521,130 @@ def get_currently_playing():
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    response = requests.get(f"{SPOTIFY_API_BASE}/me/player/currently-playing", headers=headers)
+    shape = shape_for('currently_playing')
+    response = spotify_api('GET', '/me/player/currently-playing')
     
     if response.status_code == 200:
-        return jsonify(response.json())
+        data = response.json()
+        user_id = session.get('user_id')
+        if user_id is not None:
+            prefetch_track_artists(background_token(user_id), user_id, user_market(), data.get('item'))
+        return json_body(shape.dumps(data))
     else:
         return jsonify({'error': 'Failed to fetch currently playing'}), response.status_code
 
-@app.route('/api/play')
+@app.route('/api/stream/player-state')
+def stream_player_state():
+    """Поток изменений состояния плеера (Server-Sent Events)"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not PLAYER_STREAM_ENABLED:
+        return jsonify({'error': 'Player stream requires async workers, poll /api/currently-playing'}), 503
+    
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Failed to fetch profile'}), 502
+    
+    # Опросчик живет дольше запроса: ему - токен без refresh token
+    token = background_token(user_id)
+    subscription = player_hub.subscribe(user_id, token)
+    market = user_market()
+    
+    def events():
+        playing = None
+        try:
+            yield "retry: 3000\n\n"
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    state = subscription.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(state)}\n\n"
+                # Сменился трек - страницы его исполнителей вероятно откроют следующими
+                item = state.get('item') or {}
+                if item.get('id') != playing:
+                    playing = item.get('id')
+                    prefetch_track_artists(token, user_id, market, item)
+        finally:
+            player_hub.unsubscribe(user_id, subscription)
+    
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
+@app.route('/api/play', methods=['PUT'])
 def play_track():
-    """Воспроизводит трек"""
+    """Воспроизводит трек (uri) или продолжает воспроизведение"""
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    track_uri = request.json.get('uri')
-    if not track_uri:
-        return jsonify({'error': 'Track URI required'}), 400
+    track_uri = (request.get_json(silent=True) or {}).get('uri')
+    if track_uri is not None and not isinstance(track_uri, str):
+        return jsonify({'error': 'Invalid track URI'}), 400
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    data = {'uris': [track_uri]}
-    
-    response = requests.put(f"{SPOTIFY_API_BASE}/me/player/play", headers=headers, json=data)
-    
-    if response.status_code in [200, 204]:
-        return jsonify({'success': True})
-    else:
-        return jsonify({'error': 'Failed to play track'}), response.status_code
+    return player_command('play', track_uri) if track_uri else player_command('resume')
 
-@app.route('/api/pause')
+@app.route('/api/pause', methods=['PUT'])
 def pause_track():
     """Приостанавливает воспроизведение"""
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    response = requests.put(f"{SPOTIFY_API_BASE}/me/player/pause", headers=headers)
-    
-    if response.status_code in [200, 204]:
-        return jsonify({'success': True})
-    else:
-        return jsonify({'error': 'Failed to pause'}), response.status_code
+    return player_command('pause')
 
-@app.route('/api/next')
+@app.route('/api/next', methods=['POST'])
 def next_track():
     """Следующий трек"""
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    response = requests.post(f"{SPOTIFY_API_BASE}/me/player/next", headers=headers)
-    
-    if response.status_code in [200, 204]:
-        return jsonify({'success': True})
-    else:
-        return jsonify({'error': 'Failed to skip to next'}), response.status_code
+    return player_command('next')
 
-@app.route('/api/previous')
+@app.route('/api/previous', methods=['POST'])
 def previous_track():
     """Предыдущий трек"""
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    response = requests.post(f"{SPOTIFY_API_BASE}/me/player/previous", headers=headers)
+    return player_command('previous')
+
+def player_command(name, value=None):
+    """Команда уходит в Spotify в фоне; ответ - сразу, с предсказанным состоянием плеера
+
+    Настоящее состояние приходит следом в поток /api/stream/player-state, итог
+    команды - в /api/player/commands/<id>. client и seq в теле - вкладка и номер ее
+    команды: команда, обогнанная более новой того же вида, отклоняется с 409
+    """
+    data = request.get_json(silent=True) or {}
+    client, client_seq = data.get('client'), data.get('seq')
+    if client is not None and (not isinstance(client, str) or not 0 < len(client) <= 64):
+        return jsonify({'error': 'Invalid client'}), 400
+    if client_seq is not None and (not isinstance(client_seq, int) or isinstance(client_seq, bool)):
+        return jsonify({'error': 'Invalid command sequence'}), 400
+    
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Failed to fetch profile'}), 502
+    submitted = player_commands.submit(user_id, user_token(), name, value, client, client_seq)
+    if submitted is None:
+        return jsonify({'error': 'Stale command'}), 409
+    command_id, state = submitted
+    return jsonify({'success': True, 'id': command_id, 'state': state}), 202
+
+@app.route('/api/player/commands/<int:command_id>')
+def get_player_command(command_id):
+    """Итог команды плеера: pending, sent, failed (с ошибкой Spotify) или dropped"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    if response.status_code in [200, 204]:
-        return jsonify({'success': True})
-    else:
-        return jsonify({'error': 'Failed to skip to previous'}), response.status_code
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Failed to fetch profile'}), 502
+    command = player_commands.status(user_id, command_id)
+    if command is None:
+        return jsonify({'error': 'Command not found'}), 404
+    return jsonify(command)
 
 @app.route('/api/recently-played')
 def get_recently_played():
@@ -257,15 +652,160 @@ def get_recently_played():
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
     params = {'limit': 20}
     
-    response = requests.get(f"{SPOTIFY_API_BASE}/me/player/recently-played", headers=headers, params=params)
+    return cached_response('recently_played', 'default', '/me/player/recently-played', params,
+                           error='Failed to fetch recently played')
+
+def int_arg(name, default):
+    """Целый параметр запроса: default, если его нет, None - если это не целое число"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def stats_request():
+    """(user_id, days, limit) запроса статистики или (None, ответ с ошибкой)
+
+    days=0 - за все время. Статистика читается из локальной истории; если ее у
+    пользователя еще нет, первый сбор уходит в фон, а ответ пока пустой
+    """
+    days = int_arg('days', STATS_DEFAULT_DAYS)
+    limit = int_arg('limit', STATS_DEFAULT_LIMIT)
+    if days is None or not 0 <= days <= STATS_MAX_DAYS:
+        return None, (jsonify({'error': f'days must be between 0 and {STATS_MAX_DAYS}'}), 400)
+    if limit is None or not 1 <= limit <= STATS_MAX_LIMIT:
+        return None, (jsonify({'error': f'limit must be between 1 and {STATS_MAX_LIMIT}'}), 400)
+    user_id = current_user_id()
+    if user_id is None:
+        return None, (jsonify({'error': 'Failed to fetch profile'}), 502)
+    token = history_ingester.track(user_id, user_token())
+    if history_store.updated_at(user_id) is None:
+        get_executor().submit(history_ingester.poll_if_due, user_id, token)
+    return (user_id, days or None, limit), None
+
+def stats_response(user_id, days, items):
+    return jsonify({'days': days, 'updated_at': history_store.updated_at(user_id), 'items': items})
+
+@app.route('/api/stats/top-tracks')
+def get_stats_top_tracks():
+    """Самые прослушиваемые треки за последние days дней"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    if response.status_code == 200:
-        return jsonify(response.json())
-    else:
-        return jsonify({'error': 'Failed to fetch recently played'}), response.status_code
+    params, error = stats_request()
+    if error:
+        return error
+    user_id, days, limit = params
+    items = [{'track': track, 'plays': plays, 'ms': ms}
+             for track, plays, ms in history_store.top_tracks(user_id, days, limit)]
+    return stats_response(user_id, days, items)
+
+@app.route('/api/stats/top-artists')
+def get_stats_top_artists():
+    """Самые прослушиваемые исполнители за последние days дней"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    params, error = stats_request()
+    if error:
+        return error
+    user_id, days, limit = params
+    items = [{'artist': {'id': artist_id, 'name': name}, 'plays': plays, 'ms': ms}
+             for artist_id, name, plays, ms in history_store.top_artists(user_id, days, limit)]
+    return stats_response(user_id, days, items)
+
+@app.route('/api/stats/listening')
+def get_stats_listening():
+    """Время прослушивания по дням или неделям (period=day|week)"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    period = request.args.get('period', 'day')
+    if period not in ('day', 'week'):
+        return jsonify({'error': 'period must be day or week'}), 400
+    params, error = stats_request()
+    if error:
+        return error
+    user_id, days, _ = params
+    items = [{period: start, 'plays': plays, 'ms': ms}
+             for start, plays, ms in history_store.listening(user_id, days, period)]
+    return stats_response(user_id, days, items)
+
+def stream_collection(path, page_size, error, shape, params=None, indexed=False):
+    """Вся коллекция Spotify в NDJSON: по строке JSON на элемент
+
+    Первая страница запрашивается до ответа (ее ошибка - обычный JSON с кодом),
+    остальные - параллельно и отдаются по мере получения. Параметр offset
+    позволяет пропустить уже показанные элементы. Каждый элемент проецируется
+    по shape по мере получения страниц
+    """
+    offset = int_arg('offset', 0)
+    if offset is None or offset < 0:
+        return jsonify({'error': 'Invalid offset'}), 400
+    
+    token = user_token()
+    try:
+        first_page = fetch_page(token, path, offset, page_size, params)
+    except PageError as page_error:
+        return jsonify({'error': error}), page_error.status
+    
+    on_page = None
+    user_id = current_user_id() if indexed else None
+    if user_id is not None:
+        # Полная выгрузка библиотеки заодно дополняет локальный поисковый индекс
+        index = search_indexes.get(user_id)
+        on_page = lambda page: index.add_items(page.get('items'))
+        on_page(first_page)
+    
+    def generate():
+        pages = itertools.chain([first_page], iter_pages(token, path, first_page, page_size, params, on_page))
+        try:
+            for page in pages:
+                yield ''.join(json.dumps(shape.apply(item), separators=(',', ':')) + '\n'
+                              for item in page.get('items') or ())
+        except PageError as page_error:
+            yield json.dumps({'error': error, 'status': page_error.status}) + '\n'
+        except RateLimited:
+            yield json.dumps({'error': 'Rate limited', 'status': 429}) + '\n'
+        except requests.RequestException:
+            yield json.dumps({'error': 'Spotify API unavailable', 'status': 502}) + '\n'
+    
+    headers = {
+        'X-Total-Count': str(first_page.get('total') or 0),
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    }
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
+
+@app.route('/api/stream/liked-tracks')
+def stream_liked_tracks():
+    """Все любимые треки пользователя потоком NDJSON"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return stream_collection('/me/tracks', 50, 'Failed to fetch liked tracks', shape_for('liked_track_item'),
+                             indexed=True)
+
+@app.route('/api/stream/playlists')
+def stream_playlists():
+    """Все плейлисты пользователя потоком NDJSON"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return stream_collection('/me/playlists', 50, 'Failed to fetch playlists', shape_for('playlist_item'))
+
+@app.route('/api/stream/playlist/<playlist_id>/tracks')
+def stream_playlist_tracks(playlist_id):
+    """Все треки плейлиста потоком NDJSON"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return stream_collection(f"/playlists/{playlist_id}/tracks", 100, 'Failed to fetch playlist tracks',
+                             shape_for('playlist_track_item'), indexed=True)
 
 @app.route('/api/liked-tracks')
 def get_liked_tracks():
@@ -273,50 +813,163 @@ def get_liked_tracks():
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
     params = {'limit': 50}
     
-    response = requests.get(f"{SPOTIFY_API_BASE}/me/tracks", headers=headers, params=params)
-    
-    if response.status_code == 200:
-        return jsonify(response.json())
+    return cached_response('liked_tracks', 'default', '/me/tracks', params, error='Failed to fetch liked tracks')
+
+def fetch_recommendations(token, user_id=None, priority=NORMAL):
+    """Предвычисленные рекомендации: (тело, ошибка, код ответа)
+
+    Обычно ответ читается из recommendations_store, а пересчет идет в фоне.
+    Считаем на месте только для пользователя, у которого записи еще нет: его
+    ждет страница, поэтому приоритет обычный (фоновый - у периодической задачи)
+    """
+    if user_id is not None:
+        recommendations_job.track(user_id, token)
+        row = recommendations_store.get(user_id)
+        if row is not None:
+            return row[1], None, 200
+    
+    if user_id is not None:
+        seeds, body, status = recommendations_flight.do(user_id, lambda: compute_recommendations(token, priority))
     else:
-        return jsonify({'error': 'Failed to fetch liked tracks'}), response.status_code
+        seeds, body, status = compute_recommendations(token, priority)
+    if status == 400:
+        return None, 'No listening history for recommendations', 400
+    if body is None:
+        return None, 'Failed to fetch recommendations', status
+    if user_id is not None:
+        recommendations_store.put(user_id, seeds, body)
+    return body, None, 200
 
 @app.route('/api/recommendations')
 def get_recommendations():
-    """Получает рекомендации на основе любимых треков"""
+    """Получает рекомендации на основе истории прослушивания"""
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
+    shape = shape_for('recommendations')
+    body, error, status = fetch_recommendations(user_token(), current_user_id())
     
-    # Сначала получаем любимые треки для seed
-    liked_response = requests.get(f"{SPOTIFY_API_BASE}/me/tracks", headers=headers, params={'limit': 5})
-    
-    if liked_response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch liked tracks for recommendations'}), liked_response.status_code
-    
-    liked_data = liked_response.json()
-    if not liked_data.get('items'):
-        return jsonify({'error': 'No liked tracks found'}), 400
+    if error:
+        return jsonify({'error': error}), status
+    return json_body(shape.body(body))
+
+def fetch_section(token, user_id, name, path, params, error):
+    """Одна секция bootstrap: (тело, ошибка, код ответа, состояние кэша)"""
+    cache_status = None
+    if name in CACHE_POLICIES:
+        body, status, cache_status = cached_get(name, 'default', token, user_id, path, params)
+    else:
+        response = get_client().get(path, token=token, params=params)
+        body, status = (response.content, 200) if response.status_code == 200 else (None, response.status_code)
+        if body is not None:
+            update_search_index(user_id, name, body)
+    if body is not None or status == 204:
+        return body, None, status, cache_status
+    return None, error, status, cache_status
+
+def recommendations_section(token, user_id):
+    """Рекомендации как секция bootstrap"""
+    return fetch_recommendations(token, user_id) + (None,)
+
+@app.route('/api/bootstrap')
+def bootstrap():
+    """Все данные первой отрисовки dashboard одним запросом
+
+    Секции отдаются в форме по умолчанию; fields=* - полные ответы Spotify
+    """
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    # Берем ID первых 5 любимых треков
-    seed_tracks = ','.join([item['track']['id'] for item in liked_data['items'][:5]])
+    full = request.args.get('fields') == '*'
+    token = user_token()
+    user_id = current_user_id()
+    executor = get_executor()
     
-    # Получаем рекомендации
-    params = {
-        'seed_tracks': seed_tracks,
-        'limit': 20,
-        'market': 'from_token'
+    # Запросы к Spotify идут параллельно: время ответа равно самому медленному из них.
+    # Ошибки отдельных секций попадают в errors, остальные секции все равно заполнены
+    futures = {
+        name: executor.submit(fetch_section, token, user_id, name, path, params, error)
+        for name, (path, params, error) in BOOTSTRAP_SECTIONS.items()
     }
-    
-    response = requests.get(f"{SPOTIFY_API_BASE}/recommendations", headers=headers, params=params)
-    
-    if response.status_code == 200:
-        return jsonify(response.json())
-    else:
-        return jsonify({'error': 'Failed to fetch recommendations'}), response.status_code
+    futures['recommendations'] = executor.submit(recommendations_section, token, user_id)
+    history_ingester.track(user_id, token)
+    
+    # Тела секций уже в JSON - склеиваем их проекции по умолчанию без повторной сериализации.
+    # Секции из устаревшего кэша (Spotify не ответил) отмечаются в stale
+    parts = []
+    errors = {}
+    stale = {}
+    bodies = {}
+    for name, future in futures.items():
+        try:
+            body, error, status, cache_status = future.result(timeout=UPSTREAM_WAIT_TIMEOUT)
+        except FutureTimeout:
+            body, error, status, cache_status = None, 'Spotify API timeout', 504, None
+        except requests.RequestException:
+            body, error, status, cache_status = None, 'Spotify API unavailable', 502, None
+        except RateLimited:
+            body, error, status, cache_status = None, 'Rate limited', 429, None
+        bodies[name] = body
+        if body is not None and not full:
+            body = response_shape(name).body(body)
+        parts.append(b'"%s":%s' % (name.encode(), body or b'null'))
+        if error:
+            errors[name] = {'error': error, 'status': status}
+        if cache_status == 'STALE':
+            stale[name] = True
+    parts.append(b'"errors":' + json.dumps(errors).encode())
+    parts.append(b'"stale":' + json.dumps(stale).encode())
+    if user_id is not None:
+        get_background_executor().submit(prefetch_next_views, background_token(user_id), user_id,
+                                         user_market(), bodies)
+    
+    return Response(b'{' + b','.join(parts) + b'}', mimetype='application/json')
+
+def warm_up(token, user_id, market):
+    """Прогрев после входа: секции bootstrap и рекомендации загружаются в кэш
+
+    Запрос dashboard, пришедший раньше конца прогрева, дожидается тех же
+    запросов к Spotify (fetch_flight), а не повторяет их
+    """
+    for name, (path, params, _) in BOOTSTRAP_SECTIONS.items():
+        prefetcher.submit(user_id, f"warm:{name}", 1, warm_section, token, user_id, market, name, path, params)
+    prefetcher.submit(user_id, 'warm:recommendations', RECOMMENDATIONS_REQUESTS,
+                      warm_recommendations, token, user_id)
+
+def warm_section(token, user_id, market, name, path, params):
+    """Секция bootstrap в кэш, затем упреждающая загрузка по ней"""
+    body, _, cache_status = cached_get(name, 'default', token, user_id, path, params)
+    if body is not None:
+        prefetch_next_views(token, user_id, market, {name: body})
+    return 0 if cache_status == 'HIT' else 1
+
+def warm_recommendations(token, user_id):
+    stored = recommendations_store.get(user_id) is not None
+    fetch_recommendations(token, user_id)
+    return 0 if stored else None
+
+def prefetch_next_views(token, user_id, market, bodies):
+    """Вероятные следующие экраны по секциям dashboard: первые плейлисты и исполнители текущего трека"""
+    if bodies.get('playlists'):
+        for playlist in (json.loads(bodies['playlists']).get('items') or ())[:PREFETCH_PLAYLISTS]:
+            if not playlist or not playlist.get('id'):
+                continue
+            # Метаданные и страницы треков по 100
+            pages = math.ceil(((playlist.get('tracks') or {}).get('total') or 0) / 100)
+            prefetcher.submit(user_id, f"playlist:{playlist['id']}", 1 + max(pages, 1),
+                              prefetch_playlist, token, user_id, playlist['id'])
+    if bodies.get('currently_playing'):
+        prefetch_track_artists(token, user_id, market, json.loads(bodies['currently_playing']).get('item'))
+
+def prefetch_track_artists(token, user_id, market, item):
+    """Страницы исполнителей трека в кэш (без запросов, если они там уже есть)"""
+    for artist in ((item or {}).get('artists') or ())[:PREFETCH_ARTISTS]:
+        artist_id = artist.get('id') or ''
+        if SPOTIFY_ID_RE.match(artist_id):
+            prefetcher.submit(user_id, f"artist:{artist_id}", ARTIST_PAGE_REQUESTS,
+                              prefetch_artist_page, token, artist_id, market)
 
 @app.route('/api/playlist/<playlist_id>')
 def get_playlist(playlist_id):
@@ -324,13 +977,90 @@ def get_playlist(playlist_id):
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    response = requests.get(f"{SPOTIFY_API_BASE}/playlists/{playlist_id}", headers=headers)
-    
-    if response.status_code == 200:
-        return jsonify(response.json())
+    shape = shape_for('playlist')
+    token = user_token()
+    user_id = current_user_id()
+    
+    # Метаданные плейлиста маленькие - по ним проверяем snapshot_id
+    body, status, cache_status = cached_get('playlist', playlist_id, token, user_id,
+                                            f"/playlists/{playlist_id}", {'fields': PLAYLIST_FIELDS})
+    if body is None:
+        return jsonify({'error': 'Failed to fetch playlist'}), status
+    snapshot_id = json.loads(body).get('snapshot_id')
+    
+    # ETag по метаданным с snapshot_id: неизмененный плейлист отвечает 304,
+    # не читая треки из хранилища. Устаревшие метаданные могут не совпадать
+    # с сохраненными треками - тогда ETag считается по телу ответа
+    etag = None
+    if cache_status != 'STALE':
+        etag = hashlib.sha1(shape.fields.encode() + b'\0' + body).hexdigest()
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+    
+    # Треки скачиваются заново, только если плейлист изменился. Если Spotify
+    # недоступен (метаданные из кэша пользователя), отдаем сохраненную версию
+    stored = playlist_store.get(playlist_id)
+    stored_snapshot = snapshot_id
+    if stored is not None and (stored[0] == snapshot_id or cache_status == 'STALE'):
+        stored_snapshot, tracks, total = stored
+        store_status = 'HIT'
     else:
-        return jsonify({'error': 'Failed to fetch playlist'}), response.status_code
+        try:
+            tracks, total = playlist_flight.do(
+                f"{playlist_id}:{snapshot_id}",
+                lambda: load_playlist_tracks(token, playlist_id, snapshot_id, user_id))
+        except PageError as page_error:
+            return jsonify({'error': 'Failed to fetch playlist'}), page_error.status
+        store_status = 'MISS'
+    
+    # Склеиваем проекции метаданных и треков; проекция треков запоминается
+    # по снимку плейлиста, так что повторные открытия не разбирают JSON
+    body = shape.without('tracks').body(body)
+    tracks_shape = shape.child('tracks')
+    if tracks_shape is not None:
+        parts = []
+        items_shape = tracks_shape.child('items')
+        if items_shape is not None:
+            parts.append(b'"items":' + items_shape.body(tracks, ('playlist', playlist_id, stored_snapshot)))
+        if tracks_shape.wants('total'):
+            parts.append(b'"total":%d' % total)
+        body = json_with(body, 'tracks', b'{' + b','.join(parts) + b'}')
+    response = json_body(body, cache_status)
+    response.headers['X-Playlist-Store'] = store_status
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+def load_playlist_tracks(token, playlist_id, snapshot_id, user_id=None, concurrency=PAGE_CONCURRENCY):
+    """Все треки плейлиста (страницы параллельно), сохраняются под snapshot_id"""
+    path = f"/playlists/{playlist_id}/tracks"
+    first_page = fetch_page(token, path, 0, 100)
+    items = list(first_page.get('items') or ())
+    for page in iter_pages(token, path, first_page, 100, concurrency=concurrency):
+        items.extend(page.get('items') or ())
+    
+    tracks = json.dumps(items).encode('utf-8')
+    playlist_store.put(playlist_id, snapshot_id, tracks, len(items))
+    if user_id is not None:
+        search_indexes.get(user_id).add_items(items)
+    return tracks, len(items)
+
+def prefetch_playlist(token, user_id, playlist_id):
+    """Плейлист, как его откроет /api/playlist/<id>: метаданные в кэш, треки в хранилище"""
+    body, _, cache_status = cached_get('playlist', playlist_id, token, user_id, f"/playlists/{playlist_id}",
+                                       {'fields': PLAYLIST_FIELDS}, BACKGROUND)
+    spent = 0 if cache_status == 'HIT' else 1
+    if body is None or cache_status == 'STALE':
+        return spent
+    snapshot_id = json.loads(body).get('snapshot_id')
+    stored = playlist_store.get(playlist_id)
+    if stored is None or stored[0] != snapshot_id:
+        # Фоновая задача сама занимает поток пула, поэтому страницы - по очереди в нем же
+        _, total = playlist_flight.do(
+            f"{playlist_id}:{snapshot_id}",
+            lambda: load_playlist_tracks(token, playlist_id, snapshot_id, user_id, concurrency=1))
+        spent += max(math.ceil(total / 100), 1)
+    return spent
 
 @app.route('/api/artist/<artist_id>')
 def get_artist(artist_id):
@@ -338,13 +1068,23 @@ def get_artist(artist_id):
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    response = requests.get(f"{SPOTIFY_API_BASE}/artists/{artist_id}", headers=headers)
+    if not SPOTIFY_ID_RE.match(artist_id):
+        return jsonify({'error': 'Invalid artist id'}), 400
     
-    if response.status_code == 200:
-        return jsonify(response.json())
-    else:
-        return jsonify({'error': 'Failed to fetch artist'}), response.status_code
+    # Запрос уходит общим пакетом /artists?ids= вместе с соседними запросами воркера
+    shape = shape_for('artist')
+    body = artist_loader.load(artist_id, user_token())
+    if body is None:
+        return jsonify({'error': 'Failed to fetch artist'}), 404
+    return Response(shape.body(body), mimetype='application/json')
+
+@app.route('/api/artists')
+def get_artists():
+    """Несколько исполнителей за раз: ids через запятую"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return catalog_batch_response(artist_loader, 'artists')
 
 @app.route('/api/artist/<artist_id>/top-tracks')
 def get_artist_top_tracks(artist_id):
@@ -352,15 +1092,12 @@ def get_artist_top_tracks(artist_id):
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    params = {'market': 'from_token'}
-    
-    response = requests.get(f"{SPOTIFY_API_BASE}/artists/{artist_id}/top-tracks", headers=headers, params=params)
+    # Топ треков зависит от страны, поэтому страна входит в ключ кэша
+    market = user_market()
+    params = {'market': market}
     
-    if response.status_code == 200:
-        return jsonify(response.json())
-    else:
-        return jsonify({'error': 'Failed to fetch artist top tracks'}), response.status_code
+    return cached_response('artist_top_tracks', f"{artist_id}:{market}", f"/artists/{artist_id}/top-tracks",
+                           params, error='Failed to fetch artist top tracks')
 
 @app.route('/api/album/<album_id>')
 def get_album(album_id):
@@ -368,72 +1105,196 @@ def get_album(album_id):
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    params = {'market': 'from_token'}
+    if not SPOTIFY_ID_RE.match(album_id):
+        return jsonify({'error': 'Invalid album id'}), 400
     
-    response = requests.get(f"{SPOTIFY_API_BASE}/albums/{album_id}", headers=headers, params=params)
+    # Доступность треков альбома зависит от страны - она входит в ключ пакета и кэша
+    shape = shape_for('album')
+    body = album_loader.load(album_id, user_token(), user_market())
+    if body is None:
+        return jsonify({'error': 'Failed to fetch album'}), 404
+    return Response(shape.body(body), mimetype='application/json')
+
+@app.route('/api/albums')
+def get_albums():
+    """Несколько альбомов за раз: ids через запятую"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    if response.status_code == 200:
-        return jsonify(response.json())
-    else:
-        return jsonify({'error': 'Failed to fetch album'}), response.status_code
+    return catalog_batch_response(album_loader, 'albums', user_market())
+
+def catalog_batch_response(loader, field, market=None):
+    """Ответ вида Spotify {field: [объект или null, ...]} в порядке ids"""
+    ids = [entity_id for entity_id in request.args.get('ids', '').split(',') if entity_id]
+    if not ids:
+        return jsonify({'error': 'Parameter ids required'}), 400
+    if len(ids) > CATALOG_MAX_IDS:
+        return jsonify({'error': f'At most {CATALOG_MAX_IDS} ids allowed'}), 400
+    if not all(SPOTIFY_ID_RE.match(entity_id) for entity_id in ids):
+        return jsonify({'error': 'Invalid id'}), 400
+    
+    # Объекты проецируются по отдельности: проекция каждого запоминается
+    # и переиспользуется в любых других наборах ids
+    item_shape = shape_for(field).child(field)
+    if item_shape is None:
+        return jsonify({})
+    bodies = loader.load_many(ids, user_token(), market)
+    items = b','.join(item_shape.body(bodies[entity_id]) or b'null' for entity_id in ids)
+    return Response(b'{"%s":[%s]}' % (field.encode(), items), mimetype='application/json')
+
+def load_section(loader, entity_id, token, market=None):
+    """Объект каталога через пакетный загрузчик в виде секции: (тело, код ответа, кэш)"""
+    body = loader.load(entity_id, token, market)
+    return body, 200 if body is not None else 404, None
+
+def collect_sections(page, sections, trims):
+    """Дожидается секций страницы и урезает их; ошибки секций - в page['errors']"""
+    errors = {}
+    for name, future in sections.items():
+        try:
+            body, status, _ = future.result(timeout=UPSTREAM_WAIT_TIMEOUT)
+        except FutureTimeout:
+            body, status = None, 504
+        except requests.RequestException:
+            body, status = None, 502
+        except RateLimited:
+            body, status = None, 429
+        if body is None:
+            page[name] = None
+            errors[name] = {'error': f'Failed to fetch {name}', 'status': status}
+        else:
+            page[name] = trims[name](json.loads(body))
+    page['errors'] = errors
+    return page
+
+def artist_page_requests(artist_id, market):
+    """Секции страницы исполнителя из кэша каталога: имя -> (ресурс, ключ, путь, параметры)"""
+    return {
+        'top_tracks': ('artist_top_tracks', f"{artist_id}:{market}", f"/artists/{artist_id}/top-tracks",
+                       {'market': market}),
+        'albums': ('artist_albums', f"{artist_id}:{market}", f"/artists/{artist_id}/albums",
+                   {'include_groups': 'album,single', 'market': market, 'limit': PAGE_ALBUMS_LIMIT}),
+        'related_artists': ('related_artists', artist_id, f"/artists/{artist_id}/related-artists", None),
+    }
+
+def artist_albums_section(executor, artist_id, token, market):
+    resource, ident, path, params = artist_page_requests(artist_id, market)['albums']
+    return executor.submit(cached_get, resource, ident, token, None, path, params)
+
+def prefetch_artist_page(token, artist_id, market):
+    """Страница исполнителя в кэш, как ее соберет /api/page/artist/<id>"""
+    artist_loader.load(artist_id, token)
+    spent = 1
+    for resource, ident, path, params in artist_page_requests(artist_id, market).values():
+        _, _, cache_status = cached_get(resource, ident, token, None, path, params, BACKGROUND)
+        spent += cache_status != 'HIT'
+    return spent
+
+@app.route('/api/page/artist/<artist_id>')
+def get_artist_page(artist_id):
+    """Страница исполнителя одним запросом: исполнитель, топ треков, альбомы, похожие"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not SPOTIFY_ID_RE.match(artist_id):
+        return jsonify({'error': 'Invalid artist id'}), 400
+    
+    token = user_token()
+    market = user_market()
+    executor = get_executor()
+    
+    # Все запросы к Spotify идут параллельно: время ответа равно самому медленному
+    artist_future = executor.submit(artist_loader.load, artist_id, token)
+    sections = {
+        name: executor.submit(cached_get, resource, ident, token, None, path, params)
+        for name, (resource, ident, path, params) in artist_page_requests(artist_id, market).items()
+    }
+    
+    artist = artist_future.result()
+    if artist is None:
+        return jsonify({'error': 'Artist not found'}), 404
+    
+    page = {'artist': artist_summary(json.loads(artist))}
+    trims = {
+        'top_tracks': lambda data: [track_summary(track, track.get('album') or {})
+                                    for track in data.get('tracks') or ()],
+        'albums': lambda data: [album_summary(album) for album in data.get('items') or ()],
+        'related_artists': lambda data: [related_artist(artist)
+                                         for artist in (data.get('artists') or [])[:PAGE_RELATED_LIMIT]],
+    }
+    return jsonify(collect_sections(page, sections, trims))
 
-@app.route('/api/volume')
+@app.route('/api/page/album/<album_id>')
+def get_album_page(album_id):
+    """Страница альбома одним запросом: альбом с треками, исполнитель и другие его альбомы"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not SPOTIFY_ID_RE.match(album_id):
+        return jsonify({'error': 'Invalid album id'}), 400
+    
+    token = user_token()
+    market = user_market()
+    executor = get_executor()
+    
+    # Исполнитель известен только из альбома, поэтому альбом запрашивается первым,
+    # а исполнитель и его альбомы - параллельно после него
+    album = album_loader.load(album_id, token, market)
+    if album is None:
+        return jsonify({'error': 'Album not found'}), 404
+    album = json.loads(album)
+    
+    page = {'album': album_page(album)}
+    artists = album.get('artists') or []
+    if not artists:
+        page['errors'] = {}
+        return jsonify(page)
+    
+    artist_id = artists[0]['id']
+    sections = {
+        'artist': executor.submit(load_section, artist_loader, artist_id, token),
+        'more_albums': artist_albums_section(executor, artist_id, token, market),
+    }
+    trims = {
+        'artist': artist_summary,
+        'more_albums': lambda data: [album_summary(other) for other in data.get('items') or ()
+                                     if other.get('id') != album_id],
+    }
+    return jsonify(collect_sections(page, sections, trims))
+
+@app.route('/api/volume', methods=['PUT'])
 def set_volume():
     """Устанавливает громкость воспроизведения"""
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    volume = request.json.get('volume', 50)
-    if not isinstance(volume, int) or volume < 0 or volume > 100:
+    volume = (request.get_json(silent=True) or {}).get('volume', 50)
+    if not isinstance(volume, int) or isinstance(volume, bool) or volume < 0 or volume > 100:
         return jsonify({'error': 'Volume must be between 0 and 100'}), 400
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    params = {'volume_percent': volume}
-    
-    response = requests.put(f"{SPOTIFY_API_BASE}/me/player/volume", headers=headers, params=params)
-    
-    if response.status_code in [200, 204]:
-        return jsonify({'success': True, 'volume': volume})
-    else:
-        return jsonify({'error': 'Failed to set volume'}), response.status_code
+    return player_command('volume', volume)
 
-@app.route('/api/shuffle')
+@app.route('/api/shuffle', methods=['PUT'])
 def toggle_shuffle():
     """Переключает режим перемешивания"""
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    state = request.json.get('state', True)
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    params = {'state': state}
-    
-    response = requests.put(f"{SPOTIFY_API_BASE}/me/player/shuffle", headers=headers, params=params)
+    state = (request.get_json(silent=True) or {}).get('state', True)
+    if not isinstance(state, bool):
+        return jsonify({'error': 'Shuffle state must be true or false'}), 400
     
-    if response.status_code in [200, 204]:
-        return jsonify({'success': True, 'shuffle': state})
-    else:
-        return jsonify({'error': 'Failed to toggle shuffle'}), response.status_code
+    return player_command('shuffle', state)
 
-@app.route('/api/repeat')
+@app.route('/api/repeat', methods=['PUT'])
 def set_repeat_mode():
     """Устанавливает режим повтора"""
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    state = request.json.get('state', 'off')  # off, track, context
+    state = (request.get_json(silent=True) or {}).get('state', 'off')  # off, track, context
     if state not in ['off', 'track', 'context']:
         return jsonify({'error': 'Invalid repeat state'}), 400
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    params = {'state': state}
-    
-    response = requests.put(f"{SPOTIFY_API_BASE}/me/player/repeat", headers=headers, params=params)
-    
-    if response.status_code in [200, 204]:
-        return jsonify({'success': True, 'repeat': state})
-    else:
-        return jsonify({'error': 'Failed to set repeat mode'}), response.status_code
+    return player_command('repeat', state)
 
 @app.route('/api/player-state')
 def get_player_state():
@@ -441,11 +1302,11 @@ def get_player_state():
     if 'access_token' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    headers = {'Authorization': f"Bearer {session['access_token']}"}
-    response = requests.get(f"{SPOTIFY_API_BASE}/me/player", headers=headers)
+    shape = shape_for('player_state')
+    response = spotify_api('GET', '/me/player')
     
     if response.status_code == 200:
-        return jsonify(response.json())
+        return json_body(shape.dumps(response.json()))
     else:
         return jsonify({'error': 'Failed to fetch player state'}), response.status_code
 
@@ -455,26 +1316,30 @@ def refresh_access_token():
     if 'refresh_token' not in session:
         return jsonify({'error': 'No refresh token available'}), 400
     
-    token_data = {
-        'grant_type': 'refresh_token',
-        'refresh_token': session['refresh_token'],
-        'client_id': SPOTIFY_CLIENT_ID
-    }
-    
-    response = requests.post(SPOTIFY_TOKEN_URL, data=token_data)
-    
-    if response.status_code == 200:
-        token_info = response.json()
-        
-        # Обновляем токены в сессии
-        session['access_token'] = token_info['access_token']
-        if 'refresh_token' in token_info:
-            session['refresh_token'] = token_info['refresh_token']
-        session['token_expires_at'] = token_info.get('expires_in', 3600)
-        
-        return jsonify({'success': True, 'access_token': token_info['access_token']})
+    token = user_token()
+    if token.refresh():
+        return jsonify({'success': True, 'access_token': token.access_token})
     else:
-        return jsonify({'error': 'Failed to refresh token'}), response.status_code
+        return jsonify({'error': 'Failed to refresh token'}), 400
+
+def is_loopback(address):
+    try:
+        return ipaddress.ip_address(address or '').is_loopback
+    except ValueError:
+        return False
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Метрики всех воркеров в текстовом формате Prometheus
+
+    Без METRICS_TOKEN метрики отдаются только локальным запросам
+    """
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            return jsonify({'error': 'Unauthorized'}), 401
+    elif not is_loopback(request.remote_addr):
+        return jsonify({'error': 'Metrics are available only locally without METRICS_TOKEN'}), 403
+    return Response(render_metrics(worker_metrics.collect()), mimetype='text/plain; version=0.0.4')
 
 @app.route('/logout')
 def logout():
@@ -0,0 +1,343 @@
+"""
+Статика с хэшем содержимого в имени
+Сборка (python assets.py) минифицирует JS и CSS из static/ и пишет файлы вида
+static/dist/js/dashboard.3f2a9c1b7e.js с копиями .gz и .br для gzip_static/brotli_static,
+а также манифест "исходное имя -> собранное". Шаблоны берут адрес через asset_url():
+после деплоя у изменившихся файлов новые имена, а собранные файлы кэшируются навсегда
+"""
+
+import os
+import sys
+import json
+import gzip
+import hashlib
+import logging
+from flask import url_for
+
+try:
+    import brotli
+except ImportError:
+    # Без пакета Brotli собираются только .gz, nginx отдаст их или сожмет сам
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = 'dist'
+ASSETS_MANIFEST = os.getenv('ASSETS_MANIFEST', os.path.join(STATIC_DIR, DIST_DIR, 'manifest.json'))
+HASH_LENGTH = 10
+
+# Знаки, вокруг которых пробелы не нужны
+CSS_TIGHT_AFTER = set('{};,>:(')
+CSS_TIGHT_BEFORE = set('{};,>)!')
+JS_TIGHT = set('{}();,:=')
+# После этих знаков и слов "/" начинает регулярное выражение, а не деление
+JS_REGEX_AFTER = set('(,=:[!&|?{};+-*%<>~^')
+JS_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw'}
+
+
+def _string_end(source, start):
+    """Индекс после строки в кавычках, которая начинается в start"""
+    quote = source[start]
+    position = start + 1
+    while position < len(source):
+        char = source[position]
+        if char == '\\':
+            position += 2
+            continue
+        position += 1
+        if char == quote or char == '\n':
+            break
+    return position
+
+
+def _template_end(source, start):
+    """Индекс после шаблонной строки `...${выражение}...`, вложенные шаблоны учитываются"""
+    position = start + 1
+    while position < len(source):
+        char = source[position]
+        if char == '\\':
+            position += 2
+        elif char == '`':
+            return position + 1
+        elif source.startswith('${', position):
+            position = _expression_end(source, position + 2)
+        else:
+            position += 1
+    return position
+
+
+def _expression_end(source, position):
+    """Индекс после } выражения внутри шаблонной строки"""
+    depth = 0
+    while position < len(source):
+        char = source[position]
+        if char in '"\'':
+            position = _string_end(source, position)
+        elif char == '`':
+            position = _template_end(source, position)
+        elif char == '{':
+            depth += 1
+            position += 1
+        elif char == '}':
+            if depth == 0:
+                return position + 1
+            depth -= 1
+            position += 1
+        else:
+            position += 1
+    return position
+
+
+def _regex_end(source, start):
+    """Индекс после литерала /.../флаги"""
+    position = start + 1
+    in_class = False
+    while position < len(source) and source[position] != '\n':
+        char = source[position]
+        if char == '\\':
+            position += 2
+            continue
+        position += 1
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            break
+    while position < len(source) and (source[position].isalnum() or source[position] == '_'):
+        position += 1
+    return position
+
+
+def minify_css(source):
+    """Убирает комментарии и лишние пробелы; строки не трогает"""
+    out = []
+    space = False
+    position = 0
+    while position < len(source):
+        char = source[position]
+        if source.startswith('/*', position):
+            end = source.find('*/', position + 2)
+            position = len(source) if end < 0 else end + 2
+            space = True
+            continue
+        if char.isspace():
+            space = True
+            position += 1
+            continue
+        if char in '"\'':
+            end = _string_end(source, position)
+            token = source[position:end]
+            position = end
+        else:
+            token = char
+            position += 1
+        if token == '}' and out and out[-1] == ';':
+            out.pop()
+        if space and out and out[-1][-1] not in CSS_TIGHT_AFTER and token[0] not in CSS_TIGHT_BEFORE:
+            out.append(' ')
+        out.append(token)
+        space = False
+    return ''.join(out)
+
+
+def minify_js(source):
+    """Консервативная минификация: комментарии, отступы, пустые строки и пробелы у скобок
+
+    Переводы строк сохраняются, поэтому автоматическая расстановка точек с запятой
+    работает как в исходнике; строки, шаблоны и регулярные выражения копируются как есть
+    """
+    lines = []
+    line = []
+    space = False
+    position = 0
+
+    def last_token():
+        # Последний значимый символ или слово - чтобы отличить регулярное выражение от деления
+        if line:
+            text = ''.join(line).rstrip()
+        elif lines:
+            text = lines[-1]
+        else:
+            return ''
+        word = len(text)
+        while word > 0 and (text[word - 1].isalnum() or text[word - 1] in '_$'):
+            word -= 1
+        return text[word:] if word < len(text) else text[-1:]
+
+    def emit(token):
+        nonlocal space
+        if space and line and line[-1][-1] not in JS_TIGHT and token[0] not in JS_TIGHT:
+            line.append(' ')
+        line.append(token)
+        space = False
+
+    while position < len(source):
+        char = source[position]
+        if char == '\n':
+            text = ''.join(line).strip()
+            if text:
+                lines.append(text)
+            line = []
+            space = False
+            position += 1
+        elif char in ' \t\r':
+            space = True
+            position += 1
+        elif source.startswith('//', position):
+            end = source.find('\n', position)
+            position = len(source) if end < 0 else end
+        elif source.startswith('/*', position):
+            end = source.find('*/', position + 2)
+            end = len(source) if end < 0 else end + 2
+            if '\n' in source[position:end]:
+                # Многострочный комментарий разделяет строки, как и перевод строки
+                text = ''.join(line).strip()
+                if text:
+                    lines.append(text)
+                line = []
+                space = False
+            else:
+                space = True
+            position = end
+        elif char in '"\'':
+            end = _string_end(source, position)
+            emit(source[position:end])
+            position = end
+        elif char == '`':
+            end = _template_end(source, position)
+            emit(source[position:end])
+            position = end
+        elif char == '/':
+            previous = last_token()
+            if not previous or previous in JS_REGEX_AFTER or previous in JS_REGEX_KEYWORDS:
+                end = _regex_end(source, position)
+                emit(source[position:end])
+                position = end
+            else:
+                emit(char)
+                position += 1
+        else:
+            emit(char)
+            position += 1
+    text = ''.join(line).strip()
+    if text:
+        lines.append(text)
+    return '\n'.join(lines) + '\n'
+
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+
+def _variants(path):
+    return [path, path + '.gz', path + '.br']
+
+
+def build(static_dir=STATIC_DIR, manifest_path=ASSETS_MANIFEST):
+    """Собирает статику, возвращает {исходное имя: (собранное имя, байт исходника, мин., gz, br)}"""
+    dist = os.path.join(static_dir, DIST_DIR)
+    try:
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            previous = json.load(manifest_file)
+    except (OSError, ValueError):
+        previous = {}
+
+    report = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(name for name in dirs if os.path.join(root, name) != dist)
+        for name in sorted(files):
+            minify = MINIFIERS.get(os.path.splitext(name)[1])
+            if minify is None:
+                continue
+            source_path = os.path.join(root, name)
+            relative = os.path.relpath(source_path, static_dir).replace(os.sep, '/')
+            with open(source_path, encoding='utf-8') as source_file:
+                source = source_file.read()
+            data = minify(source).encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+            stem, extension = os.path.splitext(relative)
+            built = f'{DIST_DIR}/{stem}.{digest}{extension}'
+            built_path = os.path.join(static_dir, built)
+            os.makedirs(os.path.dirname(built_path), exist_ok=True)
+            compressed = gzip.compress(data, 9, mtime=0)
+            variants = [(built_path, data), (built_path + '.gz', compressed)]
+            if brotli is not None:
+                variants.append((built_path + '.br', brotli.compress(data, quality=11)))
+            for path, content in variants:
+                with open(path, 'wb') as output:
+                    output.write(content)
+            report[relative] = (built, len(source.encode('utf-8')), len(data), len(compressed),
+                                len(variants[2][1]) if len(variants) > 2 else None)
+
+    manifest = {relative: entry[0] for relative, entry in report.items()}
+    temporary = manifest_path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temporary, manifest_path)
+
+    # Файлы прошлой сборки остаются: страницы, открытые до деплоя, ссылаются на них
+    keep = {os.path.join(static_dir, path) for path in list(manifest.values()) + list(previous.values())}
+    keep = {variant for path in keep for variant in _variants(path)}
+    for root, _, files in os.walk(dist):
+        for name in files:
+            path = os.path.join(root, name)
+            if path not in keep and path != manifest_path:
+                os.remove(path)
+    return report
+
+
+class AssetManifest:
+    """Манифест сборки, читается один раз при старте приложения
+
+    Без манифеста (разработка без сборки) asset_url отдает исходные файлы.
+    Если исходник новее собранного файла, тоже отдается исходник: правка без
+    пересборки видна сразу, а не теряется за старым хэшем
+    """
+
+    def __init__(self, path=ASSETS_MANIFEST, static_dir=STATIC_DIR):
+        self.path = path
+        self.static_dir = static_dir
+        self.entries = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as manifest_file:
+                manifest = json.load(manifest_file)
+        except OSError:
+            return {}
+        except ValueError:
+            logger.warning('Asset manifest %s is not valid JSON, serving source files', self.path)
+            return {}
+        entries = {}
+        for source, built in manifest.items():
+            try:
+                stale = (os.path.getmtime(os.path.join(self.static_dir, source)) >
+                         os.path.getmtime(os.path.join(self.static_dir, built)))
+            except OSError:
+                continue
+            if stale:
+                logger.warning('Asset %s changed after the build, serving the source file', source)
+                continue
+            entries[source] = built
+        return entries
+
+    def url(self, filename):
+        """URL статики для шаблонов: собранный файл с хэшем или исходный"""
+        return url_for('static', filename=self.entries.get(filename, filename))
+
+
+asset_manifest = AssetManifest()
+
+
+def main():
+    report = build()
+    print(f"{'файл':<24} {'исходник':>9} {'мин.':>9} {'gzip':>9} {'brotli':>9}")
+    for relative, (built, source, minified, gzipped, brotlied) in sorted(report.items()):
+        print(f"{relative:<24} {source:>9} {minified:>9} {gzipped:>9} {brotlied if brotlied else '-':>9}  {built}")
+    if brotli is None:
+        print('Пакет Brotli не установлен: файлы .br не собраны', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
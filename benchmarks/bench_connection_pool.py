@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк: новый requests.get на каждый запрос против общего пула SpotifyClient
+Запуск: python benchmarks/bench_connection_pool.py --tls --handshake-delay-ms 20
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spotify_client import SpotifyClient
+from benchmarks.fake_spotify import start_server
+
+
+def measure(label, call, count):
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = call()
+        response.raise_for_status()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<28} p50={statistics.median(timings):7.2f} мс  "
+          f"p95={p95:7.2f} мс  всего={sum(timings):8.1f} мс")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Экономия на рукопожатиях за счет пула соединений')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--handshake-delay-ms', type=float, default=20.0,
+                        help='Эмулируемая стоимость нового соединения до api.spotify.com')
+    parser.add_argument('--tls', action='store_true', help='Использовать настоящий TLS')
+    args = parser.parse_args()
+
+    server, certfile = start_server(handshake_delay=args.handshake_delay_ms / 1000, tls=args.tls)
+    verify = certfile if certfile else True
+    url = f"{server.base_url}/me"
+    print(f"Заглушка: {server.base_url}, запросов: {args.requests}\n")
+
+    before = server.connections
+    measure('requests.get (без пула)',
+            lambda: requests.get(url, headers={'Authorization': 'Bearer bench'}, verify=verify),
+            args.requests)
+    fresh_connections = server.connections - before
+
+    client = SpotifyClient(base_url=server.base_url)
+    before = server.connections
+    measure('SpotifyClient (пул)', lambda: client.get('/me', access_token='bench', verify=verify), args.requests)
+    pooled_connections = server.connections - before
+
+    print(f"\nНовых соединений: без пула={fresh_connections}, с пулом={pooled_connections}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк: размер ответа и CPU на запрос с проекцией полей и без нее
+Ответы Spotify в заглушке полные (рынки, внешние ссылки, три обложки);
+"полный" - fields=*, то есть ответ как раньше, "проекция" - форма по умолчанию
+Запуск: python benchmarks/bench_projection.py --requests 200
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_spotify import start_server
+
+ENDPOINTS = [
+    '/api/profile',
+    '/api/playlists',
+    '/api/liked-tracks',
+    '/api/recommendations',
+    '/api/search?q=track',
+    '/api/album/4aawyAB9vmqN3uQ7FjRGTy',
+    '/api/artists?ids=' + ','.join(f'{i:022d}' for i in range(20)),
+    '/api/playlist/bench',
+    '/api/player-state',
+    '/api/bootstrap',
+]
+
+
+def measure(client, url, requests_count):
+    """(байт в ответе, мкс CPU сервера на запрос, мкс на разбор JSON клиентом) при прогретых кэшах"""
+    response = client.get(url)
+    assert response.status_code == 200, (url, response.status_code, response.data[:200])
+    body = response.data
+    started = time.process_time()
+    for _ in range(requests_count):
+        client.get(url).data
+    server_cpu = (time.process_time() - started) / requests_count * 1e6
+    started = time.process_time()
+    for _ in range(requests_count):
+        json.loads(body)
+    parse_cpu = (time.process_time() - started) / requests_count * 1e6
+    return len(body), server_cpu, parse_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Байты и CPU на запрос с проекцией полей')
+    parser.add_argument('--requests', type=int, default=200, help='запросов на эндпоинт и режим')
+    args = parser.parse_args()
+
+    server, _ = start_server()
+    server.library_size = 300
+    os.environ.update(SPOTIFY_API_BASE=server.base_url, GOATMUSIC_DATA_DIR=tempfile.mkdtemp(),
+                      SPOTIFY_APP_RATE='100000', SPOTIFY_APP_BURST='100000',
+                      SPOTIFY_USER_RATE='100000', SPOTIFY_USER_BURST='100000')
+    import app as goatmusic
+
+    client = goatmusic.app.test_client()
+    with client.session_transaction() as session:
+        session.update(access_token='bench', refresh_token='bench', token_expires_at=time.time() + 3600,
+                       user_id='bench-user', country='SE')
+
+    print(f"{'эндпоинт':<24} {'байт':>17} {'CPU сервера, мкс':>18} {'разбор JSON, мкс':>18}")
+    print(f"{'':<24} {'полный':>8} {'проекц.':>8} {'полный':>9} {'проекц.':>8} {'полный':>9} {'проекц.':>8}")
+    totals = [0] * 6
+    for url in ENDPOINTS:
+        separator = '&' if '?' in url else '?'
+        full = measure(client, f'{url}{separator}fields=*', args.requests)
+        slim = measure(client, url, args.requests)
+        row = [full[0], slim[0], full[1], slim[1], full[2], slim[2]]
+        totals = [total + value for total, value in zip(totals, row)]
+        name = url.split('?')[0][:24]
+        print(f"{name:<24} {row[0]:>8} {row[1]:>8} {row[2]:>9.0f} {row[3]:>8.0f} {row[4]:>9.0f} {row[5]:>8.0f}")
+    print(f"{'всего':<24} {totals[0]:>8} {totals[1]:>8} {totals[2]:>9.0f} {totals[3]:>8.0f} "
+          f"{totals[4]:>9.0f} {totals[5]:>8.0f}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк: построение локального поискового индекса и задержка запросов
+Библиотека из синтетических треков, добавляемых страницами по 50, как из Spotify
+Запуск: python benchmarks/bench_search_index.py --tracks 10000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import LibraryIndex
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ne', 'to', 'su', 'vi', 'da', 'bel', 'mor', 'sta', 'lin', 'gre', 'xo']
+
+
+def word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def title(rng, words):
+    return ' '.join(word(rng).capitalize() for _ in range(rng.randint(1, words)))
+
+
+def make_library(count, seed=1):
+    """Страницы /me/tracks: треки ссылаются на общий набор исполнителей и альбомов"""
+    rng = random.Random(seed)
+    artists = [{'id': f'artist{i}', 'name': title(rng, 2), 'uri': f'spotify:artist:artist{i}'}
+               for i in range(max(count // 5, 1))]
+    albums = []
+    for i in range(max(count // 3, 1)):
+        albums.append({'id': f'album{i}', 'name': title(rng, 3), 'uri': f'spotify:album:album{i}',
+                       'artists': [rng.choice(artists)], 'release_date': '2020-01-01',
+                       'images': [{'url': f'https://i.scdn.co/image/{i}'}]})
+    items = []
+    for i in range(count):
+        album = rng.choice(albums)
+        items.append({'track': {'id': f'track{i}', 'name': title(rng, 4), 'uri': f'spotify:track:track{i}',
+                                'type': 'track', 'duration_ms': 200000, 'album': album,
+                                'artists': album['artists'] + rng.sample(artists, rng.randint(0, 1))}})
+    pages = [items[start:start + 50] for start in range(0, count, 50)]
+    return pages, rng
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный поисковый индекс библиотеки')
+    parser.add_argument('--tracks', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    pages, rng = make_library(args.tracks)
+
+    index = LibraryIndex()
+    started = time.perf_counter()
+    for page in pages:
+        index.add_items(page)
+    build = time.perf_counter() - started
+
+    # Память меряем отдельным построением: tracemalloc замедляет его в разы
+    tracemalloc.start()
+    measured = LibraryIndex()
+    for page in pages:
+        measured.add_items(page)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del measured
+
+    print(f"Треков: {args.tracks}, документов: {len(index)}, токенов: {len(index.postings)}")
+    print(f"Построение: {build * 1000:.1f} мс ({build / len(pages) * 1000:.2f} мс на страницу из 50), "
+          f"память индекса ~{memory / 1024 / 1024:.1f} МБ\n")
+
+    # Запросы как при наборе: префиксы реальных названий разной длины
+    names = [item['track']['name'] for page in pages for item in page]
+    for label, length in (('1-2 буквы', 2), ('4 буквы', 4), ('слово', 99), ('два слова', None)):
+        queries = []
+        for _ in range(args.queries):
+            name = rng.choice(names)
+            queries.append(name if length is None else name.split()[0][:length])
+        index.search(queries[0])
+        timings = []
+        found = 0
+        for query in queries:
+            started = time.perf_counter()
+            results = index.search(query)
+            timings.append((time.perf_counter() - started) * 1e6)
+            found += sum(len(items) for items in results.values())
+        timings.sort()
+        print(f"{label:<10} p50={statistics.median(timings):8.1f} мкс  "
+              f"p99={timings[int(len(timings) * 0.99) - 1]:8.1f} мкс  "
+              f"в среднем найдено {found / len(queries):.1f}")
+
+
+if __name__ == '__main__':
+    main()
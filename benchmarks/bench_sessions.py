@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк: накладные расходы сессии на запрос
+Подписанная cookie Flask (все токены в cookie) против серверной сессии
+(ID в cookie, данные в памяти воркера и в общем SQLite)
+Запуск: python benchmarks/bench_sessions.py --requests 5000
+"""
+
+import os
+import sys
+import time
+import secrets
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, session
+from flask.sessions import SecureCookieSessionInterface
+from session_store import SessionStore, ServerSessionInterface
+
+
+def make_app(interface):
+    app = Flask(__name__)
+    app.secret_key = secrets.token_hex(32)
+    app.session_interface = interface
+
+    @app.route('/login')
+    def login():
+        # Типичное содержимое сессии GoatMusic после входа
+        session['code_verifier'] = secrets.token_urlsafe(96)
+        session['access_token'] = 'BQ' + secrets.token_urlsafe(180)
+        session['refresh_token'] = 'AQ' + secrets.token_urlsafe(100)
+        session['token_expires_at'] = time.time() + 3600
+        session['user_id'] = 'bench-user'
+        session['country'] = 'SE'
+        return 'ok'
+
+    @app.route('/read')
+    def read():
+        return session['access_token'][:2]
+
+    @app.route('/refresh')
+    def refresh():
+        # Обновление токена: сессия перезаписывается
+        session['access_token'] = 'BQ' + secrets.token_urlsafe(180)
+        session['token_expires_at'] = time.time() + 3600
+        return 'ok'
+
+    @app.route('/static-like')
+    def static_like():
+        return 'ok'
+
+    return app
+
+
+def per_request(client, url, requests_count):
+    started = time.perf_counter()
+    for _ in range(requests_count):
+        client.get(url)
+    return (time.perf_counter() - started) / requests_count * 1e6
+
+
+def run(name, interface, requests_count):
+    app = make_app(interface)
+    client = app.test_client()
+    client.get('/login')
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+    cookie_bytes = len(cookie.key) + 1 + len(cookie.value)
+
+    baseline = per_request(app.test_client(), '/static-like', requests_count)
+    read = per_request(client, '/read', requests_count) - baseline
+    write = per_request(client, '/refresh', requests_count) - baseline
+    print(f"{name:<30} cookie {cookie_bytes:5d} Б  чтение {read:7.1f} мкс  обновление токена {write:7.1f} мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Накладные расходы сессии на запрос')
+    parser.add_argument('--requests', type=int, default=5000, help='запросов на замер')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='goatmusic-sessions-')
+    print(f"накладные расходы сверх запроса без сессии, {args.requests} запросов на замер")
+    run('cookie (подписанная)', SecureCookieSessionInterface(), args.requests)
+    run('сервер (копия в воркере)', ServerSessionInterface(
+        SessionStore(os.path.join(directory, 'warm.db'))), args.requests)
+    # Копия в памяти не используется: каждый запрос читает общий SQLite, как воркер,
+    # к которому пользователь пришел впервые
+    run('сервер (только SQLite)', ServerSessionInterface(
+        SessionStore(os.path.join(directory, 'cold.db'), local_ttl=0)), args.requests)
+
+
+if __name__ == '__main__':
+    main()
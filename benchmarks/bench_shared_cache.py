@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк: доля попаданий кэша при нескольких воркерах с перезапуском
+Сравнивает кэш в памяти процесса, общий SQLite файл и их комбинацию
+Запуск: python benchmarks/bench_shared_cache.py --workers 17 --max-requests 1000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import MemoryBackend, SQLiteBackend, TieredBackend
+
+PAYLOAD = b'{"id": "artist", "name": "Artist", "genres": ["rock", "indie"]}' * 20
+
+
+def make_backend(name, db_path):
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'sqlite':
+        return SQLiteBackend(db_path)
+    return TieredBackend(MemoryBackend(), SQLiteBackend(db_path))
+
+
+def worker(name, db_path, requests_count, keys, seed, results):
+    """Один воркер gunicorn: обслуживает requests_count запросов и завершается"""
+    backend = make_backend(name, db_path)
+    rng = random.Random(seed)
+    # Популярность ресурсов по закону Ципфа
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(keys)]
+    sample = rng.choices(range(keys), weights=weights, k=requests_count)
+    hits = 0
+    lookup_time = 0.0
+    for rank in sample:
+        key = f"catalog:artist:{rank}"
+        started = time.perf_counter()
+        value = backend.get(key)
+        lookup_time += time.perf_counter() - started
+        if value is None:
+            backend.set(key, PAYLOAD, 3600)
+        else:
+            hits += 1
+    results.put((hits, requests_count, lookup_time))
+
+
+def run(name, workers, max_requests, generations, keys):
+    db_path = os.path.join(tempfile.mkdtemp(prefix='goatmusic-cache-'), 'cache.db')
+    results = multiprocessing.Queue()
+    seed = 0
+    # Каждое поколение - все воркеры после перезапуска по max_requests
+    for _ in range(generations):
+        processes = []
+        for _ in range(workers):
+            seed += 1
+            process = multiprocessing.Process(
+                target=worker, args=(name, db_path, max_requests, keys, seed, results))
+            process.start()
+            processes.append(process)
+        for process in processes:
+            process.join()
+
+    hits = total = 0
+    lookup_time = 0.0
+    for _ in range(workers * generations):
+        worker_hits, worker_total, worker_time = results.get()
+        hits += worker_hits
+        total += worker_total
+        lookup_time += worker_time
+    print(f"{name:<8} попаданий {hits / total:6.1%}  запросов к Spotify {total - hits:7d}  "
+          f"поиск в кэше {lookup_time / total * 1e6:7.1f} мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Попадания кэша при нескольких воркерах')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count() * 2 + 1)
+    parser.add_argument('--max-requests', type=int, default=1000)
+    parser.add_argument('--generations', type=int, default=3, help='Сколько раз воркеры перезапускаются')
+    parser.add_argument('--keys', type=int, default=20000, help='Число различных ресурсов каталога')
+    args = parser.parse_args()
+
+    print(f"Воркеров: {args.workers}, запросов на воркер: {args.max_requests}, "
+          f"перезапусков: {args.generations}\n")
+    for name in ('memory', 'sqlite', 'tiered'):
+        run(name, args.workers, args.max_requests, args.generations, args.keys)
+
+
+if __name__ == '__main__':
+    main()
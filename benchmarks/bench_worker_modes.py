@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк: sync воркеры против async (gevent) воркеров gunicorn
+при медленном Spotify. Один воркер, N одновременных запросов к /api/profile
+Запуск: python benchmarks/bench_worker_modes.py --concurrency 1000 --latency-ms 500
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+from gevent.pool import Pool
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_spotify import start_server
+
+SECRET_KEY = 'bench-secret-key'
+
+
+def session_cookie():
+    """Подписанная cookie сессии Flask с фиктивным токеном"""
+    os.environ['SECRET_KEY'] = SECRET_KEY
+    os.environ['SESSION_BACKEND'] = 'cookie'
+    from app import app
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({'access_token': 'bench'})
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'gunicorn не поднялся на порту {port}')
+
+
+def run_mode(mode, upstream, cookie, concurrency, deadline):
+    port = free_port()
+    # Лимиты планировщика снимаем: сравниваем пропускную способность воркеров
+    env = dict(os.environ, GOATMUSIC_WORKER_MODE=mode, SPOTIFY_API_BASE=upstream,
+               SECRET_KEY=SECRET_KEY, SESSION_BACKEND='cookie',
+               SPOTIFY_APP_RATE='100000', SPOTIFY_APP_BURST='100000',
+               SPOTIFY_USER_RATE='100000', SPOTIFY_USER_BURST='100000')
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--workers', '1',
+         '--bind', f'127.0.0.1:{port}', '--pid', f'/tmp/goatmusic-bench-{mode}.pid',
+         '--max-requests', '0', '--log-level', 'warning', '--access-logfile', '/dev/null', 'wsgi:app'],
+        cwd=ROOT, env=env)
+    try:
+        wait_for_port(port)
+        url = f'http://127.0.0.1:{port}/api/profile'
+        results = []
+
+        def call():
+            try:
+                response = requests.get(url, cookies={'session': cookie}, timeout=deadline)
+                results.append(response.status_code)
+            except requests.RequestException:
+                results.append(None)
+
+        started = time.perf_counter()
+        pool = Pool(concurrency)
+        for _ in range(concurrency):
+            pool.spawn(call)
+        pool.join(timeout=deadline + 5)
+        elapsed = time.perf_counter() - started
+        ok = sum(1 for status in results if status == 200)
+        print(f"{mode:<6} успешно {ok}/{concurrency} за {elapsed:6.2f} с "
+              f"({ok / elapsed:8.1f} запросов/с)")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение режимов воркеров при медленном upstream')
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=500.0)
+    parser.add_argument('--deadline', type=float, default=30.0, help='Таймаут клиента, с')
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args()
+
+    server, _ = start_server(latency=args.latency_ms / 1000)
+    cookie = session_cookie()
+    print(f"Заглушка: {server.base_url}, задержка {args.latency_ms} мс, "
+          f"одновременных запросов: {args.concurrency}\n")
+    for mode in args.modes.split(','):
+        run_mode(mode, server.base_url, cookie, args.concurrency, args.deadline)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
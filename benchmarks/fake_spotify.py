@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка Spotify Web API для бенчмарков
+Отдает фиксированные JSON ответы и умеет эмулировать стоимость
+установки соединения (TCP+TLS рукопожатие до удаленного хоста),
+задержку ответа с разбросом, долю ошибок 5xx и ответы 429 с Retry-After
+
+Токен вида user-N - отдельный пользователь (свой id в /me), остальные
+токены - bench-user. GET /__bench/stats отдает счетчики и журнал запросов
+(время, токен, метод, путь) и очищает журнал
+"""
+
+import os
+import re
+import ssl
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Полные объекты, как их отдает Spotify: рынки, внешние ссылки, три размера обложек
+MARKETS = ['AD', 'AE', 'AR', 'AT', 'AU', 'BE', 'BG', 'BO', 'BR', 'CA', 'CH', 'CL', 'CO', 'CR', 'CY', 'CZ',
+           'DE', 'DK', 'DO', 'EC', 'EE', 'ES', 'FI', 'FR', 'GB', 'GR', 'GT', 'HK', 'HN', 'HU', 'ID', 'IE',
+           'IL', 'IN', 'IS', 'IT', 'JP', 'LI', 'LT', 'LU', 'LV', 'MC', 'MT', 'MX', 'MY', 'NI', 'NL', 'NO',
+           'NZ', 'PA', 'PE', 'PH', 'PL', 'PT', 'PY', 'RO', 'SE', 'SG', 'SK', 'SV', 'TH', 'TR', 'TW', 'US',
+           'UY', 'VN', 'ZA']
+
+
+def _links(kind, entity_id):
+    return {
+        'href': f'https://api.spotify.com/v1/{kind}s/{entity_id}',
+        'external_urls': {'spotify': f'https://open.spotify.com/{kind}/{entity_id}'},
+        'uri': f'spotify:{kind}:{entity_id}',
+        'type': kind,
+    }
+
+
+def _images(entity_id):
+    return [{'url': f'https://i.scdn.co/image/{entity_id}{size}', 'height': size, 'width': size}
+            for size in (640, 300, 64)]
+
+
+def _artist_ref(artist_id):
+    return {'id': artist_id, 'name': f'Artist {artist_id}', **_links('artist', artist_id)}
+
+
+def _album_ref(album_id):
+    return {'id': album_id, 'name': f'Album {album_id}', 'album_type': 'album', 'total_tracks': 10,
+            'release_date': '2020-01-01', 'release_date_precision': 'day', 'images': _images(album_id),
+            'artists': [_artist_ref('artist0')], 'available_markets': MARKETS, **_links('album', album_id)}
+
+
+def _track(i):
+    track_id = f'track{i}'
+    return {
+        'id': track_id,
+        'name': f'Track {i}',
+        'duration_ms': 180000 + i,
+        'explicit': False,
+        'popularity': 50,
+        'disc_number': 1,
+        'track_number': i % 10 + 1,
+        'is_local': False,
+        'preview_url': f'https://p.scdn.co/mp3-preview/{track_id}',
+        'external_ids': {'isrc': f'USRC1{i:07d}'},
+        'available_markets': MARKETS,
+        'artists': [_artist_ref(f'artist{i % 50}')],
+        'album': _album_ref(f'album{i % 20}'),
+        **_links('track', track_id),
+    }
+
+
+def _artist(artist_id):
+    return {'id': artist_id, 'name': f'Artist {artist_id}', 'genres': ['rock'], 'images': _images(artist_id),
+            'popularity': 50, 'followers': {'href': None, 'total': 1000}, **_links('artist', artist_id)}
+
+
+def _album(album_id):
+    album = _album_ref(album_id)
+    album.update({'label': 'Bench Records', 'popularity': 50, 'genres': [],
+                  'copyrights': [{'text': '2020 Bench Records', 'type': 'C'}],
+                  'external_ids': {'upc': '000000000000'},
+                  'tracks': {'items': [_track(i) for i in range(10)], 'total': 10}})
+    return album
+
+
+def _playlist(playlist_id, snapshot_id='bench-snapshot'):
+    return {'id': playlist_id, 'name': f'Playlist {playlist_id}', 'description': '', 'collaborative': False,
+            'public': True, 'snapshot_id': snapshot_id, 'images': _images(playlist_id),
+            'owner': {'id': 'bench-user', 'display_name': 'Bench User', **_links('user', 'bench-user')},
+            'tracks': {'href': f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', 'total': 100},
+            'primary_color': None, **_links('playlist', playlist_id)}
+
+
+RESPONSES = {
+    '/v1/me': {'id': 'bench-user', 'display_name': 'Bench User', 'email': 'bench@example.com', 'country': 'SE',
+               'product': 'premium', 'images': _images('bench-user'), 'followers': {'href': None, 'total': 0},
+               'explicit_content': {'filter_enabled': False, 'filter_locked': False}, **_links('user', 'bench-user')},
+    '/v1/me/playlists': {'items': [_playlist(f'playlist{i}') for i in range(20)], 'total': 20},
+    '/v1/me/player': {'is_playing': True, 'progress_ms': 1000, 'shuffle_state': False, 'repeat_state': 'off',
+                      'device': {'id': 'device0', 'name': 'Bench Speaker', 'type': 'Speaker', 'is_active': True,
+                                 'volume_percent': 50},
+                      'context': None, 'actions': {'disallows': {'resuming': True}}, 'item': _track(1)},
+    '/v1/me/player/currently-playing': {'is_playing': True, 'progress_ms': 1000, 'item': _track(1)},
+    '/v1/me/top/artists': {'items': [_artist(f'artist{i}') for i in range(5)], 'total': 5},
+    '/v1/recommendations': {'tracks': [_track(i) for i in range(200, 220)], 'seeds': []},
+}
+
+# Разделы ответа /search по значениям параметра type
+SEARCH_RESULTS = {
+    'track': ('tracks', [_track(i) for i in range(20)]),
+    'artist': ('artists', [_artist(f'artist{i}') for i in range(20)]),
+    'album': ('albums', [_album_ref(f'album{i}') for i in range(20)]),
+    'playlist': ('playlists', [_playlist(f'playlist{i}') for i in range(20)]),
+}
+
+
+# Пакетные эндпоинты каталога: /artists?ids=..., /albums?ids=...
+CATALOG = {'/v1/artists': ('artists', _artist), '/v1/albums': ('albums', _album)}
+
+# Вложенные ресурсы исполнителя: /artists/{id}/...
+ARTIST_RESOURCES = {
+    'top-tracks': lambda artist_id: {'tracks': [_track(i) for i in range(10)]},
+    'albums': lambda artist_id: {'items': [_album(f'{artist_id}a{i}') for i in range(20)], 'total': 20},
+    'related-artists': lambda artist_id: {'artists': [_artist(f'{artist_id}r{i}') for i in range(20)]},
+}
+ARTIST_RESOURCE_RE = re.compile(r'^/v1/artists/([^/]+)/([a-z-]+)$')
+
+# Постраничные коллекции: размер задается library_size сервера
+PAGED = {
+    re.compile(r'^/v1/me/tracks$'): lambda i: {'added_at': '2024-01-01T00:00:00Z', 'track': _track(i)},
+    re.compile(r'^/v1/playlists/[^/]+/tracks$'): lambda i: {'added_at': '2024-01-01T00:00:00Z', 'track': _track(i)},
+}
+PLAYLIST_RE = re.compile(r'^/v1/playlists/([^/]+)$')
+
+
+def _page(build, query, size):
+    params = parse_qs(query)
+    offset = int(params.get('offset', ['0'])[0])
+    limit = int(params.get('limit', ['20'])[0])
+    items = [build(i) for i in range(offset, min(offset + limit, size))]
+    return {'items': items, 'total': size, 'offset': offset, 'limit': limit}
+
+
+# История прослушиваний: каждые PLAY_SECONDS секунд "проигрывается" следующий из 30 треков
+PLAY_SECONDS = 180
+
+
+def _recently_played(query):
+    """Последние прослушивания, новые первыми; after (мс) - только более поздние"""
+    params = parse_qs(query)
+    limit = int(params.get('limit', ['20'])[0])
+    after = int(params.get('after', ['0'])[0])
+    slot = int(time.time()) // PLAY_SECONDS
+    items = []
+    for i in range(limit):
+        played = (slot - i) * PLAY_SECONDS
+        if played * 1000 <= after:
+            break
+        items.append({'played_at': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(played)),
+                      'track': _track(100 + (slot - i) % 30), 'context': None})
+    cursors = {'after': str(slot * PLAY_SECONDS * 1000),
+               'before': str((slot - len(items) + 1) * PLAY_SECONDS * 1000)} if items else None
+    return {'items': items, 'limit': limit, 'cursors': cursors, 'next': None}
+
+
+def _search(query):
+    types = parse_qs(query).get('type', ['track,artist,album'])[0].split(',')
+    return {SEARCH_RESULTS[kind][0]: {'items': SEARCH_RESULTS[kind][1], 'total': 20}
+            for kind in types if kind in SEARCH_RESULTS}
+
+
+def _profile(token):
+    user_id = token if token.startswith('user-') else 'bench-user'
+    return dict(RESPONSES['/v1/me'], id=user_id, display_name=user_id, **_links('user', user_id))
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов заглушки с поддержкой keep-alive"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeSpotify/1.0'
+    # Заголовки и тело уходят одним сегментом, без задержек Nagle/delayed ACK
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Эмулируем задержку установки нового соединения
+        delay = self.server.handshake_delay
+        if delay:
+            time.sleep(delay)
+        self.server.connections += 1
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _begin(self):
+        """Общая часть обработки: счетчики, журнал, задержка и внедренные сбои
+
+        Возвращает False, если ответ уже отправлен (401, 429 или 5xx)
+        """
+        server = self.server
+        server.requests += 1
+        token = self.token = (self.headers.get('Authorization') or '').replace('Bearer ', '', 1)
+        path = self.path.partition('?')[0]
+        if server.record_calls:
+            server.calls.append((time.time(), token, self.command, path))
+        delay = server.latency + (random.uniform(0, server.jitter) if server.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if token == 'expired':
+            self._send_json(401, {'error': {'status': 401, 'message': 'The access token expired'}})
+            return False
+        if server.throttle_rate and random.random() < server.throttle_rate:
+            server.throttled += 1
+            self._send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                            {'Retry-After': str(server.retry_after)})
+            return False
+        if server.error_rate and random.random() < server.error_rate:
+            server.failed += 1
+            self._send_json(503, {'error': {'status': 503, 'message': 'Service unavailable'}})
+            return False
+        return True
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        if path == '/__bench/stats':
+            self._send_json(200, self.server.stats())
+            return
+        if not self._begin():
+            return
+        for pattern, build in PAGED.items():
+            if pattern.match(path):
+                self._send_json(200, _page(build, query, self.server.library_size))
+                return
+        match = ARTIST_RESOURCE_RE.match(path)
+        if match and match.group(2) in ARTIST_RESOURCES:
+            self._send_json(200, ARTIST_RESOURCES[match.group(2)](match.group(1)))
+            return
+        if path in CATALOG:
+            field, build = CATALOG[path]
+            ids = parse_qs(query).get('ids', [''])[0].split(',')
+            self._send_json(200, {field: [build(entity_id) for entity_id in ids]})
+            return
+        match = PLAYLIST_RE.match(path)
+        if match:
+            self._send_json(200, _playlist(match.group(1), self.server.playlist_snapshot))
+            return
+        if path == '/v1/me/player/recently-played':
+            self._send_json(200, _recently_played(query))
+            return
+        if path == '/v1/search':
+            self._send_json(200, _search(query))
+            return
+        if path == '/v1/me':
+            self._send_json(200, _profile(self.token))
+            return
+        payload = RESPONSES.get(path)
+        if payload is None:
+            self._send_json(404, {'error': {'status': 404, 'message': 'Not found'}})
+        else:
+            self._send_json(200, payload)
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.startswith('/api/token'):
+            # Эндпоинт токенов (accounts) сбоев не внедряет: их обработка - отдельная история
+            self.server.requests += 1
+            self.server.token_requests += 1
+            self._send_json(200, {'access_token': f'fresh-{self.server.token_requests}',
+                                  'token_type': 'Bearer', 'expires_in': 3600,
+                                  'refresh_token': 'bench-refresh'})
+            return
+        if not self._begin():
+            return
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_POST = do_PUT
+
+
+class FakeSpotifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    request_queue_size = 4096
+
+    def __init__(self, address, handshake_delay=0.0, certfile=None, keyfile=None, latency=0.0,
+                 jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1):
+        super().__init__(address, FakeSpotifyHandler)
+        self.handshake_delay = handshake_delay
+        self.latency = latency
+        # Случайная добавка к задержке (0..jitter с), доли ответов 5xx и 429
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.throttled = 0
+        self.failed = 0
+        # Журнал запросов к API для подсчета вызовов Spotify на действие пользователя
+        self.record_calls = False
+        self.calls = []
+        self.library_size = 20
+        self.playlist_snapshot = 'snapshot-1'
+        self.connections = 0
+        self.requests = 0
+        self.token_requests = 0
+        self.scheme = 'http'
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.scheme = 'https'
+
+    def stats(self):
+        """Счетчики и журнал запросов; журнал очищается"""
+        calls, self.calls = self.calls, []
+        return {'requests': self.requests, 'token_requests': self.token_requests, 'connections': self.connections,
+                'throttled': self.throttled, 'failed': self.failed, 'calls': calls}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'{self.scheme}://{host}:{port}/v1'
+
+    @property
+    def token_url(self):
+        host, port = self.server_address[:2]
+        return f'{self.scheme}://{host}:{port}/api/token'
+
+
+def generate_self_signed_cert(directory):
+    """Создает самоподписанный сертификат для localhost через openssl"""
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+        '-keyout', keyfile, '-out', certfile, '-days', '1',
+        '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+    ], check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def start_server(host='127.0.0.1', port=0, handshake_delay=0.0, tls=False, latency=0.0, **faults):
+    """Запускает заглушку в фоновом потоке, возвращает (server, certfile)
+
+    faults - jitter, error_rate, throttle_rate, retry_after (см. FakeSpotifyServer)
+    """
+    certfile = keyfile = None
+    if tls:
+        certfile, keyfile = generate_self_signed_cert(tempfile.mkdtemp(prefix='fake-spotify-'))
+    server = FakeSpotifyServer((host, port), handshake_delay, certfile, keyfile, latency, **faults)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, certfile
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная заглушка Spotify API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--handshake-delay-ms', type=float, default=0.0)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Задержка ответа на каждый запрос')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Случайная добавка к задержке, до N мс')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Доля ответов 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After в ответах 429, с')
+    parser.add_argument('--record-calls', action='store_true', help='Вести журнал запросов для /__bench/stats')
+    parser.add_argument('--tls', action='store_true')
+    args = parser.parse_args()
+
+    server, certfile = start_server(args.host, args.port, args.handshake_delay_ms / 1000,
+                                    args.tls, args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                                    error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                                    retry_after=args.retry_after)
+    server.record_calls = args.record_calls
+    print(f"Заглушка Spotify: {server.base_url}")
+    if certfile:
+        print(f"Сертификат: {certfile}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
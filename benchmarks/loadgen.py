@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест: виртуальные пользователи повторяют сессии dashboard
+(первая загрузка, опрос плеера, набор поискового запроса, команды плеера,
+открытие плейлистов и страниц) против gunicorn с заглушкой Spotify вместо API.
+Отчет: p50/p95/p99 по эндпоинтам, запросов в секунду и вызовов Spotify на действие
+Запуск: python benchmarks/loadgen.py --users 50 --duration 30 --configs sync:4,async:2
+Лимиты запросов к Spotify в приложении действуют как в продакшене; чтобы мерить
+только воркеры, их можно поднять: --env SPOTIFY_APP_RATE=1000 --env SPOTIFY_APP_BURST=1000
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import bisect
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SECRET_KEY = 'bench-secret-key'
+
+# Доли действий пользователя после первой загрузки dashboard
+ACTIONS = {'poll': 0.5, 'browse': 0.2, 'search': 0.15, 'player': 0.15}
+SEARCH_QUERIES = ['radiohead', 'daft punk', 'arctic monkeys', 'billie eilish', 'kino', 'massive attack']
+# Пауза между нажатиями клавиш и задержки поиска из dashboard.js
+KEYSTROKE_SECONDS = 0.15
+CATALOG_SEARCH_DEBOUNCE = 0.5
+# Перетаскивание ползунка громкости: шагов и пауза между ними
+VOLUME_DRAG_STEPS = 8
+VOLUME_DRAG_SECONDS = 0.03
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'порт {port} не открылся за {timeout} с')
+
+
+def percentile(values, q):
+    """Перцентиль по рангу из отсортированного списка"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def catalog_id(number):
+    """ID каталога в формате Spotify (22 символа base62)"""
+    return f'{number:022d}'
+
+
+def seed_sessions(data_dir, users):
+    """Серверные сессии пользователей user-N в общем sessions.db; возвращает ID сессий"""
+    from flask.json.tag import TaggedJSONSerializer
+    from session_store import SessionStore
+
+    store = SessionStore(os.path.join(data_dir, 'sessions.db'))
+    serializer = TaggedJSONSerializer()
+    sids = []
+    for number in range(users):
+        sid = f'loadgen-{number}-{os.urandom(8).hex()}'
+        data = {'access_token': f'user-{number}', 'refresh_token': 'bench-refresh',
+                'token_expires_at': time.time() + 3600, 'user_id': f'user-{number}', 'country': 'SE'}
+        store.set(sid, serializer.dumps(data).encode('utf-8'))
+        sids.append(sid)
+    return sids
+
+
+class VirtualUser:
+    """Один пользователь dashboard: действия по очереди с паузами на раздумье"""
+
+    def __init__(self, number, base_url, sid, think, rng, samples, actions):
+        self.number = number
+        self.token = f'user-{number}'
+        self.base_url = base_url
+        self.think = think
+        self.rng = rng
+        self.samples = samples
+        self.actions = actions
+        self.http = requests.Session()
+        self.http.cookies.set('session', sid)
+        # ETag последних ответов, как apiCache в dashboard.js
+        self.etags = {}
+        self.playing = True
+
+    def request(self, endpoint, method, path, **kwargs):
+        headers = {}
+        if method == 'GET' and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, headers=headers, timeout=30, **kwargs)
+            status = response.status_code
+            if method == 'GET' and response.headers.get('ETag'):
+                self.etags[path] = response.headers['ETag']
+        except requests.RequestException:
+            status = None
+        self.samples.append((endpoint, time.perf_counter() - started, status))
+        return status
+
+    def act(self, name):
+        self.actions.append((self.token, time.time(), name))
+        getattr(self, name)()
+
+    def bootstrap(self):
+        self.request('/dashboard', 'GET', '/dashboard')
+        self.request('/api/bootstrap', 'GET', '/api/bootstrap')
+        self.request('/api/recommendations', 'GET', '/api/recommendations')
+
+    def poll(self):
+        self.request('/api/currently-playing', 'GET', '/api/currently-playing')
+
+    def search(self):
+        query = self.rng.choice(SEARCH_QUERIES)
+        # Поиск по библиотеке - на каждое нажатие, по каталогу - после паузы в наборе
+        for length in range(1, len(query) + 1):
+            time.sleep(KEYSTROKE_SECONDS)
+            if length >= 2:
+                self.request('/api/search?scope=library', 'GET',
+                             f'/api/search?q={query[:length]}&scope=library')
+        time.sleep(CATALOG_SEARCH_DEBOUNCE)
+        self.request('/api/search', 'GET', f'/api/search?q={query}')
+
+    def player(self):
+        command = self.rng.choice(['toggle', 'next', 'volume', 'shuffle'])
+        if command == 'toggle':
+            self.request('/api/pause' if self.playing else '/api/play', 'PUT',
+                         '/api/pause' if self.playing else '/api/play')
+            self.playing = not self.playing
+        elif command == 'next':
+            self.request('/api/next', 'POST', '/api/next')
+        elif command == 'volume':
+            start = self.rng.randrange(0, 60)
+            for step in range(VOLUME_DRAG_STEPS):
+                self.request('/api/volume', 'PUT', '/api/volume', json={'volume': start + step * 5})
+                time.sleep(VOLUME_DRAG_SECONDS)
+        else:
+            self.request('/api/shuffle', 'PUT', '/api/shuffle', json={'state': self.rng.random() < 0.5})
+
+    def browse(self):
+        page = self.rng.choice(['playlist', 'artist', 'album'])
+        if page == 'playlist':
+            self.request('/api/playlist/<id>', 'GET', f'/api/playlist/playlist{self.rng.randrange(20)}')
+        elif page == 'artist':
+            self.request('/api/page/artist/<id>', 'GET', f'/api/page/artist/{catalog_id(self.rng.randrange(50))}')
+        else:
+            self.request('/api/page/album/<id>', 'GET', f'/api/page/album/{catalog_id(self.rng.randrange(50))}')
+
+    def run(self, deadline):
+        self.act('bootstrap')
+        names, weights = list(ACTIONS), list(ACTIONS.values())
+        while time.time() < deadline:
+            time.sleep(self.think * self.rng.uniform(0.5, 1.5))
+            if time.time() >= deadline:
+                break
+            self.act(self.rng.choices(names, weights)[0])
+
+
+def upstream_per_action(actions, calls):
+    """Вызовы Spotify на действие: вызов относится к последнему действию его пользователя,
+    начатому до вызова (фоновые запросы после действия тоже считаются за ним)"""
+    starts = defaultdict(list)
+    names = defaultdict(list)
+    for token, started, name in sorted(actions, key=lambda action: action[1]):
+        starts[token].append(started)
+        names[token].append(name)
+    counts = defaultdict(int)
+    for called_at, token, _, _ in calls:
+        index = bisect.bisect_right(starts.get(token, ()), called_at) - 1
+        if index >= 0:
+            counts[names[token][index]] += 1
+    totals = defaultdict(int)
+    for _, _, name in actions:
+        totals[name] += 1
+    return {name: (totals[name], counts[name] / totals[name]) for name in totals}
+
+
+def run_config(config, args, upstream_url, stats_url, extra_env):
+    mode, _, workers = config.partition(':')
+    workers = workers or '1'
+    data_dir = tempfile.mkdtemp(prefix='goatmusic-loadgen-')
+    sids = seed_sessions(data_dir, args.users)
+    port = free_port()
+    env = dict(os.environ, GOATMUSIC_WORKER_MODE=mode, GOATMUSIC_DATA_DIR=data_dir, SECRET_KEY=SECRET_KEY,
+               SPOTIFY_API_BASE=upstream_url + '/v1', SPOTIFY_TOKEN_URL=upstream_url + '/api/token',
+               SESSION_BACKEND='server', **extra_env)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--workers', workers,
+         '--bind', f'127.0.0.1:{port}', '--pid', f'/tmp/goatmusic-loadgen-{port}.pid',
+         '--log-level', 'warning', '--access-logfile', '/dev/null', 'wsgi:app'],
+        cwd=ROOT, env=env)
+    try:
+        wait_for_port(port)
+        requests.get(stats_url, timeout=5)  # журнал - только этого прогона
+        samples, actions = [], []
+        deadline = time.time() + args.duration
+        threads = []
+        started = time.perf_counter()
+        for number in range(args.users):
+            user = VirtualUser(number, f'http://127.0.0.1:{port}', sids[number], args.think_ms / 1000,
+                               random.Random(args.seed * 100003 + number), samples, actions)
+            thread = threading.Thread(target=user.run, args=(deadline,), daemon=True)
+            thread.start()
+            threads.append(thread)
+            # Пользователи приходят постепенно, а не одним залпом
+            time.sleep(args.ramp_up / max(args.users, 1))
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        # Отложенные запросы (сверка плеера после команд) успевают попасть в журнал
+        time.sleep(1)
+        upstream = requests.get(stats_url, timeout=30).json()
+    finally:
+        proc.terminate()
+        proc.wait()
+    return report(config, args, samples, actions, upstream, elapsed)
+
+
+def report(config, args, samples, actions, upstream, elapsed):
+    by_endpoint = defaultdict(list)
+    errors = defaultdict(int)
+    throttled = defaultdict(int)
+    for endpoint, latency, status in samples:
+        by_endpoint[endpoint].append(latency * 1000)
+        if status == 429:
+            # Лимиты планировщика приложения (SPOTIFY_APP_RATE и др.), а не сбой
+            throttled[endpoint] += 1
+        elif status is None or status >= 400:
+            errors[endpoint] += 1
+    result = {
+        'config': config, 'users': args.users, 'duration': round(elapsed, 2),
+        'requests': len(samples), 'rps': round(len(samples) / elapsed, 1),
+        'upstream_requests': len(upstream['calls']), 'upstream_throttled': upstream['throttled'],
+        'upstream_failed': upstream['failed'], 'endpoints': {}, 'actions': {},
+    }
+    print(f"\n== {config}: {args.users} пользователей, {elapsed:.1f} с, {len(samples)} запросов, "
+          f"{result['rps']} запросов/с")
+    print(f"{'эндпоинт':<26} {'запросов':>8} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} {'429':>5} {'ошибок':>7}")
+    for endpoint in sorted(by_endpoint):
+        values = sorted(by_endpoint[endpoint])
+        row = {'count': len(values), 'p50': round(percentile(values, 50), 1),
+               'p95': round(percentile(values, 95), 1), 'p99': round(percentile(values, 99), 1),
+               'throttled': throttled[endpoint], 'errors': errors[endpoint]}
+        result['endpoints'][endpoint] = row
+        print(f"{endpoint:<26} {row['count']:>8} {row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f} "
+              f"{row['throttled']:>5} {row['errors']:>7}")
+    print(f"\n{'действие':<26} {'раз':>8} {'вызовов Spotify на действие':>28}")
+    for name, (count, per_action) in sorted(upstream_per_action(actions, upstream['calls']).items()):
+        result['actions'][name] = {'count': count, 'upstream_per_action': round(per_action, 2)}
+        print(f"{name:<26} {count:>8} {per_action:>28.2f}")
+    print(f"Spotify: {result['upstream_requests']} запросов, из них 429: {upstream['throttled']}, "
+          f"5xx: {upstream['failed']}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест dashboard с заглушкой Spotify')
+    parser.add_argument('--users', type=int, default=50, help='виртуальных пользователей')
+    parser.add_argument('--duration', type=float, default=30.0, help='длительность прогона, с')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='за сколько секунд приходят все пользователи')
+    parser.add_argument('--think-ms', type=float, default=1000.0, help='средняя пауза между действиями')
+    parser.add_argument('--configs', default='sync:4', help='режим:воркеров через запятую, например sync:4,async:2')
+    parser.add_argument('--latency-ms', type=float, default=80.0, help='задержка ответа Spotify')
+    parser.add_argument('--jitter-ms', type=float, default=40.0, help='случайная добавка к задержке')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503 от Spotify')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='доля ответов 429 от Spotify')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After в ответах 429, с')
+    parser.add_argument('--env', action='append', default=[], help='KEY=VALUE для gunicorn (можно повторять)')
+    parser.add_argument('--seed', type=int, default=1, help='зерно случайных сценариев')
+    parser.add_argument('--output', help='сохранить отчет в JSON для сравнения прогонов')
+    args = parser.parse_args()
+
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    upstream_port = free_port()
+    upstream = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'benchmarks', 'fake_spotify.py'), '--port', str(upstream_port),
+         '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+         '--error-rate', str(args.error_rate), '--throttle-rate', str(args.throttle_rate),
+         '--retry-after', str(args.retry_after), '--record-calls'],
+        stdout=subprocess.DEVNULL)
+    upstream_url = f'http://127.0.0.1:{upstream_port}'
+    try:
+        wait_for_port(upstream_port)
+        print(f"Заглушка Spotify: задержка {args.latency_ms:g}+{args.jitter_ms:g} мс, "
+              f"503: {args.error_rate:g}, 429: {args.throttle_rate:g}")
+        results = [run_config(config, args, upstream_url, upstream_url + '/__bench/stats', extra_env)
+                   for config in args.configs.split(',')]
+    finally:
+        upstream.terminate()
+        upstream.wait()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
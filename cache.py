@@ -0,0 +1,284 @@
+"""
+Кэш ответов Spotify API
+Политики TTL по типам ресурсов, LRU в памяти процесса
+и общий для всех воркеров бэкенд на SQLite
+"""
+
+import os
+import time
+import random
+import threading
+from collections import OrderedDict, namedtuple
+from storage import DATA_DIR, SQLiteDatabase
+
+# memory - только память процесса, sqlite - общий файл,
+# tiered - небольшой LRU в памяти поверх общего файла
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'tiered')
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+CACHE_SHARED_MAX_BYTES = int(os.getenv('CACHE_SHARED_MAX_BYTES', str(512 * 1024 * 1024)))
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', os.path.join(DATA_DIR, 'cache.db'))
+# Сколько секунд запись из общего кэша живет в памяти воркера
+CACHE_LOCAL_TTL = int(os.getenv('CACHE_LOCAL_TTL', '30'))
+# Сколько ответ хранится после истечения TTL как последний удачный -
+# его отдают, пока Spotify недоступен
+CACHE_STALE_TTL = int(os.getenv('CACHE_STALE_TTL', str(24 * 3600)))
+
+# scope 'catalog' - общий для всех пользователей ключ по ID,
+# scope 'user' - отдельная запись на каждого пользователя.
+# stale_ttl - сколько хранить ответ после TTL (None - CACHE_STALE_TTL)
+CachePolicy = namedtuple('CachePolicy', ['ttl', 'scope', 'stale_ttl'], defaults=(None,))
+
+CACHE_POLICIES = {
+    # Каталог: альбомы и исполнители почти не меняются
+    'artist': CachePolicy(ttl=24 * 3600, scope='catalog'),
+    'album': CachePolicy(ttl=24 * 3600, scope='catalog'),
+    'artist_top_tracks': CachePolicy(ttl=6 * 3600, scope='catalog'),
+    'artist_albums': CachePolicy(ttl=6 * 3600, scope='catalog'),
+    'related_artists': CachePolicy(ttl=24 * 3600, scope='catalog'),
+    # Метаданные плейлиста со snapshot_id (треки - в playlist_store). Плейлист
+    # может быть приватным, поэтому запись у каждого пользователя своя
+    'playlist': CachePolicy(ttl=30, scope='user'),
+    # Библиотека пользователя
+    'profile': CachePolicy(ttl=10 * 60, scope='user'),
+    'playlists': CachePolicy(ttl=60, scope='user'),
+    'liked_tracks': CachePolicy(ttl=60, scope='user'),
+    'recently_played': CachePolicy(ttl=30, scope='user'),
+    # Текущий трек для первой отрисовки: прогрев после входа успевает к bootstrap,
+    # а дальше состояние приходит в поток плеера. Старое состояние плеера
+    # хуже, чем никакого, поэтому устаревшим оно не отдается
+    'currently_playing': CachePolicy(ttl=5, scope='user', stale_ttl=0),
+    # Поиск: популярные запросы стоят один запрос к Spotify за окно TTL
+    'search': CachePolicy(ttl=int(os.getenv('SEARCH_CACHE_TTL', '120')), scope='catalog'),
+}
+
+
+def cache_key(resource, ident, user_id=None):
+    """Ключ кэша с учетом области видимости ресурса"""
+    if CACHE_POLICIES[resource].scope == 'user':
+        return f"user:{user_id}:{resource}:{ident}"
+    return f"catalog:{resource}:{ident}"
+
+
+class MemoryBackend:
+    """LRU в памяти процесса, ограниченный суммарным размером значений"""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.get_with_expiry(key)[0]
+
+    def get_with_expiry(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None, None
+            evict_at, value, expires_at = entry
+            if evict_at < time.time():
+                del self._data[key]
+                self.size -= len(value)
+                return None, None
+            self._data.move_to_end(key)
+            return value, expires_at
+
+    def set(self, key, value, ttl, expires_at=None):
+        """expires_at - срок жизни исходной записи, если здесь хранится ее копия на ttl секунд"""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            evict_at = time.time() + ttl
+            self._data[key] = (evict_at, value, expires_at or evict_at)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, (_, evicted, _) = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[1])
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteBackend:
+    """Общий кэш всех воркеров в файле SQLite (WAL)
+
+    Вытеснение приблизительное LRU: время доступа обновляется не чаще
+    раза в TOUCH_INTERVAL секунд, а проверка размера выполняется
+    примерно на каждой EVICT_EVERY записи
+    """
+
+    TOUCH_INTERVAL = 60
+    EVICT_EVERY = 64
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at);
+    """
+
+    def __init__(self, path=CACHE_DB_PATH, max_bytes=CACHE_SHARED_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.db = SQLiteDatabase(path, self.SCHEMA)
+
+    def get(self, key):
+        return self.get_with_expiry(key)[0]
+
+    def get_with_expiry(self, key):
+        row = self.db.execute(
+            'SELECT value, expires_at, accessed_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None, None
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at < now:
+            return None, None
+        if now - accessed_at > self.TOUCH_INTERVAL:
+            self.db.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return value, expires_at
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        self.db.execute(
+            'INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+            (key, value, len(value), now + ttl, now))
+        if random.randrange(self.EVICT_EVERY) == 0:
+            self.evict()
+
+    def delete(self, key):
+        self.db.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def evict(self):
+        """Удаляет просроченные записи и самые давние, пока размер выше лимита"""
+        self.db.execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        keys = []
+        for key, size in self.db.execute('SELECT key, size FROM cache ORDER BY accessed_at'):
+            keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self.db.connection().executemany('DELETE FROM cache WHERE key = ?', keys)
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+class TieredBackend:
+    """LRU в памяти воркера поверх общего кэша"""
+
+    def __init__(self, local, shared, local_ttl=CACHE_LOCAL_TTL):
+        self.local = local
+        self.shared = shared
+        self.local_ttl = local_ttl
+
+    def get(self, key):
+        return self.get_with_expiry(key)[0]
+
+    def get_with_expiry(self, key):
+        value, expires_at = self.local.get_with_expiry(key)
+        if value is not None:
+            return value, expires_at
+        value, expires_at = self.shared.get_with_expiry(key)
+        if value is not None:
+            self.local.set(key, value, min(self.local_ttl, expires_at - time.time()), expires_at)
+        return value, expires_at
+
+    def set(self, key, value, ttl):
+        self.shared.set(key, value, ttl)
+        self.local.set(key, value, min(self.local_ttl, ttl), time.time() + ttl)
+
+    def delete(self, key):
+        self.shared.delete(key)
+        self.local.delete(key)
+
+    def __len__(self):
+        return len(self.shared)
+
+
+def create_backend(name=CACHE_BACKEND):
+    """Бэкенд кэша по имени из настроек"""
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'sqlite':
+        return SQLiteBackend()
+    if name == 'tiered':
+        return TieredBackend(MemoryBackend(), SQLiteBackend())
+    raise ValueError(f"Unknown cache backend: {name}")
+
+
+class ResponseCache:
+    """Кэш тел ответов (bytes) со счетчиками попаданий по ресурсам
+
+    Записи живут дольше TTL на stale_ttl политики (по умолчанию общий stale_ttl):
+    свежими они считаются только в пределах TTL, а после - доступны через
+    get_stale как последний удачный ответ
+    """
+
+    def __init__(self, backend, stale_ttl=CACHE_STALE_TTL):
+        self.backend = backend
+        self.stale_ttl = stale_ttl
+        self.hits = {}
+        self.misses = {}
+        self.stale = {}
+        self._lock = threading.Lock()
+
+    def _count(self, counters, resource):
+        with self._lock:
+            counters[resource] = counters.get(resource, 0) + 1
+
+    def stale_ttl_for(self, resource):
+        stale_ttl = CACHE_POLICIES[resource].stale_ttl
+        return self.stale_ttl if stale_ttl is None else stale_ttl
+
+    def get(self, resource, key):
+        value, expires_at = self.backend.get_with_expiry(key)
+        if value is not None and expires_at - self.stale_ttl_for(resource) < time.time():
+            value = None
+        self._count(self.misses if value is None else self.hits, resource)
+        return value
+
+    def get_stale(self, resource, key):
+        """Последний удачный ответ, даже если его TTL уже истек"""
+        value = self.backend.get(key)
+        if value is not None:
+            self._count(self.stale, resource)
+        return value
+
+    def set(self, resource, key, value):
+        self.backend.set(key, value, CACHE_POLICIES[resource].ttl + self.stale_ttl_for(resource))
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def stats(self):
+        """Попадания, промахи и устаревшие ответы по каждому ресурсу"""
+        resources = set(self.hits) | set(self.misses) | set(self.stale)
+        return {
+            resource: {'hits': self.hits.get(resource, 0), 'misses': self.misses.get(resource, 0),
+                       'stale': self.stale.get(resource, 0)}
+            for resource in sorted(resources)
+        }
+
+
+response_cache = ResponseCache(create_backend())
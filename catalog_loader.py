@@ -0,0 +1,141 @@
+"""
+Пакетная загрузка каталога Spotify (в духе DataLoader)
+ID исполнителей и альбомов, запрошенные в течение короткого окна любыми
+запросами воркера, собираются в один вызов /artists?ids= или /albums?ids=
+"""
+
+import os
+import json
+import threading
+from concurrent.futures import Future
+import requests
+from spotify_client import get_client
+from cache import response_cache, cache_key
+from scheduler import RateLimited
+
+# Сколько миллисекунд ждать других ID перед отправкой пакета
+CATALOG_BATCH_WINDOW_MS = float(os.getenv('CATALOG_BATCH_WINDOW_MS', '5'))
+
+
+class _Batch:
+    def __init__(self, token, market):
+        self.token = token
+        self.market = market
+        self.futures = {}
+        self.sent = False
+
+
+class CatalogLoader:
+    """Собирает ID одного вида каталога в пакеты до max_batch штук
+
+    Результат по каждому ID - JSON объекта (bytes) или None, если Spotify
+    такого объекта не знает. Найденные объекты кладутся в кэш по отдельности,
+    так что одиночные маршруты тоже их видят
+    """
+
+    def __init__(self, resource, path, field, max_batch, window=CATALOG_BATCH_WINDOW_MS / 1000):
+        self.resource = resource
+        self.path = path
+        self.field = field
+        self.max_batch = max_batch
+        self.window = window
+        self.batches = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def ident(self, entity_id, market):
+        return f"{entity_id}:{market}" if market else entity_id
+
+    def load_many(self, ids, token, market=None):
+        """{id: JSON объекта или None} для всех ids (кэш, затем общий пакет)"""
+        results = {}
+        futures = {}
+        for entity_id in dict.fromkeys(ids):
+            body = response_cache.get(self.resource, cache_key(self.resource, self.ident(entity_id, market)))
+            if body is not None:
+                results[entity_id] = body
+            else:
+                futures[entity_id] = None
+
+        full = []
+        with self._lock:
+            for entity_id in futures:
+                futures[entity_id] = self._enqueue(entity_id, token, market, full)
+        # Полные пакеты отправляем сами, не дожидаясь окна
+        for batch in full:
+            self._dispatch(batch)
+
+        for entity_id, future in futures.items():
+            try:
+                results[entity_id] = future.result()
+            except (requests.RequestException, RateLimited):
+                # Spotify недоступен - последний известный объект, если он есть
+                stale = response_cache.get_stale(
+                    self.resource, cache_key(self.resource, self.ident(entity_id, market)))
+                if stale is None:
+                    raise
+                results[entity_id] = stale
+        return results
+
+    def load(self, entity_id, token, market=None):
+        return self.load_many([entity_id], token, market)[entity_id]
+
+    def _enqueue(self, entity_id, token, market, full):
+        batch = self._pending.get(market)
+        if batch is None:
+            batch = self._pending[market] = _Batch(token, market)
+            # Отдельный таймер, а не пул потоков: ожидающие пакета сами могут
+            # занимать все потоки пула (например, в составных маршрутах)
+            timer = threading.Timer(self.window, self._dispatch_after_window, (batch,))
+            timer.daemon = True
+            timer.start()
+        future = batch.futures.get(entity_id)
+        if future is None:
+            future = batch.futures[entity_id] = Future()
+            if len(batch.futures) >= self.max_batch:
+                self._detach(batch)
+                full.append(batch)
+        return future
+
+    def _detach(self, batch):
+        batch.sent = True
+        if self._pending.get(batch.market) is batch:
+            del self._pending[batch.market]
+
+    def _dispatch_after_window(self, batch):
+        with self._lock:
+            if batch.sent:
+                return
+            self._detach(batch)
+        self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        self.batches += 1
+        futures = batch.futures
+        params = {'ids': ','.join(futures)}
+        if batch.market:
+            params['market'] = batch.market
+        try:
+            response = get_client().get(self.path, token=batch.token, params=params)
+            if response.status_code != 200:
+                raise requests.HTTPError(f"Spotify returned {response.status_code}", response=response)
+            objects = response.json().get(self.field) or []
+        except Exception as error:
+            for future in futures.values():
+                future.set_exception(error)
+            return
+
+        # Spotify возвращает объекты в порядке ids, на месте неизвестных - null
+        for entity_id, obj in zip(list(futures), objects):
+            body = None
+            if obj is not None:
+                body = json.dumps(obj).encode('utf-8')
+                response_cache.set(self.resource, cache_key(self.resource, self.ident(entity_id, batch.market)), body)
+            futures[entity_id].set_result(body)
+        for future in futures.values():
+            if not future.done():
+                future.set_result(None)
+
+
+artist_loader = CatalogLoader('artist', '/artists', 'artists', max_batch=50)
+album_loader = CatalogLoader('album', '/albums', 'albums', max_batch=20)
@@ -0,0 +1,116 @@
+"""
+Circuit breaker для групп эндпоинтов Spotify API
+Пока группа недоступна, запросы к ней сразу завершаются ошибкой
+и не занимают воркер на время таймаутов
+"""
+
+import os
+import time
+import threading
+import requests
+
+# Сколько ошибок подряд открывают цепь и через сколько секунд пробовать снова
+FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(requests.RequestException):
+    """Группа эндпоинтов Spotify считается недоступной, запрос не отправлен"""
+
+    def __init__(self, family, retry_after):
+        super().__init__(f"Spotify {family} endpoints unavailable, retry after {retry_after:.0f}s")
+        self.family = family
+        self.retry_after = retry_after
+
+
+def endpoint_family(path):
+    """Группа эндпоинта по пути API: player, search, library или catalog"""
+    path = '/' + path.split('?', 1)[0].lstrip('/')
+    if path.startswith('/me/player'):
+        return 'player'
+    if path.startswith('/search'):
+        return 'search'
+    if path.startswith('/me') or path.startswith('/playlists') or path.startswith('/users'):
+        return 'library'
+    return 'catalog'
+
+
+def is_failure(response):
+    """Ответы, которые говорят о сбое на стороне Spotify"""
+    return response.status_code >= 500
+
+
+class CircuitBreaker:
+    """Состояния closed -> open -> half_open (одна пробная попытка) -> closed"""
+
+    def __init__(self, family, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.family = family
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Пропускает запрос или бросает CircuitOpen"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                # Время вышло: пропускаем один пробный запрос
+                self.state = HALF_OPEN
+                return
+            raise CircuitOpen(self.family, max(remaining, 1))
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, send):
+        """Выполняет send() под защитой цепи"""
+        self.before_request()
+        try:
+            response = send()
+        except Exception:
+            # Пробный запрос тоже должен завершить half_open, иначе цепь зависнет
+            self.record_failure()
+            raise
+        if is_failure(response):
+            self.record_failure()
+        else:
+            self.record_success()
+        return response
+
+
+class CircuitBreakers:
+    """Цепи по группам эндпоинтов (на процесс воркера)"""
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def for_path(self, path):
+        family = endpoint_family(path)
+        breaker = self._breakers.get(family)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(family, CircuitBreaker(family, **self._kwargs))
+        return breaker
+
+    def states(self):
+        return {family: breaker.state for family, breaker in self._breakers.items()}
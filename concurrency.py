@@ -0,0 +1,85 @@
+"""
+Пул потоков для параллельных запросов к Spotify
+и объединение одинаковых одновременных вызовов (single-flight)
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+UPSTREAM_CONCURRENCY = int(os.getenv('UPSTREAM_CONCURRENCY', '32'))
+# Отдельный небольшой пул для фоновых загрузок (прогрев, упреждающая загрузка):
+# они не занимают потоки, которых ждут запросы пользователей
+BACKGROUND_CONCURRENCY = int(os.getenv('BACKGROUND_CONCURRENCY', '8'))
+# Сколько секунд ждать результата из пула, прежде чем считать запрос к Spotify потерянным
+UPSTREAM_WAIT_TIMEOUT = float(os.getenv('UPSTREAM_WAIT_TIMEOUT', '60'))
+
+
+class _ProcessExecutor:
+    """Пул потоков, который создается заново в каждом процессе (после fork)"""
+
+    def __init__(self, max_workers, name):
+        self.max_workers = max_workers
+        self.name = name
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        executor = self._executor
+        if executor is not None and self._pid == os.getpid():
+            return executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=self.name)
+                self._pid = os.getpid()
+            return self._executor
+
+
+_upstream = _ProcessExecutor(UPSTREAM_CONCURRENCY, 'upstream')
+_background = _ProcessExecutor(BACKGROUND_CONCURRENCY, 'background')
+
+
+def get_executor():
+    """Возвращает пул потоков текущего процесса"""
+    return _upstream.get()
+
+
+def get_background_executor():
+    """Пул фоновых загрузок текущего процесса
+
+    Задачи в нем не должны ждать других задач этого же пула: все его потоки
+    могут оказаться заняты ожидающими
+    """
+    return _background.get()
+
+
+class SingleFlight:
+    """Одновременные вызовы с одинаковым ключом выполняются один раз"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Выполняет fn() или дожидается уже идущего вызова с тем же ключом"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
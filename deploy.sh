@@ -49,6 +49,7 @@ create_directories() {
     
     mkdir -p $APP_DIR
     mkdir -p $APP_DIR/logs
+    mkdir -p $APP_DIR/data
     mkdir -p $APP_DIR/static/images
     mkdir -p /var/log/nginx
     mkdir -p /etc/nginx/sites-available
@@ -81,6 +82,9 @@ setup_python_env() {
     pip install --upgrade pip
     pip install -r requirements.txt
     
+    # Сборка статики: минификация, хэш в имени, .gz и .br копии
+    python assets.py
+    
     log_success "Python окружение настроено"
 }
 
@@ -1,14 +1,27 @@
 # Gunicorn configuration file
+import os
 import multiprocessing
 
-# Server socket
-bind = "0.0.0.0:5000"
+# Server socket: снаружи приложение доступно через nginx, поэтому по умолчанию
+# только loopback (в Docker контейнере - 0.0.0.0, см. Dockerfile)
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:5000')
 backlog = 2048
 
+# Режим воркеров: sync (по умолчанию) или async
+# В async режиме каждый воркер крутит event loop gevent, а сетевые вызовы
+# requests становятся неблокирующими, поэтому медленный ответ Spotify
+# занимает гринлет, а не весь процесс
+worker_mode = os.getenv('GOATMUSIC_WORKER_MODE', 'sync')
+
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
-worker_connections = 1000
+if worker_mode == 'async':
+    workers = multiprocessing.cpu_count() + 1
+    worker_class = "gevent"
+    worker_connections = int(os.getenv('GOATMUSIC_WORKER_CONNECTIONS', '5000'))
+else:
+    workers = multiprocessing.cpu_count() * 2 + 1
+    worker_class = "sync"
+    worker_connections = 1000
 timeout = 30
 keepalive = 2
 
@@ -35,3 +48,20 @@ tmp_upload_dir = None
 # SSL (раскомментируйте для HTTPS)
 # keyfile = "path/to/keyfile"
 # certfile = "path/to/certfile"
+
+# Пул соединений к Spotify создается в каждом воркере после fork,
+# чтобы процессы не делили между собой сокеты. Хук post_worker_init
+# срабатывает уже после monkey-patching gevent в async режиме
+def post_worker_init(worker):
+    """Инициализирует клиент Spotify API в воркере"""
+    import spotify_client
+    if worker_mode == 'async':
+        # Тысячи одновременных запросов на процесс - пул должен быть шире
+        spotify_client.init_client(pool_size=int(os.getenv('SPOTIFY_POOL_SIZE', '200')))
+    else:
+        spotify_client.init_client()
+
+def worker_exit(server, worker):
+    """Сохраняет последние метрики воркера перед выходом (перезапуск по max_requests)"""
+    from metrics import worker_metrics
+    worker_metrics.flush()
@@ -0,0 +1,313 @@
+"""
+Локальная история прослушиваний
+Фоновая задача воркера забирает у активных пользователей /me/player/recently-played
+по курсору after и дописывает прослушивания в общий файл SQLite. При записи сразу
+обновляются дневные агрегаты (треки, исполнители, время), поэтому /api/stats/*
+отвечают суммой нескольких строк за окно без запросов к Spotify
+"""
+
+import os
+import json
+import time
+import calendar
+import datetime
+import threading
+from storage import DATA_DIR, SQLiteDatabase
+from spotify_client import get_client
+from scheduler import BACKGROUND, RateLimited
+from token_manager import UserToken, REFRESH_MARGIN
+from pages import track_summary
+
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', os.path.join(DATA_DIR, 'history.db'))
+# Как часто забирать новые прослушивания пользователя. Spotify помнит только
+# последние 50, поэтому интервал должен быть заметно меньше 50 треков (~2.5 часа)
+HISTORY_POLL_INTERVAL = int(os.getenv('HISTORY_POLL_INTERVAL', str(10 * 60)))
+# Пользователи без запросов дольше этого времени из фоновой задачи выбывают
+ACTIVE_WINDOW = 3600
+JOB_TICK = 30
+# Страниц по 50 прослушиваний за один проход
+MAX_PAGES = 4
+PAGE_LIMIT = 50
+
+DAY_MS = 24 * 3600 * 1000
+
+
+def played_at_ms(value):
+    """2024-01-01T12:00:00.123Z -> миллисекунды с начала эпохи (UTC)"""
+    stamp, _, fraction = value.rstrip('Z').partition('.')
+    seconds = calendar.timegm(time.strptime(stamp[:19], '%Y-%m-%dT%H:%M:%S'))
+    return seconds * 1000 + int((fraction + '000')[:3])
+
+
+def day_date(day):
+    """Номер дня с начала эпохи -> дата ISO"""
+    return (datetime.date(1970, 1, 1) + datetime.timedelta(days=day)).isoformat()
+
+
+def week_start(day):
+    """Понедельник недели, в которую попадает день (1 января 1970 - четверг)"""
+    return day - (day + 3) % 7
+
+
+class HistoryStore:
+    """Прослушивания и дневные агрегаты в общем для воркеров SQLite
+
+    Прослушивание - строка (user_id, played_at, track_id) без rowid; названия треков
+    и исполнителей хранятся один раз. Время прослушивания - длительность трека:
+    Spotify не сообщает, дослушан ли он. Дни считаются по UTC
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS plays (
+            user_id TEXT NOT NULL,
+            played_at INTEGER NOT NULL,
+            track_id TEXT NOT NULL,
+            PRIMARY KEY (user_id, played_at)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS tracks (
+            track_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS artists (
+            artist_id TEXT PRIMARY KEY,
+            name TEXT
+        );
+        CREATE TABLE IF NOT EXISTS daily_tracks (
+            user_id TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            track_id TEXT NOT NULL,
+            plays INTEGER NOT NULL,
+            ms INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, track_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS daily_artists (
+            user_id TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            artist_id TEXT NOT NULL,
+            plays INTEGER NOT NULL,
+            ms INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, artist_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            plays INTEGER NOT NULL,
+            ms INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS cursors (
+            user_id TEXT PRIMARY KEY,
+            after INTEGER NOT NULL,
+            checked_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.db = SQLiteDatabase(path, self.SCHEMA)
+
+    def add(self, user_id, items):
+        """Дописывает прослушивания из ответа recently-played; возвращает число новых
+
+        Повторы (тот же played_at) пропускаются, поэтому один и тот же ответ
+        можно передавать сколько угодно раз
+        """
+        conn = self.db.connection()
+        added = 0
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for item in items:
+                track = item.get('track') or {}
+                if not track.get('id') or not item.get('played_at'):
+                    continue
+                played_at = played_at_ms(item['played_at'])
+                if not conn.execute('INSERT OR IGNORE INTO plays (user_id, played_at, track_id) VALUES (?, ?, ?)',
+                                    (user_id, played_at, track['id'])).rowcount:
+                    continue
+                added += 1
+                day = played_at // DAY_MS
+                ms = track.get('duration_ms') or 0
+                summary = track_summary(track, track.get('album') or {})
+                conn.execute('INSERT OR REPLACE INTO tracks (track_id, summary) VALUES (?, ?)',
+                             (track['id'], json.dumps(summary, separators=(',', ':'))))
+                conn.execute('INSERT INTO daily_tracks (user_id, day, track_id, plays, ms) VALUES (?, ?, ?, 1, ?) '
+                             'ON CONFLICT (user_id, day, track_id) DO UPDATE SET plays = plays + 1, ms = ms + excluded.ms',
+                             (user_id, day, track['id'], ms))
+                conn.execute('INSERT INTO daily_totals (user_id, day, plays, ms) VALUES (?, ?, 1, ?) '
+                             'ON CONFLICT (user_id, day) DO UPDATE SET plays = plays + 1, ms = ms + excluded.ms',
+                             (user_id, day, ms))
+                for artist in track.get('artists') or ():
+                    if not artist.get('id'):
+                        continue
+                    conn.execute('INSERT OR REPLACE INTO artists (artist_id, name) VALUES (?, ?)',
+                                 (artist['id'], artist.get('name')))
+                    conn.execute('INSERT INTO daily_artists (user_id, day, artist_id, plays, ms) '
+                                 'VALUES (?, ?, ?, 1, ?) '
+                                 'ON CONFLICT (user_id, day, artist_id) DO UPDATE '
+                                 'SET plays = plays + 1, ms = ms + excluded.ms',
+                                 (user_id, day, artist['id'], ms))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return added
+
+    def claim(self, user_id, interval):
+        """Курсор пользователя, если пора забирать историю, иначе None
+
+        Проверка и отметка - одним UPDATE: из нескольких воркеров забирает только один
+        """
+        now = time.time()
+        self.db.execute('INSERT OR IGNORE INTO cursors (user_id, after, checked_at) VALUES (?, 0, 0)', (user_id,))
+        claimed = self.db.execute('UPDATE cursors SET checked_at = ? WHERE user_id = ? AND checked_at <= ?',
+                                  (now, user_id, now - interval)).rowcount
+        if not claimed:
+            return None
+        return self.db.execute('SELECT after FROM cursors WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+    def advance(self, user_id, after):
+        self.db.execute('UPDATE cursors SET after = MAX(after, ?) WHERE user_id = ?', (after, user_id))
+
+    def release(self, user_id):
+        """Сбор не удался: пользователь снова в очереди на ближайшем проходе"""
+        self.db.execute('UPDATE cursors SET checked_at = 0 WHERE user_id = ?', (user_id,))
+
+    def updated_at(self, user_id):
+        """Когда история пользователя последний раз забиралась у Spotify (None - ни разу или сбой)"""
+        row = self.db.execute('SELECT checked_at FROM cursors WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row and row[0] else None
+
+    def _since(self, days):
+        return 0 if not days else int(time.time() * 1000) // DAY_MS - days + 1
+
+    def top_tracks(self, user_id, days=None, limit=10):
+        """[(сводка трека, прослушиваний, мс)] за последние days дней (None - за все время)"""
+        rows = self.db.execute(
+            'SELECT track_id, SUM(plays) AS total, SUM(ms) FROM daily_tracks WHERE user_id = ? AND day >= ? '
+            'GROUP BY track_id ORDER BY total DESC, SUM(ms) DESC LIMIT ?',
+            (user_id, self._since(days), limit)).fetchall()
+        summaries = self._lookup('SELECT track_id, summary FROM tracks WHERE track_id IN (%s)', rows)
+        return [(json.loads(summaries[track_id]), plays, ms) for track_id, plays, ms in rows
+                if track_id in summaries]
+
+    def top_artists(self, user_id, days=None, limit=10):
+        """[(id исполнителя, имя, прослушиваний, мс)]"""
+        rows = self.db.execute(
+            'SELECT artist_id, SUM(plays) AS total, SUM(ms) FROM daily_artists WHERE user_id = ? AND day >= ? '
+            'GROUP BY artist_id ORDER BY total DESC, SUM(ms) DESC LIMIT ?',
+            (user_id, self._since(days), limit)).fetchall()
+        names = self._lookup('SELECT artist_id, name FROM artists WHERE artist_id IN (%s)', rows)
+        return [(artist_id, names.get(artist_id), plays, ms) for artist_id, plays, ms in rows]
+
+    def listening(self, user_id, days=None, period='day'):
+        """[(дата начала дня или недели, прослушиваний, мс)] по возрастанию даты"""
+        rows = self.db.execute('SELECT day, plays, ms FROM daily_totals WHERE user_id = ? AND day >= ? ORDER BY day',
+                               (user_id, self._since(days))).fetchall()
+        if period == 'week':
+            weeks = {}
+            for day, plays, ms in rows:
+                total = weeks.setdefault(week_start(day), [0, 0])
+                total[0] += plays
+                total[1] += ms
+            rows = [(week, plays, ms) for week, (plays, ms) in sorted(weeks.items())]
+        return [(day_date(day), plays, ms) for day, plays, ms in rows]
+
+    def _lookup(self, sql, rows):
+        if not rows:
+            return {}
+        keys = [row[0] for row in rows]
+        return dict(self.db.execute(sql % ','.join('?' * len(keys)), keys).fetchall())
+
+
+def fetch_new_plays(token, after, priority=BACKGROUND):
+    """Прослушивания после курсора after (мс): (items, новый курсор)"""
+    items = []
+    for _ in range(MAX_PAGES):
+        response = get_client().get('/me/player/recently-played', token=token, priority=priority,
+                                    params={'limit': PAGE_LIMIT, 'after': after})
+        if response.status_code != 200:
+            break
+        data = response.json()
+        page = [item for item in data.get('items') or () if item.get('played_at')]
+        items.extend(page)
+        newest = max((played_at_ms(item['played_at']) for item in page), default=after)
+        if newest <= after:
+            break
+        after = newest
+        if len(page) < PAGE_LIMIT or not data.get('next'):
+            break
+    return items, after
+
+
+class HistoryIngester:
+    """Фоновый сбор истории прослушиваний активных пользователей воркера"""
+
+    def __init__(self, store, interval=HISTORY_POLL_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self._users = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def track(self, user_id, token):
+        """Отмечает пользователя активным и возвращает копию токена для фона
+
+        Токен копируется без refresh token, как в RecommendationsJob: фоновая
+        задача токены не обновляет
+        """
+        if user_id is None:
+            return None
+        copy = UserToken(token.access_token, None, token.expires_at, user_id)
+        with self._lock:
+            self._users[user_id] = (copy, time.time())
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self.run, name='listening-history', daemon=True)
+                self._thread.start()
+        return copy
+
+    def played(self, user_id, body):
+        """Ответ recently-played, полученный маршрутом: прослушивания из него записываются сразу
+
+        Курсор не двигается: в ответе только последние треки, а более ранние после
+        курсора заберет фоновая задача
+        """
+        if user_id is None or not body:
+            return
+        self.store.add(user_id, json.loads(body).get('items') or ())
+
+    def run(self):
+        while True:
+            time.sleep(JOB_TICK)
+            now = time.time()
+            with self._lock:
+                for user_id, (_, seen_at) in list(self._users.items()):
+                    if now - seen_at > ACTIVE_WINDOW:
+                        del self._users[user_id]
+                users = list(self._users.items())
+            for user_id, (token, _) in users:
+                try:
+                    self.poll_if_due(user_id, token)
+                except RateLimited:
+                    # Лимит занят интерактивными запросами - заберем на следующем проходе
+                    break
+                except Exception:
+                    continue
+
+    def poll_if_due(self, user_id, token):
+        if token.expires_at - time.time() < REFRESH_MARGIN:
+            return
+        after = self.store.claim(user_id, self.interval)
+        if after is None:
+            return
+        try:
+            items, cursor = fetch_new_plays(token, after)
+        except Exception:
+            self.store.release(user_id)
+            raise
+        self.store.add(user_id, items)
+        self.store.advance(user_id, cursor)
+
+
+history_store = HistoryStore()
+history_ingester = HistoryIngester(history_store)
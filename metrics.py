@@ -0,0 +1,334 @@
+"""
+Метрики задержек в формате Prometheus
+Каждый воркер считает свои счетчики в памяти и раз в METRICS_FLUSH_INTERVAL
+записывает снимок в общий файл SQLite; /metrics в любом воркере суммирует
+снимки всех воркеров, поэтому Prometheus видит сервис целиком
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+from functools import lru_cache
+from storage import DATA_DIR, SQLiteDatabase
+from cache import response_cache
+
+METRICS_DB_PATH = os.getenv('METRICS_DB_PATH', os.path.join(DATA_DIR, 'metrics.db'))
+# Как часто воркер сохраняет свой снимок; /metrics отстает от живых данных не больше чем на это время
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '10'))
+# Если задан, /metrics требует заголовок Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Счетчик ResponseCache -> значение метки result
+CACHE_RESULTS = {'hits': 'hit', 'misses': 'miss', 'stale': 'stale'}
+
+# Имя метрики: (тип, описание)
+METRICS = {
+    'goatmusic_http_requests_total': ('counter', 'Requests handled, by route, method and status'),
+    'goatmusic_http_request_duration_seconds': ('histogram', 'Time until the response is ready (streams: until the first byte)'),
+    'goatmusic_http_requests_in_flight': ('gauge', 'Requests being handled, including open streams'),
+    'goatmusic_upstream_requests_total': ('counter', 'Spotify API requests, by endpoint family, method and status'),
+    'goatmusic_upstream_request_duration_seconds': ('histogram', 'Spotify API request time including connection retries'),
+    'goatmusic_upstream_requests_in_flight': ('gauge', 'Spotify API requests waiting for a response'),
+    'goatmusic_cache_requests_total': ('counter', 'Response cache lookups, by resource and result (hit, miss, stale)'),
+    'goatmusic_prefetch_total': ('counter', 'Prefetch jobs, by kind and outcome (started, over_budget, rate_limited, failed)'),
+    'goatmusic_workers': ('gauge', 'Workers that reported metrics recently'),
+}
+
+
+def labels(**values):
+    """Метки в синтаксисе Prometheus: route="/api/profile",method="GET" """
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in values.items())
+
+
+@lru_cache(maxsize=4096)
+def series_labels(*pairs):
+    """labels() для горячего пути: набор маршрутов и кодов конечен, строки запоминаются"""
+    return labels(**dict(zip(pairs[::2], pairs[1::2])))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Счетчики, гистограммы и датчики одного воркера
+
+    Серии хранятся по имени и готовой строке меток: запись - словарь и сложение
+    под блокировкой, без выделения объектов на каждый запрос
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, label_string, value=1):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[label_string] = series.get(label_string, 0) + value
+
+    def add(self, name, label_string, value):
+        """Изменяет датчик (in-flight: +1 в начале, -1 в конце)"""
+        with self._lock:
+            series = self.gauges.setdefault(name, {})
+            series[label_string] = series.get(label_string, 0) + value
+
+    def observe(self, name, label_string, seconds):
+        # Корзины без накопления: [по корзинам..., +Inf, сумма, количество]
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            values = series.get(label_string)
+            if values is None:
+                values = series[label_string] = [0] * (len(self.buckets) + 3)
+            values[index] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': {name: dict(series) for name, series in self.counters.items()},
+                'histograms': {name: {key: list(values) for key, values in series.items()}
+                               for name, series in self.histograms.items()},
+                'gauges': {name: dict(series) for name, series in self.gauges.items()},
+            }
+
+
+def merge(snapshots, buckets=LATENCY_BUCKETS):
+    """Сумма снимков нескольких воркеров"""
+    total = {'counters': {}, 'histograms': {}, 'gauges': {}}
+    for snapshot in snapshots:
+        for kind in ('counters', 'gauges'):
+            for name, series in snapshot.get(kind, {}).items():
+                merged = total[kind].setdefault(name, {})
+                for key, value in series.items():
+                    merged[key] = merged.get(key, 0) + value
+        for name, series in snapshot.get('histograms', {}).items():
+            merged = total['histograms'].setdefault(name, {})
+            for key, values in series.items():
+                if len(values) != len(buckets) + 3:
+                    # Снимок с другими корзинами (до смены настроек) не складывается
+                    continue
+                current = merged.setdefault(key, [0] * len(values))
+                merged[key] = [a + b for a, b in zip(current, values)]
+    return total
+
+
+def render(snapshot, buckets=LATENCY_BUCKETS):
+    """Текстовый формат Prometheus (text/plain; version=0.0.4)"""
+    lines = []
+    bounds = [f'{bound:g}' for bound in buckets] + ['+Inf']
+    for name, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'histogram':
+            for key, values in sorted(snapshot['histograms'].get(name, {}).items()):
+                prefix = key + ',' if key else ''
+                cumulative = 0
+                for bound, count in zip(bounds, values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{key}}} {values[-2]:.6f}')
+                lines.append(f'{name}_count{{{key}}} {values[-1]}')
+        else:
+            series = snapshot['counters' if kind == 'counter' else 'gauges'].get(name, {})
+            for key, value in sorted(series.items()):
+                lines.append(f'{name}{{{key}}} {value:g}' if key else f'{name} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsStore:
+    """Снимки воркеров в общем SQLite
+
+    Счетчики завершившихся воркеров (перезапуск по max_requests) не теряются:
+    строка, которая давно не обновлялась, складывается в строку 'retired'
+    без датчиков, поэтому суммы счетчиков только растут
+    """
+
+    RETIRED = 'retired'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metrics (
+            worker TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path=METRICS_DB_PATH, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.db = SQLiteDatabase(path, self.SCHEMA)
+        self.flush_interval = flush_interval
+
+    def put(self, worker, snapshot):
+        self.db.execute('INSERT OR REPLACE INTO metrics (worker, data, updated_at) VALUES (?, ?, ?)',
+                        (worker, json.dumps(snapshot, separators=(',', ':')), time.time()))
+
+    def collect(self, worker=None, snapshot=None):
+        """Сумма снимков всех воркеров; свой снимок worker берется живым, а не из файла"""
+        live_after = time.time() - 3 * self.flush_interval
+        snapshots = []
+        workers = 0
+        retired = []
+        for name, data, updated_at in self.db.execute('SELECT worker, data, updated_at FROM metrics'):
+            if name == worker:
+                continue
+            data = json.loads(data)
+            if name != self.RETIRED and updated_at < live_after:
+                retired.append((name, data))
+                continue
+            snapshots.append(data)
+            workers += name != self.RETIRED
+        if snapshot is not None:
+            snapshots.append(snapshot)
+            workers += 1
+        if retired:
+            self.retire(retired)
+            snapshots.extend(dict(data, gauges={}) for _, data in retired)
+        total = merge(snapshots)
+        total['gauges']['goatmusic_workers'] = {'': workers}
+        return total
+
+    def retire(self, rows):
+        """Переносит счетчики замолчавших воркеров в строку 'retired'"""
+        conn = self.db.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM metrics WHERE worker = ?', (self.RETIRED,)).fetchone()
+            snapshots = [json.loads(row[0])] if row else []
+            names = []
+            for name, data in rows:
+                # Другой воркер мог уже перенести эту строку
+                if conn.execute('DELETE FROM metrics WHERE worker = ? AND updated_at < ?',
+                                (name, time.time() - 3 * self.flush_interval)).rowcount:
+                    snapshots.append(dict(data, gauges={}))
+                    names.append(name)
+            if names:
+                retired = merge(snapshots)
+                retired['gauges'] = {}
+                conn.execute('INSERT OR REPLACE INTO metrics (worker, data, updated_at) VALUES (?, ?, ?)',
+                             (self.RETIRED, json.dumps(retired, separators=(',', ':')), time.time()))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+class WorkerMetrics:
+    """Метрики текущего процесса и их периодическая запись в MetricsStore
+
+    Поток записи запускается при первом измерении в процессе (после fork
+    у каждого воркера свой), счетчики унаследованные от мастера сбрасываются
+    """
+
+    def __init__(self, store=None, cache=response_cache):
+        self._store = store
+        self.cache = cache
+        self.local = Metrics()
+        self.worker = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = MetricsStore()
+        return self._store
+
+    def current(self):
+        """Metrics этого процесса"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self.local = Metrics()
+                    self.worker = f'{os.getpid()}-{time.time():.0f}'
+                    self._thread = threading.Thread(target=self.run, name='metrics', daemon=True)
+                    self._thread.start()
+        return self.local
+
+    def snapshot(self):
+        snapshot = self.current().snapshot()
+        if self.cache is not None:
+            # Попадания в кэш ответов: счетчики ResponseCache этого воркера
+            cache = {}
+            for resource, counts in self.cache.stats().items():
+                for counter, result in CACHE_RESULTS.items():
+                    cache[labels(resource=resource, result=result)] = counts[counter]
+            snapshot['counters']['goatmusic_cache_requests_total'] = cache
+        return snapshot
+
+    def flush(self):
+        if self._pid == os.getpid():
+            self.store.put(self.worker, self.snapshot())
+
+    def collect(self):
+        """Сумма по всем воркерам для /metrics"""
+        self.current()
+        return self.store.collect(self.worker, self.snapshot())
+
+    def run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.store.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # Метрики не должны ронять воркер: следующая попытка через интервал
+                pass
+
+    def request_started(self, route):
+        self.current().add('goatmusic_http_requests_in_flight', series_labels('route', route), 1)
+        return time.perf_counter()
+
+    def request_finished(self, route, method, status, started):
+        metrics = self.current()
+        metrics.observe('goatmusic_http_request_duration_seconds', series_labels('route', route, 'method', method),
+                        time.perf_counter() - started)
+        metrics.inc('goatmusic_http_requests_total',
+                    series_labels('route', route, 'method', method, 'status', status))
+
+    def request_closed(self, route):
+        self.current().add('goatmusic_http_requests_in_flight', series_labels('route', route), -1)
+
+    def prefetch(self, kind, outcome):
+        self.current().inc('goatmusic_prefetch_total', series_labels('kind', kind, 'outcome', outcome))
+
+    def upstream(self, family, method):
+        """Контекст замера одного запроса к Spotify"""
+        return UpstreamTimer(self.current(), family, method)
+
+
+class UpstreamTimer:
+    """with metrics.upstream(...) as timer: timer.status = response.status_code"""
+
+    def __init__(self, metrics, family, method):
+        self.metrics = metrics
+        self.family = family
+        self.method = method
+        self.status = 'error'
+
+    def __enter__(self):
+        self.metrics.add('goatmusic_upstream_requests_in_flight', series_labels('family', self.family), 1)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        metrics = self.metrics
+        metrics.observe('goatmusic_upstream_request_duration_seconds',
+                        series_labels('family', self.family, 'method', self.method), time.perf_counter() - self.started)
+        metrics.inc('goatmusic_upstream_requests_total',
+                    series_labels('family', self.family, 'method', self.method, 'status', self.status))
+        metrics.add('goatmusic_upstream_requests_in_flight', series_labels('family', self.family), -1)
+        return False
+
+
+worker_metrics = WorkerMetrics()
@@ -0,0 +1,68 @@
+"""
+Урезанные представления объектов Spotify для составных страниц
+Только поля, которые нужны для отрисовки: ответ меньше в разы
+"""
+
+
+def _images(obj):
+    return obj.get('images') or []
+
+
+def _artist_refs(artists):
+    return [{'id': artist.get('id'), 'name': artist.get('name')} for artist in artists or ()]
+
+
+def artist_summary(artist):
+    return {
+        'id': artist.get('id'),
+        'name': artist.get('name'),
+        'uri': artist.get('uri'),
+        'images': _images(artist),
+        'genres': artist.get('genres') or [],
+        'popularity': artist.get('popularity'),
+        'followers': (artist.get('followers') or {}).get('total'),
+    }
+
+
+def related_artist(artist):
+    return {'id': artist.get('id'), 'name': artist.get('name'), 'uri': artist.get('uri'),
+            'images': _images(artist)}
+
+
+def album_summary(album):
+    return {
+        'id': album.get('id'),
+        'name': album.get('name'),
+        'uri': album.get('uri'),
+        'album_type': album.get('album_type'),
+        'release_date': album.get('release_date'),
+        'total_tracks': album.get('total_tracks'),
+        'images': _images(album),
+        'artists': _artist_refs(album.get('artists')),
+    }
+
+
+def track_summary(track, album=None):
+    """Трек; album - если трек показывается вне страницы своего альбома"""
+    summary = {
+        'id': track.get('id'),
+        'name': track.get('name'),
+        'uri': track.get('uri'),
+        'duration_ms': track.get('duration_ms'),
+        'explicit': track.get('explicit'),
+        'track_number': track.get('track_number'),
+        'artists': _artist_refs(track.get('artists')),
+    }
+    if album is not None:
+        summary['album'] = {'id': album.get('id'), 'name': album.get('name'), 'images': _images(album)}
+    return summary
+
+
+def album_page(album):
+    """Альбом с урезанным списком треков"""
+    page = album_summary(album)
+    tracks = album.get('tracks') or {}
+    page['label'] = album.get('label')
+    page['tracks'] = [track_summary(track) for track in tracks.get('items') or ()]
+    page['tracks_total'] = tracks.get('total')
+    return page
@@ -0,0 +1,87 @@
+"""
+Постраничная выгрузка коллекций Spotify целиком
+После первой страницы известен total - остальные страницы запрашиваются
+параллельно ограниченным окном и отдаются по порядку, не накапливаясь в памяти
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeout
+from spotify_client import get_client
+from concurrency import get_executor, UPSTREAM_WAIT_TIMEOUT
+from scheduler import RateLimited
+
+# Сколько страниц одной коллекции запрашивается одновременно
+PAGE_CONCURRENCY = int(os.getenv('PAGE_CONCURRENCY', '4'))
+# Сколько раз страница ждет освобождения лимита, прежде чем выгрузка прервется
+PAGE_RATE_LIMIT_ATTEMPTS = 5
+
+
+class PageError(Exception):
+    """Страница не получена: Spotify ответил ошибкой"""
+
+    def __init__(self, status):
+        super().__init__(f"Spotify returned {status}")
+        self.status = status
+
+
+def fetch_page(token, path, offset, limit, params=None):
+    """Одна страница коллекции; при исчерпанном лимите ждет и повторяет"""
+    page_params = dict(params or {}, offset=offset, limit=limit)
+    for attempt in range(PAGE_RATE_LIMIT_ATTEMPTS):
+        try:
+            response = get_client().get(path, token=token, params=page_params)
+            break
+        except RateLimited as error:
+            if attempt == PAGE_RATE_LIMIT_ATTEMPTS - 1:
+                raise
+            time.sleep(error.retry_after)
+    if response.status_code != 200:
+        raise PageError(response.status_code)
+    return response.json()
+
+
+def iter_pages(token, path, first_page, page_size, params=None, on_page=None,
+               concurrency=PAGE_CONCURRENCY):
+    """Страницы после first_page по порядку; в работе не больше concurrency запросов
+
+    on_page(page) вызывается в потоке пула для каждой полученной страницы.
+    concurrency=1 - страницы грузятся по очереди в текущем потоке: так работают
+    задачи, которые сами выполняются в пуле и не должны ждать его очереди
+    """
+    total = first_page.get('total') or 0
+    offsets = iter(range(first_page.get('offset', 0) + page_size, total, page_size))
+
+    def load(offset):
+        page = fetch_page(token, path, offset, page_size, params)
+        if on_page is not None:
+            on_page(page)
+        return page
+
+    if concurrency <= 1:
+        for offset in offsets:
+            yield load(offset)
+        return
+
+    executor = get_executor()
+    window = deque()
+    try:
+        for offset in offsets:
+            window.append(executor.submit(load, offset))
+            if len(window) >= concurrency:
+                break
+        while window:
+            try:
+                page = window.popleft().result(timeout=UPSTREAM_WAIT_TIMEOUT)
+            except FutureTimeout:
+                # Пул занят дольше разумного - выгрузка прерывается, а не висит
+                raise PageError(504)
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                window.append(executor.submit(load, next_offset))
+            yield page
+    finally:
+        # Клиент отключился или страница не пришла - остальные не нужны
+        for future in window:
+            future.cancel()
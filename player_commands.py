@@ -0,0 +1,291 @@
+"""
+Конвейер команд плеера
+Команды пользователя уходят в Spotify по одной в фоне, а маршрут сразу отвечает
+предсказанным состоянием. Пока команда ждет отправки, более новая команда того же
+вида (громкость при перетаскивании ползунка, трек, пауза) заменяет ее.
+Порядок команд одного пользователя общий для всех воркеров (журнал в SQLite),
+там же - итог каждой команды для вкладки
+"""
+
+import os
+import time
+import random
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+from storage import SQLiteDatabase
+from spotify_client import get_client
+from scheduler import RateLimited, INTERACTIVE
+from token_manager import UserToken
+from player_stream import player_hub, PLAYER_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# Сколько миллисекунд собирать всплеск команд перед первой отправкой
+COMMAND_WINDOW_MS = float(os.getenv('PLAYER_COMMAND_WINDOW_MS', '50'))
+# Через сколько секунд после команд опросить настоящее состояние плеера
+RECONCILE_DELAY = float(os.getenv('PLAYER_RECONCILE_DELAY', '0.5'))
+# Сколько секунд неотправленная команда другого воркера держит очередь пользователя
+COMMAND_TIMEOUT = float(os.getenv('PLAYER_COMMAND_TIMEOUT', '10'))
+# Как часто проверять, ушли ли более ранние команды из других воркеров
+COMMAND_CHECK_INTERVAL = 0.02
+# Сколько секунд хранить итоги команд
+COMMAND_RETENTION = 3600
+
+# Ошибки Spotify, о которых вкладка сообщает пользователю
+COMMAND_ERRORS = {
+    401: 'Spotify session expired',
+    403: 'Spotify Premium required',
+    404: 'No active device',
+    429: 'Rate limited',
+}
+
+# Команда: (метод, путь, слот). Команды одного слота заменяют друг друга,
+# слот None - каждая команда выполняется (два "следующий трек" - это два трека)
+COMMANDS = {
+    'play': ('PUT', '/me/player/play', 'play'),
+    'resume': ('PUT', '/me/player/play', 'playback'),
+    'pause': ('PUT', '/me/player/pause', 'playback'),
+    'next': ('POST', '/me/player/next', None),
+    'previous': ('POST', '/me/player/previous', None),
+    'volume': ('PUT', '/me/player/volume', 'volume'),
+    'shuffle': ('PUT', '/me/player/shuffle', 'shuffle'),
+    'repeat': ('PUT', '/me/player/repeat', 'repeat'),
+}
+
+
+def request_args(name, value):
+    """Параметры запроса к Spotify для команды"""
+    if name == 'play':
+        return {'json': {'uris': [value]}}
+    if name == 'volume':
+        return {'params': {'volume_percent': value}}
+    if name in ('shuffle', 'repeat'):
+        return {'params': {'state': value}}
+    return {}
+
+
+def predict(state, name, value):
+    """Состояние плеера, каким оно станет после команды"""
+    state = dict(state or {})
+    state.pop('error', None)
+    state.pop('status', None)
+    if name in ('play', 'resume', 'next', 'previous'):
+        state['is_playing'] = True
+    elif name == 'pause':
+        state['is_playing'] = False
+    elif name == 'volume':
+        state['device'] = dict(state.get('device') or {}, volume_percent=value)
+    elif name == 'shuffle':
+        state['shuffle_state'] = value
+    elif name == 'repeat':
+        state['repeat_state'] = value
+    if name in ('play', 'next', 'previous'):
+        # Новый трек станет известен после опроса Spotify
+        state['progress_ms'] = 0
+        state['track_pending'] = True
+    state['predicted'] = True
+    return state
+
+
+class CommandLog:
+    """Журнал команд плеера, общий для всех воркеров
+
+    Номер записи задает порядок команд пользователя: воркер отправляет команду,
+    когда более ранние уже ушли, и пропускает ее, если в том же слоте есть более
+    новая. Номер команды вкладки (client_seq) отсекает команды, которые дошли
+    до сервера позже своих более новых
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS player_commands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            slot TEXT,
+            client TEXT,
+            client_seq INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            http_status INTEGER,
+            error TEXT,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS player_commands_user ON player_commands (user_id, id);
+    """
+
+    PRUNE_EVERY = 64
+
+    def __init__(self, path=PLAYER_DB_PATH):
+        self.db = SQLiteDatabase(path, self.SCHEMA)
+
+    def add(self, user_id, name, slot, client=None, client_seq=None):
+        """Номер новой команды или None, если вкладка уже прислала более новую в этот слот"""
+        conn = self.db.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if slot is not None and client is not None and client_seq is not None:
+                newer = conn.execute('SELECT 1 FROM player_commands WHERE user_id = ? AND slot = ? '
+                                     'AND client = ? AND client_seq >= ? LIMIT 1',
+                                     (user_id, slot, client, client_seq)).fetchone()
+                if newer is not None:
+                    conn.execute('COMMIT')
+                    return None
+            command_id = conn.execute(
+                'INSERT INTO player_commands (user_id, name, slot, client, client_seq, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (user_id, name, slot, client, client_seq, time.time())).lastrowid
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if random.randrange(self.PRUNE_EVERY) == 0:
+            self.db.execute('DELETE FROM player_commands WHERE created_at < ?',
+                            (time.time() - COMMAND_RETENTION,))
+        return command_id
+
+    def wait_turn(self, user_id, command_id, slot, timeout=COMMAND_TIMEOUT):
+        """Ждет отправки более ранних команд пользователя; False - команда уже заменена
+
+        Команда, которую другой воркер не отправил за timeout секунд, считается потерянной
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if slot is not None and self.db.execute(
+                    'SELECT 1 FROM player_commands WHERE user_id = ? AND slot = ? AND id > ? LIMIT 1',
+                    (user_id, slot, command_id)).fetchone() is not None:
+                return False
+            earlier = self.db.execute(
+                "SELECT 1 FROM player_commands WHERE user_id = ? AND id < ? AND status = 'pending' "
+                "AND created_at > ? LIMIT 1", (user_id, command_id, time.time() - timeout)).fetchone()
+            if earlier is None or time.monotonic() >= deadline:
+                return True
+            time.sleep(COMMAND_CHECK_INTERVAL)
+
+    def finish(self, command_id, status, http_status=None, error=None):
+        self.db.execute('UPDATE player_commands SET status = ?, http_status = ?, error = ? WHERE id = ?',
+                        (status, http_status, error, command_id))
+
+    def get(self, user_id, command_id):
+        row = self.db.execute('SELECT name, status, http_status, error FROM player_commands '
+                              'WHERE id = ? AND user_id = ?', (command_id, user_id)).fetchone()
+        if row is None:
+            return None
+        name, status, http_status, error = row
+        return {'id': command_id, 'command': name, 'status': status, 'http_status': http_status,
+                'error': error}
+
+
+command_log = CommandLog()
+
+
+class CommandPipeline:
+    """Очередь команд одного пользователя с заменой по слотам"""
+
+    def __init__(self, user_id, window=COMMAND_WINDOW_MS / 1000, log=command_log):
+        self.user_id = user_id
+        self.window = window
+        self.log = log
+        self.token = None
+        self.state = None
+        self.submitted = 0
+        self.sent = 0
+        self._pending = OrderedDict()
+        self._running = False
+        self._serial = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, token, name, value=None, client=None, client_seq=None):
+        """Ставит команду в очередь: (номер команды, предсказанное состояние)
+
+        None - команда устарела: вкладка уже прислала более новую того же вида
+        """
+        _, _, slot = COMMANDS[name]
+        with self._lock:
+            command_id = self.log.add(self.user_id, name, slot, client, client_seq)
+            if command_id is None:
+                return None
+            self.token = token
+            self.submitted += 1
+            key = slot if slot is not None else next(self._serial)
+            # Более новая команда слота встает в конец: порядок отражает последнее намерение
+            replaced = self._pending.pop(key, None)
+            if replaced is not None:
+                self.log.finish(replaced[0], 'dropped')
+            self._pending[key] = (command_id, name, value, slot)
+            self.state = predict(player_hub.last_state(self.user_id) or self.state, name, value)
+            state = self.state
+            start = not self._running
+            self._running = True
+        player_hub.predict(self.user_id, state)
+        if start:
+            timer = threading.Timer(self.window, self._drain)
+            timer.daemon = True
+            timer.start()
+        return command_id, state
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    break
+                _, (command_id, name, value, slot) = self._pending.popitem(last=False)
+                token = self.token
+            # Команды пользователя из других воркеров уходят в Spotify в общем порядке
+            if not self.log.wait_turn(self.user_id, command_id, slot):
+                self.log.finish(command_id, 'dropped')
+                continue
+            self.sent += 1
+            self.log.finish(command_id, *self._send(token, name, value))
+
+        # Spotify применяет команду не мгновенно: настоящее состояние спросим чуть позже
+        timer = threading.Timer(RECONCILE_DELAY, player_hub.nudge, (self.user_id,))
+        timer.daemon = True
+        timer.start()
+
+    def _send(self, token, name, value):
+        """Отправляет команду: (статус, код ответа Spotify, ошибка)"""
+        method, path, _ = COMMANDS[name]
+        try:
+            response = get_client().request(method, path, token=token, priority=INTERACTIVE,
+                                            **request_args(name, value))
+        except RateLimited:
+            logger.warning('Player command %s dropped: rate limited', name)
+            return 'failed', 429, COMMAND_ERRORS[429]
+        except Exception as error:
+            logger.warning('Player command %s failed: %s', name, error)
+            return 'failed', None, 'Spotify API unavailable'
+        if response.status_code not in (200, 202, 204):
+            logger.warning('Player command %s failed: %s', name, response.status_code)
+            return 'failed', response.status_code, COMMAND_ERRORS.get(response.status_code,
+                                                                     'Player command failed')
+        return 'sent', response.status_code, None
+
+
+class PlayerCommands:
+    """Конвейеры команд по пользователям"""
+
+    def __init__(self):
+        self._pipelines = {}
+        self._lock = threading.Lock()
+
+    def pipeline(self, user_id):
+        with self._lock:
+            pipeline = self._pipelines.get(user_id)
+            if pipeline is None:
+                pipeline = self._pipelines[user_id] = CommandPipeline(user_id)
+            return pipeline
+
+    def submit(self, user_id, token, name, value=None, client=None, client_seq=None):
+        # Команда уйдет уже после ответа: токен берем действующий и без refresh token,
+        # чтобы фоновая отправка не обновляла его в обход сессии
+        token = UserToken(token.get(), None, token.expires_at, user_id)
+        return self.pipeline(user_id).submit(token, name, value, client, client_seq)
+
+    def status(self, user_id, command_id):
+        """Итог команды пользователя или None"""
+        return command_log.get(user_id, command_id)
+
+
+player_commands = PlayerCommands()
@@ -0,0 +1,273 @@
+"""
+Поток состояния плеера (Server-Sent Events)
+Один опрос Spotify на пользователя в воркере, результат раздается во все его вкладки.
+Предсказанные состояния и внеочередные опросы после команд передаются между
+воркерами через общий файл SQLite: команда и поток могут попасть в разные воркеры
+"""
+
+import os
+import json
+import time
+import queue
+import threading
+from storage import DATA_DIR, SQLiteDatabase
+from spotify_client import get_client
+from scheduler import RateLimited, BACKGROUND
+from projection import response_shape
+
+# Интервал опроса во время воспроизведения и верхняя граница при паузе
+PLAYING_INTERVAL = float(os.getenv('PLAYER_POLL_INTERVAL', '5'))
+PAUSED_MAX_INTERVAL = float(os.getenv('PLAYER_POLL_MAX_INTERVAL', '60'))
+# Прогресс трека округляется до корзины, чтобы не слать событие на каждый опрос
+PROGRESS_BUCKET_MS = int(os.getenv('PLAYER_PROGRESS_BUCKET_MS', '10000'))
+# Сколько секунд после команды плановые опросы не перебивают предсказанное состояние
+PREDICTION_HOLD = 3.0
+# Как часто опросчик проверяет сигналы из других воркеров
+SIGNAL_CHECK_INTERVAL = 0.5
+
+PLAYER_DB_PATH = os.getenv('PLAYER_DB_PATH', os.path.join(DATA_DIR, 'player.db'))
+
+PLAYER_STATE_SHAPE = response_shape('player_state')
+
+
+class PlayerSignals:
+    """Последнее предсказанное состояние и запрос внеочередного опроса по пользователям"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS player_signals (
+            user_id TEXT PRIMARY KEY,
+            state TEXT,
+            predicted_at REAL NOT NULL DEFAULT 0,
+            nudged_at REAL NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, path=PLAYER_DB_PATH):
+        self.db = SQLiteDatabase(path, self.SCHEMA)
+
+    def predict(self, user_id, state, predicted_at):
+        self.db.execute('INSERT INTO player_signals (user_id, state, predicted_at) VALUES (?, ?, ?) '
+                        'ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, '
+                        'predicted_at = excluded.predicted_at',
+                        (user_id, json.dumps(state), predicted_at))
+
+    def nudge(self, user_id, nudged_at):
+        self.db.execute('INSERT INTO player_signals (user_id, nudged_at) VALUES (?, ?) '
+                        'ON CONFLICT(user_id) DO UPDATE SET nudged_at = excluded.nudged_at',
+                        (user_id, nudged_at))
+
+    def get(self, user_id):
+        """(состояние или None, время предсказания, время запроса опроса)"""
+        row = self.db.execute('SELECT state, predicted_at, nudged_at FROM player_signals WHERE user_id = ?',
+                              (user_id,)).fetchone()
+        if row is None:
+            return None, 0, 0
+        return (json.loads(row[0]) if row[0] else None), row[1], row[2]
+
+
+def state_signature(state):
+    """Ключ состояния: трек, корзина прогресса, play/pause и код ошибки"""
+    item = state.get('item') or {}
+    progress = state.get('progress_ms') or 0
+    return (item.get('id'), progress // PROGRESS_BUCKET_MS, bool(state.get('is_playing')),
+            state.get('status'))
+
+
+class _UserPoller:
+    """Фоновый опрос /me/player для одного пользователя"""
+
+    def __init__(self, hub, user_id, token):
+        self.hub = hub
+        self.user_id = user_id
+        self.token = token
+        self.subscribers = set()
+        self.last_state = None
+        self.last_signature = None
+        self.hold_until = 0
+        # Какие сигналы других воркеров уже учтены: при старте - все прошлые
+        self.predicted_seen = self.nudged_seen = time.time()
+        self.wakeup = threading.Event()
+        self.interval = PLAYING_INTERVAL
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name=f'player-poller-{self.user_id}', daemon=True)
+        thread.start()
+
+    def fetch(self):
+        response = get_client().get('/me/player', token=self.token, priority=BACKGROUND)
+        if response.status_code == 200:
+            # В поток уходят только поля, которые нужны вкладкам
+            return PLAYER_STATE_SHAPE.apply(response.json())
+        if response.status_code == 204:
+            # Нет активного устройства
+            return {'is_playing': False, 'item': None}
+        return {'error': 'Failed to fetch player state', 'status': response.status_code}
+
+    def next_interval(self, state):
+        """Адаптивный интервал: часто во время игры, с отступлением на паузе"""
+        if state.get('is_playing'):
+            self.interval = PLAYING_INTERVAL
+            item = state.get('item') or {}
+            remaining = (item.get('duration_ms') or 0) - (state.get('progress_ms') or 0)
+            if 0 < remaining < PLAYING_INTERVAL * 1000:
+                # Проснемся сразу после окончания трека
+                return remaining / 1000 + 0.5
+            return self.interval
+        self.interval = min(self.interval * 2, PAUSED_MAX_INTERVAL)
+        return self.interval
+
+    def run(self):
+        while True:
+            try:
+                state = self.fetch()
+                delay = self.next_interval(state)
+            except RateLimited as error:
+                # Под нагрузкой опрос уступает командам плеера: держим прошлое состояние
+                state = self.last_state or {'error': 'Rate limited', 'status': 429}
+                delay = max(error.retry_after, self.interval)
+            except Exception:
+                state = {'error': 'Spotify API unavailable', 'status': 502}
+                delay = self.next_interval(state)
+
+            if not self.hub.publish(self, state):
+                return
+            self.hub.wait(self, delay)
+
+
+class PlayerStateHub:
+    """Реестр опросчиков по пользователям и их подписчиков"""
+
+    def __init__(self, signals=None):
+        self._lock = threading.Lock()
+        self._pollers = {}
+        self._signals = signals
+
+    @property
+    def signals(self):
+        if self._signals is None:
+            self._signals = PlayerSignals()
+        return self._signals
+
+    def subscribe(self, user_id, token):
+        """Подписывает вкладку, возвращает очередь событий"""
+        subscription = queue.Queue(maxsize=16)
+        with self._lock:
+            poller = self._pollers.get(user_id)
+            created = poller is None
+            if created:
+                poller = _UserPoller(self, user_id, token)
+                self._pollers[user_id] = poller
+            poller.token = token
+            poller.subscribers.add(subscription)
+            if poller.last_state is not None:
+                subscription.put_nowait(poller.last_state)
+        if created:
+            poller.start()
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            poller = self._pollers.get(user_id)
+            if poller is not None:
+                poller.subscribers.discard(subscription)
+
+    def last_state(self, user_id):
+        """Последнее разосланное состояние или None, если опроса нет"""
+        with self._lock:
+            poller = self._pollers.get(user_id)
+            return poller.last_state if poller is not None else None
+
+    def predict(self, user_id, state):
+        """Рассылает предсказанное состояние после команды; опрос его подтвердит или исправит
+
+        Вкладки в других воркерах получат его при следующей проверке сигналов
+        """
+        now = time.time()
+        try:
+            self.signals.predict(user_id, state, now)
+        except Exception:
+            # Без общего файла предсказание дойдет только до вкладок этого воркера
+            pass
+        self._apply_prediction(user_id, state, now)
+
+    def _apply_prediction(self, user_id, state, predicted_at):
+        with self._lock:
+            poller = self._pollers.get(user_id)
+            if poller is None:
+                return
+            poller.predicted_seen = max(poller.predicted_seen, predicted_at)
+            poller.last_state = state
+            poller.hold_until = predicted_at + PREDICTION_HOLD
+            # Следующий опрос рассылается в любом случае, даже если совпадет с прошлым
+            poller.last_signature = None
+            subscribers = list(poller.subscribers)
+        self._send(subscribers, state)
+
+    def nudge(self, user_id):
+        """Внеочередной опрос (после команды плеера) во всех воркерах с вкладками пользователя"""
+        now = time.time()
+        try:
+            self.signals.nudge(user_id, now)
+        except Exception:
+            pass
+        with self._lock:
+            poller = self._pollers.get(user_id)
+        if poller is not None:
+            poller.nudged_seen = max(poller.nudged_seen, now)
+            self._wake(poller)
+
+    def _wake(self, poller):
+        poller.interval = PLAYING_INTERVAL
+        poller.hold_until = 0
+        poller.wakeup.set()
+
+    def wait(self, poller, delay):
+        """Пауза опросчика до следующего опроса; сигналы других воркеров ее прерывают"""
+        deadline = time.monotonic() + delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if poller.wakeup.wait(min(remaining, SIGNAL_CHECK_INTERVAL)):
+                poller.wakeup.clear()
+                return
+            try:
+                state, predicted_at, nudged_at = self.signals.get(poller.user_id)
+            except Exception:
+                continue
+            if state is not None and predicted_at > poller.predicted_seen:
+                self._apply_prediction(poller.user_id, state, predicted_at)
+            if nudged_at > poller.nudged_seen:
+                poller.nudged_seen = nudged_at
+                self._wake(poller)
+                poller.wakeup.clear()
+                return
+
+    def publish(self, poller, state):
+        """Рассылает состояние, если оно изменилось. False - подписчиков нет"""
+        with self._lock:
+            if not poller.subscribers:
+                self._pollers.pop(poller.user_id, None)
+                return False
+            if time.time() < poller.hold_until:
+                # Команда еще не дошла до Spotify - опрос покажет прежнее состояние
+                return True
+            signature = state_signature(state)
+            if signature == poller.last_signature:
+                return True
+            poller.last_signature = signature
+            poller.last_state = state
+            subscribers = list(poller.subscribers)
+        self._send(subscribers, state)
+        return True
+
+    def _send(self, subscribers, state):
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(state)
+            except queue.Full:
+                # Вкладка не успевает читать - пропускаем промежуточное состояние
+                pass
+
+
+player_hub = PlayerStateHub()
@@ -0,0 +1,80 @@
+"""
+Локальное хранилище треков плейлистов
+Список треков хранится вместе со snapshot_id, при котором он получен:
+пока snapshot в Spotify не изменился, треки читаются с диска
+"""
+
+import os
+import time
+import random
+from storage import DATA_DIR, SQLiteDatabase
+
+PLAYLIST_DB_PATH = os.getenv('PLAYLIST_DB_PATH', os.path.join(DATA_DIR, 'playlists.db'))
+PLAYLIST_STORE_MAX_BYTES = int(os.getenv('PLAYLIST_STORE_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+
+class PlaylistStore:
+    """Треки плейлистов по snapshot_id в общем для воркеров файле SQLite
+
+    tracks - JSON массив элементов /playlists/{id}/tracks как есть,
+    чтобы отдавать его без повторной сериализации
+    """
+
+    TOUCH_INTERVAL = 60
+    EVICT_EVERY = 32
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS playlists (
+            playlist_id TEXT PRIMARY KEY,
+            snapshot_id TEXT NOT NULL,
+            tracks BLOB NOT NULL,
+            total INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS playlists_accessed_at ON playlists (accessed_at);
+    """
+
+    def __init__(self, path=PLAYLIST_DB_PATH, max_bytes=PLAYLIST_STORE_MAX_BYTES):
+        self.db = SQLiteDatabase(path, self.SCHEMA)
+        self.max_bytes = max_bytes
+
+    def get(self, playlist_id):
+        """(snapshot_id, треки JSON, total) или None"""
+        row = self.db.execute(
+            'SELECT snapshot_id, tracks, total, accessed_at FROM playlists WHERE playlist_id = ?',
+            (playlist_id,)).fetchone()
+        if row is None:
+            return None
+        snapshot_id, tracks, total, accessed_at = row
+        now = time.time()
+        if now - accessed_at > self.TOUCH_INTERVAL:
+            self.db.execute('UPDATE playlists SET accessed_at = ? WHERE playlist_id = ?', (now, playlist_id))
+        return snapshot_id, tracks, total
+
+    def put(self, playlist_id, snapshot_id, tracks, total):
+        self.db.execute(
+            'INSERT OR REPLACE INTO playlists (playlist_id, snapshot_id, tracks, total, size, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (playlist_id, snapshot_id, tracks, total, len(tracks), time.time()))
+        if random.randrange(self.EVICT_EVERY) == 0:
+            self.evict()
+
+    def evict(self):
+        """Удаляет давно не открывавшиеся плейлисты сверх max_bytes"""
+        total_size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM playlists').fetchone()[0]
+        excess = total_size - self.max_bytes
+        if excess <= 0:
+            return
+        ids = []
+        freed = 0
+        for playlist_id, size in self.db.execute(
+                'SELECT playlist_id, size FROM playlists ORDER BY accessed_at'):
+            ids.append((playlist_id,))
+            freed += size
+            if freed >= excess:
+                break
+        self.db.connection().executemany('DELETE FROM playlists WHERE playlist_id = ?', ids)
+
+
+playlist_store = PlaylistStore()
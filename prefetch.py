@@ -0,0 +1,113 @@
+"""
+Прогрев кэша после входа и упреждающая загрузка
+Пока браузер идет по редиректу от callback к dashboard, секции первой отрисовки
+уже запрашиваются в фоне. Следом загружается то, что пользователь вероятно откроет
+дальше: первые плейлисты целиком и страницы исполнителей текущего трека.
+Упреждающие запросы тратят бюджет пользователя и не повторяются, пока результат свежий
+"""
+
+import os
+import time
+import logging
+import threading
+import requests
+from concurrency import get_background_executor
+from scheduler import RateLimited, TokenBucket
+from metrics import worker_metrics
+
+logger = logging.getLogger(__name__)
+
+# Бюджет упреждающей загрузки: не больше N запросов к Spotify на пользователя
+# за PREFETCH_BUDGET_WINDOW секунд (в каждом воркере)
+PREFETCH_BUDGET = float(os.getenv('PREFETCH_BUDGET', '30'))
+PREFETCH_BUDGET_WINDOW = float(os.getenv('PREFETCH_BUDGET_WINDOW', '300'))
+# Через сколько секунд одну и ту же загрузку можно повторить
+PREFETCH_REPEAT_INTERVAL = float(os.getenv('PREFETCH_REPEAT_INTERVAL', '300'))
+# Сколько первых плейлистов пользователя загружать целиком
+PREFETCH_PLAYLISTS = int(os.getenv('PREFETCH_PLAYLISTS', '3'))
+# Сколько исполнителей текущего трека загружать
+PREFETCH_ARTISTS = 2
+
+
+class Prefetcher:
+    """Фоновые загрузки в кэш с бюджетом на пользователя
+
+    Задача получает оценку стоимости (запросов к Spotify) и возвращает, сколько
+    запросов сделала на самом деле: попадания в кэш возвращаются в бюджет.
+    Повтор той же задачи в течение PREFETCH_REPEAT_INTERVAL пропускается
+    """
+
+    def __init__(self, budget=PREFETCH_BUDGET, window=PREFETCH_BUDGET_WINDOW,
+                 repeat_interval=PREFETCH_REPEAT_INTERVAL):
+        self.budget = budget
+        self.window = window
+        self.repeat_interval = repeat_interval
+        self._budgets = {}
+        self._recent = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, user_id):
+        bucket = self._budgets.get(user_id)
+        if bucket is None:
+            bucket = self._budgets[user_id] = TokenBucket(self.budget / self.window, self.budget)
+        return bucket
+
+    def _prune(self, now):
+        # Старые отметки и полные бюджеты хранить незачем
+        for key, started in list(self._recent.items()):
+            if now - started >= self.repeat_interval:
+                del self._recent[key]
+        for user_id, bucket in list(self._budgets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._budgets[user_id]
+
+    def submit(self, user_id, key, cost, fn, *args):
+        """Ставит загрузку fn(*args) в пул фоновых загрузок; False - пропущена
+
+        Пропускаются повторы и загрузки, на которые у пользователя не хватает бюджета
+        """
+        kind = key.partition(':')[0]
+        now = time.monotonic()
+        with self._lock:
+            started = self._recent.get((user_id, key))
+            if started is not None and now - started < self.repeat_interval:
+                return False
+            bucket = self._bucket(user_id)
+            bucket.refill(now)
+            if bucket.tokens < cost:
+                worker_metrics.prefetch(kind, 'over_budget')
+                return False
+            bucket.tokens -= cost
+            if len(self._recent) > 10000:
+                self._prune(now)
+            self._recent[(user_id, key)] = now
+        worker_metrics.prefetch(kind, 'started')
+        get_background_executor().submit(self._run, user_id, key, kind, cost, fn, args)
+        return True
+
+    def _run(self, user_id, key, kind, cost, fn, args):
+        try:
+            spent = fn(*args)
+        except RateLimited:
+            # Лимит нужен запросам пользователя: загрузка не состоялась,
+            # ее можно повторить при следующем поводе
+            worker_metrics.prefetch(kind, 'rate_limited')
+            with self._lock:
+                self._recent.pop((user_id, key), None)
+            return
+        except requests.RequestException as error:
+            worker_metrics.prefetch(kind, 'failed')
+            logger.debug('Prefetch %s failed: %s', kind, error)
+            return
+        except Exception:
+            worker_metrics.prefetch(kind, 'failed')
+            logger.exception('Prefetch %s failed', kind)
+            return
+        if spent is not None and spent < cost:
+            with self._lock:
+                bucket = self._bucket(user_id)
+                bucket.tokens = min(bucket.capacity, bucket.tokens + cost - spent)
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,211 @@
+"""
+Проекция ответов Spotify
+Маршруты отдают только поля, которые читает dashboard.js: без available_markets,
+external_urls, href и прочего. Параметр fields= (синтаксис как у Spotify:
+items(track(name,album(images)))) задает свой набор полей, fields=* - полный ответ
+"""
+
+import os
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+# Сколько байт готовых проекций тел ответов держать в памяти воркера
+PROJECTION_CACHE_MAX_BYTES = int(os.getenv('PROJECTION_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+MAX_FIELDS_LENGTH = 1000
+
+
+class InvalidFields(ValueError):
+    """Параметр fields не разбирается"""
+
+
+TRACK = 'id,name,uri,duration_ms,explicit,artists(id,name),album(id,name,images,release_date)'
+ARTIST = 'id,name,uri,images,genres,popularity,followers(total)'
+ALBUM = 'id,name,uri,album_type,images,release_date,total_tracks,artists(id,name)'
+PLAYLIST = 'id,name,uri,description,images,snapshot_id,owner(id,display_name),tracks(total)'
+PAGING = 'total,limit,offset,next'
+
+# Форма ответа по умолчанию для каждого ресурса
+DEFAULT_FIELDS = {
+    'profile': 'id,display_name,email,images,country,product',
+    'playlists': f'items({PLAYLIST}),{PAGING}',
+    'liked_tracks': f'items(added_at,track({TRACK})),{PAGING}',
+    'recently_played': f'items(played_at,track({TRACK})),next,cursors',
+    # Без progress_ms и timestamp: тело меняется только со сменой трека или паузой,
+    # и опрос с If-None-Match получает 304
+    'currently_playing': f'is_playing,currently_playing_type,item({TRACK})',
+    'player_state': f'is_playing,progress_ms,shuffle_state,repeat_state,timestamp,'
+                    f'device(id,name,type,volume_percent),item({TRACK})',
+    'recommendations': f'tracks({TRACK})',
+    'search': f'tracks(items({TRACK}),total),artists(items({ARTIST}),total),'
+              f'albums(items({ALBUM}),total),playlists(items({PLAYLIST}),total)',
+    'artist': ARTIST,
+    'artists': f'artists({ARTIST})',
+    'album': f'{ALBUM},label,tracks(items({TRACK}),total)',
+    'albums': f'albums({ALBUM},label,tracks(items({TRACK}),total))',
+    'artist_top_tracks': f'tracks({TRACK})',
+    'playlist': f'{PLAYLIST},public,collaborative,followers(total),tracks(items(added_at,track({TRACK})),total)',
+    # Элементы потоков NDJSON
+    'liked_track_item': f'added_at,track({TRACK})',
+    'playlist_item': PLAYLIST,
+    'playlist_track_item': f'added_at,track({TRACK})',
+}
+
+
+@lru_cache(maxsize=256)
+def parse_fields(fields):
+    """Дерево полей {имя: поддерево или None}; None - поле целиком"""
+    if len(fields) > MAX_FIELDS_LENGTH:
+        raise InvalidFields('fields is too long')
+    tree, position = _parse_group(fields, 0)
+    if position != len(fields):
+        raise InvalidFields(f'Unexpected {fields[position]!r} in fields')
+    return tree
+
+
+def _parse_group(fields, position):
+    tree = {}
+    while True:
+        start = position
+        while position < len(fields) and fields[position] not in ',()':
+            position += 1
+        path = fields[start:position].strip()
+        if not path:
+            raise InvalidFields('Empty field name in fields')
+        subtree = None
+        if position < len(fields) and fields[position] == '(':
+            subtree, position = _parse_group(fields, position + 1)
+            if position >= len(fields) or fields[position] != ')':
+                raise InvalidFields('Unbalanced parentheses in fields')
+            position += 1
+        _insert(tree, path.split('.'), subtree)
+        if position < len(fields) and fields[position] == ',':
+            position += 1
+            continue
+        return tree, position
+
+
+def _insert(tree, names, subtree):
+    # a.b.c - то же самое, что a(b(c))
+    for name in names[:-1]:
+        node = tree.get(name, {})
+        if node is None:
+            return
+        tree = tree.setdefault(name, node)
+    name = names[-1]
+    if subtree is None or tree.get(name, {}) is None:
+        tree[name] = None
+    else:
+        existing = tree.setdefault(name, {})
+        for key, value in subtree.items():
+            _insert(existing, [key], value)
+
+
+def project(value, tree):
+    """Оставляет в value только поля из tree; списки проецируются поэлементно"""
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {name: project(value[name], subtree) for name, subtree in tree.items() if name in value}
+    return value
+
+
+class Shape:
+    """Набор полей ответа; full - ответ без изменений"""
+
+    def __init__(self, fields, tree=None):
+        self.fields = fields
+        self.full = fields == '*'
+        if tree is None and not self.full:
+            tree = parse_fields(fields)
+        self.tree = tree
+
+    def apply(self, value):
+        return value if self.full else project(value, self.tree)
+
+    def dumps(self, value):
+        return json.dumps(self.apply(value), separators=(',', ':')).encode('utf-8')
+
+    def body(self, body, version=None):
+        """Проекция готового JSON тела; результат запоминается по телу ответа
+
+        version - готовый идентификатор содержимого (например, snapshot_id),
+        с ним большое тело не приходится хранить и сравнивать
+        """
+        if self.full or body is None:
+            return body
+        return projected_bodies.get(self, body, version)
+
+    def child(self, *names):
+        """Форма вложенного поля или None, если поле не запрошено"""
+        if self.full:
+            return self
+        tree = self.tree
+        for name in names:
+            if name not in tree:
+                return None
+            tree = tree[name]
+            if tree is None:
+                return FULL
+        return Shape(f"{self.fields}/{'.'.join(names)}", tree)
+
+    def without(self, name):
+        """Та же форма без поля name (оно подставляется отдельно)"""
+        if self.full:
+            return self
+        tree = {key: subtree for key, subtree in self.tree.items() if key != name}
+        return Shape(f"{self.fields}/-{name}", tree)
+
+    def wants(self, name):
+        return self.full or name in self.tree
+
+
+FULL = Shape('*')
+
+
+def response_shape(resource, fields=None):
+    """Форма ответа ресурса: из параметра fields или по умолчанию"""
+    return Shape(fields or DEFAULT_FIELDS[resource])
+
+
+class ProjectedBodies:
+    """LRU готовых проекций: тело из кэша ответов проецируется один раз,
+    повторные запросы отдают сохраненные байты без разбора JSON"""
+
+    def __init__(self, max_bytes=PROJECTION_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, shape, body, version=None):
+        # Ключ - само тело (или version), а не его хэш: память общая для всех
+        # пользователей, и совпадение хэшей не должно отдать чужую проекцию.
+        # Тело в ключе тоже занимает память и учитывается в размере
+        if version is not None:
+            key, cost = (shape.fields, version), 0
+        else:
+            key, cost = (shape.fields, body), len(body)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+        projected = shape.dumps(json.loads(body))
+        cost += len(projected)
+        if cost > self.max_bytes:
+            return projected
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (projected, cost)
+                self.size += cost
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+        return projected
+
+
+projected_bodies = ProjectedBodies()
@@ -0,0 +1,191 @@
+"""
+Предвычисленные рекомендации
+Фоновая задача воркера периодически проверяет seed (любимые треки, недавно
+прослушанное, топ исполнителей) активных пользователей и пересчитывает
+рекомендации, когда seed изменились или результат устарел
+"""
+
+import os
+import json
+import time
+import threading
+from storage import DATA_DIR, SQLiteDatabase
+from spotify_client import get_client
+from scheduler import BACKGROUND, RateLimited
+from token_manager import UserToken, REFRESH_MARGIN
+
+RECOMMENDATIONS_DB_PATH = os.getenv('RECOMMENDATIONS_DB_PATH', os.path.join(DATA_DIR, 'recommendations.db'))
+# Как часто проверять seed пользователя и как долго рекомендации считаются свежими
+SEED_CHECK_INTERVAL = int(os.getenv('RECOMMENDATIONS_SEED_CHECK_INTERVAL', str(15 * 60)))
+RECOMMENDATIONS_MAX_AGE = int(os.getenv('RECOMMENDATIONS_MAX_AGE', str(6 * 3600)))
+# Пользователи без запросов дольше этого времени из фоновой задачи выбывают
+ACTIVE_WINDOW = 3600
+JOB_TICK = 30
+
+RECOMMENDATIONS_LIMIT = 20
+# Запросов к Spotify на один пересчет: три источника seed и /recommendations
+COMPUTE_REQUESTS = 4
+
+
+class RecommendationsStore:
+    """Рекомендации пользователей в общем для воркеров файле SQLite"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS recommendations (
+            user_id TEXT PRIMARY KEY,
+            seeds TEXT NOT NULL,
+            body BLOB NOT NULL,
+            computed_at REAL NOT NULL,
+            checked_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path=RECOMMENDATIONS_DB_PATH):
+        self.db = SQLiteDatabase(path, self.SCHEMA)
+
+    def get(self, user_id):
+        """(seeds, тело, computed_at, checked_at) или None"""
+        return self.db.execute(
+            'SELECT seeds, body, computed_at, checked_at FROM recommendations WHERE user_id = ?',
+            (user_id,)).fetchone()
+
+    def put(self, user_id, seeds, body):
+        now = time.time()
+        self.db.execute(
+            'INSERT OR REPLACE INTO recommendations (user_id, seeds, body, computed_at, checked_at) '
+            'VALUES (?, ?, ?, ?, ?)', (user_id, seeds, body, now, now))
+
+    def touch(self, user_id, checked_at=None):
+        if checked_at is None:
+            checked_at = time.time()
+        self.db.execute('UPDATE recommendations SET checked_at = ? WHERE user_id = ?', (checked_at, user_id))
+
+
+def _ids(response, extract):
+    if response.status_code != 200:
+        return []
+    return [entity_id for entity_id in map(extract, response.json().get('items') or ()) if entity_id]
+
+
+def select_seeds(token, priority=BACKGROUND):
+    """Seed для /recommendations: до 5 штук из трех источников
+
+    Возвращает (seed_tracks, seed_artists). Источник, который не ответил,
+    просто пропускается
+    """
+    client = get_client()
+    liked = _ids(client.get('/me/tracks', token=token, params={'limit': 5}, priority=priority),
+                 lambda item: (item.get('track') or {}).get('id'))
+    recent = _ids(client.get('/me/player/recently-played', token=token, params={'limit': 10}, priority=priority),
+                  lambda item: (item.get('track') or {}).get('id'))
+    top_artists = _ids(client.get('/me/top/artists', token=token,
+                                  params={'limit': 5, 'time_range': 'short_term'}, priority=priority),
+                       lambda artist: artist.get('id'))
+
+    # Свежие любимые и недавно прослушанные треки плюс пара топ исполнителей
+    tracks = list(dict.fromkeys(liked[:2] + recent[:2]))
+    artists = top_artists[:2]
+    tracks = tracks[:5 - len(artists)]
+    return tracks, artists
+
+
+def seeds_signature(tracks, artists):
+    return ','.join(sorted(tracks)) + '|' + ','.join(sorted(artists))
+
+
+def compute(token, priority=BACKGROUND, seeds=None):
+    """Seed и рекомендации по ним: (подпись seed, тело или None, код ответа)"""
+    tracks, artists = seeds or select_seeds(token, priority)
+    signature = seeds_signature(tracks, artists)
+    if not tracks and not artists:
+        # Истории прослушивания нет - рекомендовать не на чем
+        return signature, None, 400
+    params = {'limit': RECOMMENDATIONS_LIMIT, 'market': 'from_token'}
+    if tracks:
+        params['seed_tracks'] = ','.join(tracks)
+    if artists:
+        params['seed_artists'] = ','.join(artists)
+    response = get_client().get('/recommendations', token=token, params=params, priority=priority)
+    if response.status_code != 200:
+        return signature, None, response.status_code
+    return signature, response.content, 200
+
+
+class RecommendationsJob:
+    """Фоновый пересчет рекомендаций активных пользователей воркера"""
+
+    def __init__(self, store):
+        self.store = store
+        self._users = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def track(self, user_id, token):
+        """Отмечает пользователя активным; токен копируется без refresh token
+
+        Фоновая задача не обновляет токены сама: ротация refresh token
+        в фоне разошлась бы с сессией пользователя
+        """
+        if user_id is None:
+            return
+        copy = UserToken(token.access_token, None, token.expires_at, user_id)
+        with self._lock:
+            self._users[user_id] = (copy, time.time())
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self.run, name='recommendations', daemon=True)
+                self._thread.start()
+
+    def liked_tracks_seen(self, user_id, body):
+        """Свежий ответ /me/tracks: если новые любимые треки не среди seed,
+        пользователь проверяется на ближайшем проходе задачи"""
+        row = self.store.get(user_id)
+        if row is None:
+            return
+        seed_tracks = row[0].split('|')[0].split(',')
+        items = json.loads(body).get('items') or ()
+        latest = [(item.get('track') or {}).get('id') for item in items[:2]]
+        if any(track_id and track_id not in seed_tracks for track_id in latest):
+            self.store.touch(user_id, checked_at=0)
+
+    def run(self):
+        while True:
+            time.sleep(JOB_TICK)
+            now = time.time()
+            with self._lock:
+                for user_id, (_, seen_at) in list(self._users.items()):
+                    if now - seen_at > ACTIVE_WINDOW:
+                        del self._users[user_id]
+                users = list(self._users.items())
+            for user_id, (token, _) in users:
+                try:
+                    self.refresh_if_due(user_id, token)
+                except RateLimited:
+                    # Лимит занят интерактивными запросами - досчитаем на следующем проходе
+                    break
+                except Exception:
+                    continue
+
+    def refresh_if_due(self, user_id, token):
+        if token.expires_at - time.time() < REFRESH_MARGIN:
+            return
+        row = self.store.get(user_id)
+        now = time.time()
+        # Первую запись создает запрос пользователя; другой воркер мог
+        # только что проверить этого пользователя
+        if row is None or now - row[3] < SEED_CHECK_INTERVAL:
+            return
+        seeds = None
+        if now - row[2] < RECOMMENDATIONS_MAX_AGE:
+            seeds = select_seeds(token)
+            if seeds_signature(*seeds) == row[0]:
+                self.store.touch(user_id)
+                return
+        signature, body, _ = compute(token, seeds=seeds)
+        if body is not None:
+            self.store.put(user_id, signature, body)
+
+
+recommendations_store = RecommendationsStore()
+recommendations_job = RecommendationsJob(recommendations_store)
@@ -0,0 +1,160 @@
+"""
+Планировщик запросов к Spotify с учетом лимитов
+Token bucket на приложение и на пользователя, приоритеты запросов
+и соблюдение Retry-After после ответа 429
+"""
+
+import os
+import time
+import threading
+from cache import response_cache
+
+# Приоритеты: команды плеера важнее обычных запросов, фоновые - последние
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+
+# Лимиты на процесс воркера (запросов в секунду и размер всплеска)
+APP_RATE = float(os.getenv('SPOTIFY_APP_RATE', '10'))
+APP_BURST = float(os.getenv('SPOTIFY_APP_BURST', '30'))
+USER_RATE = float(os.getenv('SPOTIFY_USER_RATE', '3'))
+# Всплеск пользователя вмещает холодный bootstrap (профиль, пять секций и четыре
+# запроса рекомендаций) в долю, доступную обычному приоритету
+USER_BURST = float(os.getenv('SPOTIFY_USER_BURST', '15'))
+
+# Доля корзины, которую приоритет не может израсходовать: фоновые запросы
+# останавливаются раньше и оставляют запас для интерактивных
+RESERVE = {INTERACTIVE: 0.0, NORMAL: 0.2, BACKGROUND: 0.5}
+# Сколько запрос готов ждать в очереди, прежде чем получит отказ
+MAX_WAIT = {INTERACTIVE: 3.0, NORMAL: 1.0, BACKGROUND: 0.25}
+
+# Как часто сверяться с блокировкой по Retry-After, записанной другими воркерами
+SHARED_CHECK_INTERVAL = 1.0
+BLOCKED_KEY = 'ratelimit:blocked_until'
+
+
+class RateLimited(Exception):
+    """Запрос не отправлен: лимит исчерпан или Spotify попросил подождать"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Spotify rate limit, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, reserve):
+        """Сколько токенов может взять приоритет с данным резервом"""
+        return self.tokens - self.capacity * reserve
+
+    def wait_time(self, reserve):
+        """Через сколько секунд приоритету станет доступен токен"""
+        missing = 1 - self.available(reserve)
+        return max(missing, 0) / self.rate
+
+
+class Scheduler:
+    """Допуск запросов к Spotify по лимитам приложения и пользователя"""
+
+    def __init__(self, shared_state=None):
+        self.app_bucket = TokenBucket(APP_RATE, APP_BURST)
+        self.user_buckets = {}
+        self.blocked_until = 0.0
+        self.shed = 0
+        self.shared_state = shared_state
+        self._shared_checked = 0.0
+        self._cond = threading.Condition()
+
+    def _user_bucket(self, user_id):
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            if len(self.user_buckets) > 10000:
+                # Полные корзины неактивных пользователей хранить незачем
+                now = time.monotonic()
+                for key, old in list(self.user_buckets.items()):
+                    old.refill(now)
+                    if old.tokens >= old.capacity:
+                        del self.user_buckets[key]
+            bucket = self.user_buckets[user_id] = TokenBucket(USER_RATE, USER_BURST)
+        return bucket
+
+    def _sync_shared_block(self, now):
+        if self.shared_state is None or now - self._shared_checked < SHARED_CHECK_INTERVAL:
+            return
+        self._shared_checked = now
+        value = self.shared_state.get(BLOCKED_KEY)
+        if value is not None:
+            # В общем хранилище время на часах системы, локально - monotonic
+            remaining = float(value) - time.time()
+            if remaining > 0:
+                self.blocked_until = max(self.blocked_until, now + remaining)
+
+    def acquire(self, user_id=None, priority=NORMAL):
+        """Ждет разрешения на запрос или бросает RateLimited"""
+        reserve = RESERVE[priority]
+        deadline = time.monotonic() + MAX_WAIT[priority]
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._sync_shared_block(now)
+                buckets = [self.app_bucket]
+                if user_id is not None:
+                    buckets.append(self._user_bucket(user_id))
+                for bucket in buckets:
+                    bucket.refill(now)
+
+                if self.blocked_until > now:
+                    wait = self.blocked_until - now
+                else:
+                    wait = max(bucket.wait_time(reserve) for bucket in buckets)
+                    if wait == 0:
+                        for bucket in buckets:
+                            bucket.tokens -= 1
+                        return
+
+                if now + wait > deadline:
+                    self.shed += 1
+                    raise RateLimited(wait)
+                self._cond.wait(wait)
+
+    def observe(self, response):
+        """Учитывает ответ Spotify: после 429 блокирует запросы на Retry-After"""
+        if response.status_code != 429:
+            return None
+        try:
+            retry_after = float(response.headers.get('Retry-After', 1))
+        except ValueError:
+            retry_after = 1.0
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.app_bucket.tokens = 0
+        if self.shared_state is not None:
+            self.shared_state.set(BLOCKED_KEY, str(time.time() + retry_after).encode(), retry_after)
+        return retry_after
+
+
+_scheduler = None
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Планировщик процесса (блокировки по 429 видны всем воркерам через общий кэш)"""
+    global _scheduler, _scheduler_pid
+    scheduler = _scheduler
+    if scheduler is not None and _scheduler_pid == os.getpid():
+        return scheduler
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_pid != os.getpid():
+            _scheduler = Scheduler(response_cache.backend)
+            _scheduler_pid = os.getpid()
+        return _scheduler
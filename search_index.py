@@ -0,0 +1,205 @@
+"""
+Локальный поисковый индекс по библиотеке пользователя
+Строится по мере прихода ответов Spotify (любимые треки, плейлисты,
+недавно прослушанное) и отвечает на запросы typeahead без обращения к API
+"""
+
+import os
+import re
+import json
+import bisect
+import itertools
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+# Сколько индексов пользователей держать в памяти воркера
+SEARCH_INDEX_MAX_USERS = int(os.getenv('SEARCH_INDEX_MAX_USERS', '200'))
+
+KINDS = ('tracks', 'artists', 'albums')
+# Префиксы до этой длины хранятся готовыми постингами: короткий запрос
+# при наборе - самый частый и иначе затрагивает тысячи токенов словаря
+SHORT_PREFIX = 3
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Нижний регистр без диакритики: 'Beyoncé' -> 'beyonce'"""
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text or ''))
+
+
+def _names(objects):
+    return ' '.join(obj.get('name') or '' for obj in objects or ())
+
+
+def _compact_artist(artist):
+    return {'id': artist.get('id'), 'name': artist.get('name'), 'uri': artist.get('uri'),
+            'images': artist.get('images') or [], 'genres': artist.get('genres') or []}
+
+
+def _compact_album(album):
+    return {'id': album.get('id'), 'name': album.get('name'), 'uri': album.get('uri'),
+            'images': album.get('images') or [], 'release_date': album.get('release_date'),
+            'artists': [{'id': a.get('id'), 'name': a.get('name')} for a in album.get('artists') or ()]}
+
+
+def _compact_track(track):
+    return {'id': track.get('id'), 'name': track.get('name'), 'uri': track.get('uri'),
+            'duration_ms': track.get('duration_ms'),
+            'artists': [{'id': a.get('id'), 'name': a.get('name')} for a in track.get('artists') or ()],
+            'album': _compact_album(track.get('album') or {})}
+
+
+class LibraryIndex:
+    """Инвертированный индекс треков, исполнителей и альбомов одного пользователя
+
+    Постинги - массивы array('I') с возрастающими номерами документов,
+    префиксы ищутся бинарным поиском по отсортированному словарю токенов
+    """
+
+    def __init__(self):
+        self.docs = []              # номер документа -> (вид, объект Spotify, токены)
+        self.ids = {}               # (вид, Spotify ID) -> номер документа
+        self.postings = {}          # токен -> array номеров документов
+        self.prefixes = {}          # короткий префикс -> array номеров документов
+        self.seeded = False
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _add(self, kind, obj, text):
+        key = (kind, obj.get('id'))
+        if key[1] is None or key in self.ids:
+            return
+        doc = len(self.docs)
+        tokens = tuple(set(tokenize(text)))
+        self.ids[key] = doc
+        self.docs.append((kind, obj, tokens))
+        for token in tokens:
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = array('I')
+                self._vocabulary_dirty = True
+            postings.append(doc)
+        for prefix in {token[:length] for token in tokens for length in range(1, SHORT_PREFIX + 1)}:
+            postings = self.prefixes.get(prefix)
+            if postings is None:
+                postings = self.prefixes[prefix] = array('I')
+            postings.append(doc)
+
+    def add_tracks(self, tracks):
+        """Добавляет треки вместе с их исполнителями и альбомами"""
+        with self._lock:
+            for track in tracks:
+                if not track or track.get('type', 'track') != 'track':
+                    continue
+                album = track.get('album') or {}
+                self._add('tracks', _compact_track(track),
+                          f"{track.get('name')} {_names(track.get('artists'))} {album.get('name') or ''}")
+                for artist in track.get('artists') or ():
+                    self._add('artists', _compact_artist(artist), artist.get('name'))
+                if album:
+                    self._add('albums', _compact_album(album),
+                              f"{album.get('name')} {_names(album.get('artists'))}")
+
+    def add_items(self, items):
+        """Элементы страниц Spotify вида {'track': {...}} (любимые, плейлист, история)"""
+        self.add_tracks(item.get('track') for item in items or () if item)
+
+    def _prefix_postings(self, prefix):
+        """Номера документов со словами на prefix по возрастанию (могут повторяться)"""
+        if len(prefix) <= SHORT_PREFIX:
+            return self.prefixes.get(prefix, ())
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self.postings)
+            self._vocabulary_dirty = False
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, prefix)
+        end = bisect.bisect_left(vocabulary, prefix + '\uffff', start)
+        matched = set()
+        for token in vocabulary[start:end]:
+            if token != prefix:
+                matched.update(self.postings[token])
+        return sorted(matched)
+
+    def search(self, query, limit=20):
+        """Документы, в которых каждый токен запроса - префикс какого-то слова
+
+        Сначала точные совпадения самого длинного токена, затем префиксные,
+        внутри - в порядке добавления. Постинги сливаются лениво, поэтому
+        обход останавливается, как только набрано limit результатов каждого вида
+        """
+        tokens = sorted(set(tokenize(query)), key=len, reverse=True)
+        results = {kind: [] for kind in KINDS}
+        if not tokens:
+            return results
+        primary, rest = tokens[0], tokens[1:]
+        with self._lock:
+            exact = self.postings.get(primary, ())
+            candidates = itertools.chain(exact, self._prefix_postings(primary))
+            seen = set(exact)
+            remaining = len(KINDS)
+            for position, doc in enumerate(candidates):
+                if position >= len(exact):
+                    if doc in seen:
+                        continue
+                    seen.add(doc)
+                kind, obj, doc_tokens = self.docs[doc]
+                found = results[kind]
+                if len(found) >= limit:
+                    continue
+                if rest and not all(any(word.startswith(token) for word in doc_tokens) for token in rest):
+                    continue
+                found.append(obj)
+                if len(found) == limit:
+                    remaining -= 1
+                    if not remaining:
+                        break
+        return results
+
+
+# Где лежат элементы с треками в ответах Spotify, из которых строится индекс
+LIBRARY_SOURCES = {
+    'liked_tracks': lambda data: data.get('items'),
+    'recently_played': lambda data: data.get('items'),
+}
+
+
+def index_body(index, resource, body):
+    """Добавляет в индекс треки из тела ответа Spotify (bytes)"""
+    index.add_items(LIBRARY_SOURCES[resource](json.loads(body)))
+
+
+class SearchIndexes:
+    """Индексы пользователей процесса, вытесняются по LRU"""
+
+    def __init__(self, max_users=SEARCH_INDEX_MAX_USERS):
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = self._indexes[user_id] = LibraryIndex()
+                while len(self._indexes) > self.max_users:
+                    self._indexes.popitem(last=False)
+            else:
+                self._indexes.move_to_end(user_id)
+            return index
+
+
+search_indexes = SearchIndexes()
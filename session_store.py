@@ -0,0 +1,147 @@
+"""
+Серверные сессии
+В cookie только непрозрачный ID, данные сессии (токены Spotify, code_verifier)
+лежат в общем для воркеров файле SQLite с LRU копией в памяти воркера
+"""
+
+import os
+import time
+import random
+import secrets
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+from werkzeug.datastructures import CallbackDict
+from storage import DATA_DIR, SQLiteDatabase
+from cache import MemoryBackend
+
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', os.path.join(DATA_DIR, 'sessions.db'))
+# Сессия без запросов дольше этого срока удаляется
+SESSION_LIFETIME = int(os.getenv('SESSION_LIFETIME', str(30 * 24 * 3600)))
+# Сколько секунд воркер доверяет своей копии сессии без чтения общего файла.
+# Запись (например, обновленный токен) другого воркера видна не позже этого срока
+SESSION_LOCAL_TTL = float(os.getenv('SESSION_LOCAL_TTL', '5'))
+SESSION_LOCAL_MAX_BYTES = int(os.getenv('SESSION_LOCAL_MAX_BYTES', str(16 * 1024 * 1024)))
+
+
+class SessionStore:
+    """Данные сессий по ID: MemoryBackend воркера поверх общего SQLite
+
+    Срок жизни скользящий: expires_at продлевается при записи и не чаще раза
+    в TOUCH_INTERVAL при чтении. Просроченные сессии удаляются примерно на
+    каждой SWEEP_EVERY записи
+    """
+
+    TOUCH_INTERVAL = 3600
+    SWEEP_EVERY = 128
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            sid TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+    """
+
+    def __init__(self, path=SESSION_DB_PATH, lifetime=SESSION_LIFETIME, local_ttl=SESSION_LOCAL_TTL):
+        self.db = SQLiteDatabase(path, self.SCHEMA)
+        self.local = MemoryBackend(SESSION_LOCAL_MAX_BYTES)
+        self.lifetime = lifetime
+        self.local_ttl = local_ttl
+
+    def get(self, sid):
+        """Сериализованные данные сессии или None"""
+        data, expires_at = self.local.get_with_expiry(sid)
+        if data is None:
+            row = self.db.execute('SELECT data, expires_at FROM sessions WHERE sid = ?', (sid,)).fetchone()
+            if row is None:
+                return None
+            data, expires_at = row
+            self.local.set(sid, data, self.local_ttl, expires_at)
+        now = time.time()
+        if expires_at < now:
+            return None
+        if expires_at - now < self.lifetime - self.TOUCH_INTERVAL:
+            expires_at = now + self.lifetime
+            self.db.execute('UPDATE sessions SET expires_at = ? WHERE sid = ?', (expires_at, sid))
+            self.local.set(sid, data, self.local_ttl, expires_at)
+        return data
+
+    def set(self, sid, data):
+        expires_at = time.time() + self.lifetime
+        self.db.execute('INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)',
+                        (sid, data, expires_at))
+        self.local.set(sid, data, self.local_ttl, expires_at)
+        if random.randrange(self.SWEEP_EVERY) == 0:
+            self.sweep()
+
+    def delete(self, sid):
+        self.db.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+        self.local.delete(sid)
+
+    def sweep(self):
+        """Удаляет просроченные сессии"""
+        self.db.execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Сессия с ID; modified выставляется при любом изменении словаря"""
+
+    def __init__(self, initial=None, sid=None):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.modified = False
+        self.rotate = False
+
+    def regenerate(self):
+        """Новый ID при сохранении (после входа), старый удаляется"""
+        self.rotate = True
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask SessionInterface поверх SessionStore"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSession(self.serializer.loads(data.decode('utf-8')), sid)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        response.vary.add('Cookie')
+
+        if not session:
+            # Пустая сессия (logout) не хранится
+            if session.sid is not None and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        new_sid = session.sid is None or session.rotate
+        if new_sid:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.rotate = False
+        self.store.set(session.sid, self.serializer.dumps(dict(session)).encode('utf-8'))
+        if new_sid:
+            response.set_cookie(
+                name, session.sid, expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
@@ -0,0 +1,162 @@
+"""
+Общий HTTP клиент для Spotify API
+Держит пул keep-alive соединений на процесс воркера, чтобы не платить
+за TCP+TLS рукопожатие на каждый запрос
+"""
+
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from scheduler import get_scheduler, RateLimited, NORMAL, INTERACTIVE, MAX_WAIT
+from circuit_breaker import CircuitBreakers, endpoint_family
+from metrics import worker_metrics
+
+SPOTIFY_API_BASE = os.getenv('SPOTIFY_API_BASE', 'https://api.spotify.com/v1')
+SPOTIFY_TOKEN_URL = os.getenv('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+
+# Настройки пула и таймаутов (можно переопределить через окружение)
+POOL_SIZE = int(os.getenv('SPOTIFY_POOL_SIZE', '10'))
+CONNECT_TIMEOUT = float(os.getenv('SPOTIFY_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.getenv('SPOTIFY_READ_TIMEOUT', '10'))
+MAX_RETRIES = int(os.getenv('SPOTIFY_MAX_RETRIES', '2'))
+RETRY_BACKOFF = float(os.getenv('SPOTIFY_RETRY_BACKOFF', '0.2'))
+
+
+class SpotifyClient:
+    """Клиент Spotify API поверх requests.Session с пулом соединений"""
+
+    def __init__(self, base_url=SPOTIFY_API_BASE, pool_size=POOL_SIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF, scheduler=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        # Планировщик лимитов: запросы к API сначала получают у него разрешение
+        self.scheduler = scheduler
+        # Цепи по группам эндпоинтов: недоступная группа не держит воркеры на таймаутах
+        self.breakers = CircuitBreakers()
+
+        # Повторяем только сетевые ошибки и 5xx для идемпотентных методов,
+        # 429 обрабатывается выше по стеку
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=retry_backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'PUT', 'DELETE', 'HEAD', 'OPTIONS']),
+            raise_on_status=False,
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size,
+                              max_retries=retry, pool_block=False)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def url(self, path):
+        """Строит полный URL для пути API"""
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, access_token=None, token=None, priority=NORMAL, **kwargs):
+        """Выполняет запрос к Spotify через общий пул соединений
+
+        token - объект с методами get() и refresh(rejected): при ответе 401
+        токен обновляется и запрос повторяется один раз.
+        priority - приоритет для планировщика лимитов (scheduler.INTERACTIVE и др.)
+        """
+        if token is not None:
+            access_token = token.get()
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.url(path)
+        if not url.startswith(self.base_url):
+            # Запросы к accounts (обновление токена) идут мимо лимитов и цепей API
+            return self._send(method, url, access_token, kwargs)
+        user_id = getattr(token, 'user_id', None)
+        breaker = self.breakers.for_path(url[len(self.base_url):])
+
+        response = self._dispatch(method, url, access_token, kwargs, breaker, user_id, priority)
+        if response.status_code == 401 and token is not None and token.refresh(rejected=access_token):
+            response = self._dispatch(method, url, token.access_token, kwargs, breaker, user_id, priority)
+        return response
+
+    def _dispatch(self, method, url, access_token, kwargs, breaker, user_id, priority):
+        def send():
+            if self.scheduler is not None:
+                self.scheduler.acquire(user_id, priority)
+            # Цепь проверяется после очереди планировщика: ожидание лимита не считается сбоем
+            return breaker.call(lambda: self._send(method, url, access_token, kwargs))
+
+        response = send()
+        if self.scheduler is None:
+            return response
+        retry_after = self.scheduler.observe(response)
+        # Команду плеера пользователь ждет: если Spotify просит подождать недолго,
+        # повторяем ее сами вместо ошибки в браузере
+        if retry_after is not None and priority == INTERACTIVE and retry_after <= MAX_WAIT[INTERACTIVE]:
+            response = send()
+            retry_after = self.scheduler.observe(response)
+        if retry_after is not None:
+            # 429 не отдаем браузеру как есть: маршрут ответит с Retry-After
+            raise RateLimited(retry_after)
+        return response
+
+    def _send(self, method, url, access_token, kwargs):
+        if access_token:
+            kwargs = dict(kwargs)
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers['Authorization'] = f"Bearer {access_token}"
+            kwargs['headers'] = headers
+        family = endpoint_family(url[len(self.base_url):]) if url.startswith(self.base_url) else 'accounts'
+        with worker_metrics.upstream(family, method) as timer:
+            response = self.session.request(method, url, **kwargs)
+            timer.status = response.status_code
+        return response
+
+    def get(self, path, access_token=None, **kwargs):
+        return self.request('GET', path, access_token=access_token, **kwargs)
+
+    def put(self, path, access_token=None, **kwargs):
+        return self.request('PUT', path, access_token=access_token, **kwargs)
+
+    def post(self, path, access_token=None, **kwargs):
+        return self.request('POST', path, access_token=access_token, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def init_client(**kwargs):
+    """Создает клиент заново (вызывается в воркере gunicorn после fork)"""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        kwargs.setdefault('scheduler', get_scheduler())
+        _client = SpotifyClient(**kwargs)
+        _client_pid = os.getpid()
+    return _client
+
+
+def get_client():
+    """Возвращает клиент текущего процесса, пересоздавая его после fork"""
+    global _client, _client_pid
+    client = _client
+    if client is not None and _client_pid == os.getpid():
+        return client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            # Сокеты родительского процесса не закрываем - они принадлежат ему
+            _client = SpotifyClient(scheduler=get_scheduler())
+            _client_pid = os.getpid()
+        return _client
@@ -4,21 +4,96 @@ class GoatMusicApp {
         this.currentTrack = null;
         this.isPlaying = false;
         this.searchTimeout = null;
+        this.librarySearchTimeout = null;
+        this.searchQuery = '';
+        this.searchResultsQuery = null;
+        this.favoritesGeneration = 0;
         this.currentSection = 'home';
+        this.playerStream = null;
+        this.bootstrapData = null;
+        // Вкладка и номер ее команды плеера: сервер отклоняет обогнанные команды
+        this.playerClient = Math.random().toString(36).slice(2);
+        this.playerSeq = 0;
+        this.watchedCommand = null;
+        this.playerMessageTimeout = null;
+        // Последние ответы GET /api/* с их ETag: url -> { etag, data }
+        this.apiCache = new Map();
+        this.apiCacheLimit = 50;
         
         this.init();
     }
     
+    async apiGet(url) {
+        // GET с If-None-Match: неизмененные данные приходят как 304 без тела
+        // и берутся из памяти без повторного разбора JSON
+        const cached = this.apiCache.get(url);
+        const headers = cached ? { 'If-None-Match': cached.etag } : {};
+        const response = await fetch(url, { headers, cache: 'no-store' });
+        
+        if (response.status === 304 && cached) {
+            return { ok: true, status: 200, json: async () => cached.data };
+        }
+        const etag = response.headers.get('ETag');
+        if (!response.ok || !etag) {
+            return response;
+        }
+        
+        const data = await response.json();
+        this.apiCache.delete(url);
+        this.apiCache.set(url, { etag, data });
+        if (this.apiCache.size > this.apiCacheLimit) {
+            this.apiCache.delete(this.apiCache.keys().next().value);
+        }
+        return { ok: true, status: response.status, json: async () => data };
+    }
+    
     init() {
         this.setupEventListeners();
-        this.loadUserProfile();
-        this.loadCurrentTrack();
-        this.loadPlaylists();
+        this.loadBootstrap();
         this.setupNavigation();
         this.setupSearch();
         this.setupModal();
     }
     
+    async loadBootstrap() {
+        // Все данные первой отрисовки одним запросом, сервер собирает их параллельно
+        try {
+            const response = await this.apiGet('/api/bootstrap');
+            const data = await response.json();
+            
+            if (!response.ok) {
+                console.error('Bootstrap failed:', data.error);
+                return;
+            }
+            
+            this.bootstrapData = data;
+            const errors = data.errors || {};
+            Object.entries(errors).forEach(([section, error]) => {
+                console.error(`Failed to load ${section}:`, error.error);
+            });
+            // Секции из устаревшего кэша: Spotify сейчас не отвечает
+            Object.keys(data.stale || {}).forEach((section) => {
+                console.warn(`Showing cached ${section}, Spotify is unavailable`);
+            });
+            
+            if (data.profile) {
+                this.displayUserProfile(data.profile);
+            }
+            if (data.currently_playing) {
+                this.applyPlayerState(data.currently_playing);
+            } else {
+                this.clearCurrentTrack();
+            }
+            if (data.playlists) {
+                this.displayPlaylists(data.playlists.items || []);
+            }
+            this.displayRecentTracks(data.recently_played);
+            this.displayRecommendations(data.recommendations);
+        } catch (error) {
+            console.error('Bootstrap loading failed:', error);
+        }
+    }
+    
     setupEventListeners() {
         // Управление воспроизведением
         document.getElementById('play-btn')?.addEventListener('click', () => this.playTrack());
@@ -26,7 +101,34 @@ class GoatMusicApp {
         document.getElementById('next-btn')?.addEventListener('click', () => this.nextTrack());
         document.getElementById('prev-btn')?.addEventListener('click', () => this.previousTrack());
         
-        // Обновление текущего трека каждые 5 секунд
+        // Состояние плеера приходит с сервера через SSE, опрос - только запасной вариант
+        this.subscribePlayerState();
+    }
+    
+    subscribePlayerState() {
+        if (!window.EventSource) {
+            this.pollPlayerState();
+            return;
+        }
+        
+        this.playerStream = new EventSource('/api/stream/player-state');
+        this.playerStream.onmessage = (e) => {
+            const data = JSON.parse(e.data);
+            if (!data.error) {
+                this.applyPlayerState(data);
+            }
+        };
+        this.playerStream.onerror = () => {
+            // Ответ не 200 (sync воркеры отвечают 503) закрывает поток насовсем - переходим на опрос.
+            // Обычный обрыв EventSource переподключает сам
+            if (this.playerStream.readyState === EventSource.CLOSED) {
+                this.playerStream = null;
+                this.pollPlayerState();
+            }
+        };
+    }
+    
+    pollPlayerState() {
         setInterval(() => this.loadCurrentTrack(), 5000);
     }
     
@@ -92,12 +194,23 @@ class GoatMusicApp {
         searchInput.addEventListener('input', (e) => {
             const query = e.target.value.trim();
             
-            // Очищаем предыдущий таймаут
+            // Очищаем предыдущие таймауты
             if (this.searchTimeout) {
                 clearTimeout(this.searchTimeout);
             }
+            if (this.librarySearchTimeout) {
+                clearTimeout(this.librarySearchTimeout);
+            }
+            this.searchQuery = query;
+            
+            // Библиотека ищется локально на сервере - показываем ее почти сразу
+            this.librarySearchTimeout = setTimeout(() => {
+                if (query.length >= 2) {
+                    this.performLibrarySearch(query);
+                }
+            }, 100);
             
-            // Устанавливаем новый таймаут для поиска
+            // Поиск по каталогу Spotify - после паузы в наборе
             this.searchTimeout = setTimeout(() => {
                 if (query.length >= 2) {
                     this.performSearch(query);
@@ -108,13 +221,28 @@ class GoatMusicApp {
         });
     }
     
+    async performLibrarySearch(query) {
+        try {
+            const response = await this.apiGet(`/api/search?q=${encodeURIComponent(query)}&scope=library`);
+            const data = await response.json();
+            
+            // Не перетираем более полные результаты и ответы на устаревший запрос
+            if (response.ok && query === this.searchQuery && this.searchResultsQuery !== query) {
+                this.displaySearchResults({ query, library: data });
+            }
+        } catch (error) {
+            console.error('Library search failed:', error);
+        }
+    }
+    
     async performSearch(query) {
         try {
-            const response = await fetch(`/api/search?q=${encodeURIComponent(query)}`);
+            const response = await this.apiGet(`/api/search?q=${encodeURIComponent(query)}`);
             const data = await response.json();
             
-            if (response.ok) {
-                this.displaySearchResults(data);
+            if (response.ok && query === this.searchQuery) {
+                this.searchResultsQuery = query;
+                this.displaySearchResults({ query, ...data });
             } else {
                 console.error('Search error:', data.error);
             }
@@ -128,9 +256,23 @@ class GoatMusicApp {
         if (!searchResults) return;
         
         let html = '<div class="search-results-header">';
-        html += `<h3>Результаты поиска для "${data.query || 'запроса'}"</h3>`;
+        html += '<h3></h3>';
         html += '</div>';
         
+        const library = data.library || {};
+        const libraryItems = [
+            ...(library.tracks?.items || []).slice(0, 5).map(track => this.createTrackCard(track)),
+            ...(library.artists?.items || []).slice(0, 3).map(artist => this.createArtistCard(artist)),
+            ...(library.albums?.items || []).slice(0, 3).map(album => this.createAlbumCard(album))
+        ];
+        if (libraryItems.length > 0) {
+            html += '<div class="search-category">';
+            html += '<h4>В вашей библиотеке</h4>';
+            html += '<div class="tracks-grid">';
+            html += libraryItems.join('');
+            html += '</div></div>';
+        }
+        
         if (data.tracks && data.tracks.items.length > 0) {
             html += '<div class="search-category">';
             html += '<h4>Треки</h4>';
@@ -161,7 +303,7 @@ class GoatMusicApp {
             html += '</div></div>';
         }
         
-        if (!data.tracks?.items.length && !data.artists?.items.length && !data.albums?.items.length) {
+        if (!libraryItems.length && !data.tracks?.items.length && !data.artists?.items.length && !data.albums?.items.length) {
             html += '<div class="no-results">';
             html += '<i class="fas fa-search"></i>';
             html += '<p>Ничего не найдено</p>';
@@ -169,6 +311,9 @@ class GoatMusicApp {
         }
         
         searchResults.innerHTML = html;
+        // Запрос пользователя - только как текст, не как разметка
+        searchResults.querySelector('.search-results-header h3').textContent =
+            `Результаты поиска для "${data.query || 'запроса'}"`;
     }
     
     clearSearchResults() {
@@ -240,7 +385,7 @@ class GoatMusicApp {
     
     async loadUserProfile() {
         try {
-            const response = await fetch('/api/profile');
+            const response = await this.apiGet('/api/profile');
             const profile = await response.json();
             
             if (response.ok) {
@@ -268,14 +413,11 @@ class GoatMusicApp {
     
     async loadCurrentTrack() {
         try {
-            const response = await fetch('/api/currently-playing');
+            const response = await this.apiGet('/api/currently-playing');
             const data = await response.json();
             
-            if (response.ok && data.item) {
-                this.currentTrack = data.item;
-                this.isPlaying = data.is_playing;
-                this.displayCurrentTrack(data);
-                this.updatePlaybackControls();
+            if (response.ok) {
+                this.applyPlayerState(data);
             } else {
                 this.clearCurrentTrack();
             }
@@ -284,6 +426,21 @@ class GoatMusicApp {
         }
     }
     
+    applyPlayerState(data) {
+        if (data.predicted && (data.track_pending || !data.item)) {
+            // Предсказание без трека: новый трек придет из потока, пока меняем только кнопки
+            this.isPlaying = data.is_playing;
+            this.updatePlaybackControls();
+        } else if (data.item) {
+            this.currentTrack = data.item;
+            this.isPlaying = data.is_playing;
+            this.displayCurrentTrack(data);
+            this.updatePlaybackControls();
+        } else {
+            this.clearCurrentTrack();
+        }
+    }
+    
     displayCurrentTrack(data) {
         const currentTrackElement = document.getElementById('current-track');
         if (!currentTrackElement) return;
@@ -350,36 +507,71 @@ class GoatMusicApp {
         }
     }
     
+    async sendPlayerCommand(endpoint, method, body = null) {
+        // Сервер отвечает сразу предсказанным состоянием, настоящее приходит из потока
+        const response = await fetch(endpoint, {
+            method: method,
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ ...body, client: this.playerClient, seq: ++this.playerSeq })
+        });
+        
+        if (response.ok) {
+            const data = await response.json();
+            if (data.state) {
+                this.applyPlayerState(data.state);
+            }
+            if (data.id) {
+                this.watchCommand(data.id);
+            }
+            if (!this.playerStream) {
+                setTimeout(() => this.loadCurrentTrack(), 1000);
+            }
+        }
+        return response;
+    }
+    
+    async watchCommand(id) {
+        // Команда уходит в Spotify после ответа: ее итог (нет устройства, нет Premium)
+        // узнаем опросом. Следим только за последней командой
+        this.watchedCommand = id;
+        for (let attempt = 0; attempt < 20 && this.watchedCommand === id; attempt++) {
+            await new Promise((resolve) => setTimeout(resolve, 500));
+            const response = await fetch(`/api/player/commands/${id}`, { cache: 'no-store' });
+            if (!response.ok) {
+                return;
+            }
+            const command = await response.json();
+            if (command.status === 'failed') {
+                this.showPlayerMessage(command.error);
+            }
+            if (command.status !== 'pending') {
+                return;
+            }
+        }
+    }
+    
+    showPlayerMessage(message) {
+        const element = document.getElementById('player-message');
+        if (!element) {
+            return;
+        }
+        element.textContent = message;
+        element.hidden = false;
+        clearTimeout(this.playerMessageTimeout);
+        this.playerMessageTimeout = setTimeout(() => {
+            element.hidden = true;
+        }, 5000);
+    }
+    
     async playTrack(uri = null) {
         try {
-            let endpoint = '/api/play';
-            let method = 'PUT';
-            let body = null;
-            
             if (uri) {
-                body = JSON.stringify({ uri: uri });
+                await this.sendPlayerCommand('/api/play', 'PUT', { uri: uri });
             } else {
                 // Переключаем воспроизведение текущего трека
-                endpoint = this.isPlaying ? '/api/pause' : '/api/play';
-                method = 'PUT';
-            }
-            
-            const response = await fetch(endpoint, {
-                method: method,
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: body
-            });
-            
-            if (response.ok) {
-                if (uri) {
-                    // Обновляем текущий трек после небольшой задержки
-                    setTimeout(() => this.loadCurrentTrack(), 1000);
-                } else {
-                    this.isPlaying = !this.isPlaying;
-                    this.updatePlaybackControls();
-                }
+                await this.sendPlayerCommand(this.isPlaying ? '/api/pause' : '/api/play', 'PUT');
             }
         } catch (error) {
             console.error('Playback control failed:', error);
@@ -388,11 +580,7 @@ class GoatMusicApp {
     
     async pauseTrack() {
         try {
-            const response = await fetch('/api/pause', { method: 'PUT' });
-            if (response.ok) {
-                this.isPlaying = false;
-                this.updatePlaybackControls();
-            }
+            await this.sendPlayerCommand('/api/pause', 'PUT');
         } catch (error) {
             console.error('Pause failed:', error);
         }
@@ -400,10 +588,7 @@ class GoatMusicApp {
     
     async nextTrack() {
         try {
-            const response = await fetch('/api/next', { method: 'POST' });
-            if (response.ok) {
-                setTimeout(() => this.loadCurrentTrack(), 1000);
-            }
+            await this.sendPlayerCommand('/api/next', 'POST');
         } catch (error) {
             console.error('Next track failed:', error);
         }
@@ -411,10 +596,7 @@ class GoatMusicApp {
     
     async previousTrack() {
         try {
-            const response = await fetch('/api/previous', { method: 'POST' });
-            if (response.ok) {
-                setTimeout(() => this.loadCurrentTrack(), 1000);
-            }
+            await this.sendPlayerCommand('/api/previous', 'POST');
         } catch (error) {
             console.error('Previous track failed:', error);
         }
@@ -422,7 +604,7 @@ class GoatMusicApp {
     
     async loadPlaylists() {
         try {
-            const response = await fetch('/api/playlists');
+            const response = await this.apiGet('/api/playlists');
             const data = await response.json();
             
             if (response.ok) {
@@ -475,45 +657,10 @@ class GoatMusicApp {
     
     async loadRecentTracks() {
         try {
-            const response = await fetch('/api/recently-played');
+            const response = await this.apiGet('/api/recently-played');
             const data = await response.json();
             
-            const recentTracks = document.getElementById('recent-tracks');
-            if (!recentTracks) return;
-            
-            if (response.ok && data.items && data.items.length > 0) {
-                let html = '';
-                data.items.forEach(item => {
-                    const track = item.track;
-                    const artists = track.artists.map(artist => artist.name).join(', ');
-                    
-                    html += `
-                        <div class="track-card" data-uri="${track.uri}">
-                            <div class="track-cover">
-                                <img src="${track.album.images[0]?.url || '/static/images/default-album.png'}" alt="${track.name}">
-                                <div class="track-overlay">
-                                    <button class="play-btn" onclick="app.playTrack('${track.uri}')">
-                                        <i class="fas fa-play"></i>
-                                    </button>
-                                </div>
-                            </div>
-                            <div class="track-info">
-                                <h4 class="track-name">${track.name}</h4>
-                                <p class="track-artist">${artists}</p>
-                                <p class="track-album">${track.album.name}</p>
-                            </div>
-                        </div>
-                    `;
-                });
-                recentTracks.innerHTML = html;
-            } else {
-                recentTracks.innerHTML = `
-                    <div class="no-content">
-                        <i class="fas fa-history"></i>
-                        <p>Нет недавно прослушанных треков</p>
-                    </div>
-                `;
-            }
+            this.displayRecentTracks(response.ok ? data : null);
         } catch (error) {
             console.error('Failed to load recent tracks:', error);
             const recentTracks = document.getElementById('recent-tracks');
@@ -528,46 +675,51 @@ class GoatMusicApp {
         }
     }
     
-    async loadRecommendations() {
-        try {
-            const response = await fetch('/api/recommendations');
-            const data = await response.json();
-            
-            const recommendations = document.getElementById('recommendations');
-            if (!recommendations) return;
-            
-            if (response.ok && data.tracks && data.tracks.length > 0) {
-                let html = '';
-                data.tracks.forEach(track => {
-                    const artists = track.artists.map(artist => artist.name).join(', ');
-                    
-                    html += `
-                        <div class="track-card" data-uri="${track.uri}">
-                            <div class="track-cover">
-                                <img src="${track.album.images[0]?.url || '/static/images/default-album.png'}" alt="${track.name}">
-                                <div class="track-overlay">
-                                    <button class="play-btn" onclick="app.playTrack('${track.uri}')">
-                                        <i class="fas fa-play"></i>
-                                    </button>
-                                </div>
-                            </div>
-                            <div class="track-info">
-                                <h4 class="track-name">${track.name}</h4>
-                                <p class="track-artist">${artists}</p>
-                                <p class="track-album">${track.album.name}</p>
+    displayRecentTracks(data) {
+        const recentTracks = document.getElementById('recent-tracks');
+        if (!recentTracks) return;
+        
+        if (data && data.items && data.items.length > 0) {
+            let html = '';
+            data.items.forEach(item => {
+                const track = item.track;
+                const artists = track.artists.map(artist => artist.name).join(', ');
+                
+                html += `
+                    <div class="track-card" data-uri="${track.uri}">
+                        <div class="track-cover">
+                            <img src="${track.album.images[0]?.url || '/static/images/default-album.png'}" alt="${track.name}">
+                            <div class="track-overlay">
+                                <button class="play-btn" onclick="app.playTrack('${track.uri}')">
+                                    <i class="fas fa-play"></i>
+                                </button>
                             </div>
                         </div>
-                    `;
-                });
-                recommendations.innerHTML = html;
-            } else {
-                recommendations.innerHTML = `
-                    <div class="no-content">
-                        <i class="fas fa-lightbulb"></i>
-                        <p>Рекомендации появятся после прослушивания музыки</p>
+                        <div class="track-info">
+                            <h4 class="track-name">${track.name}</h4>
+                            <p class="track-artist">${artists}</p>
+                            <p class="track-album">${track.album.name}</p>
+                        </div>
                     </div>
                 `;
-            }
+            });
+            recentTracks.innerHTML = html;
+        } else {
+            recentTracks.innerHTML = `
+                <div class="no-content">
+                    <i class="fas fa-history"></i>
+                    <p>Нет недавно прослушанных треков</p>
+                </div>
+            `;
+        }
+    }
+    
+    async loadRecommendations() {
+        try {
+            const response = await this.apiGet('/api/recommendations');
+            const data = await response.json();
+            
+            this.displayRecommendations(response.ok ? data : null);
         } catch (error) {
             console.error('Failed to load recommendations:', error);
             const recommendations = document.getElementById('recommendations');
@@ -582,24 +734,63 @@ class GoatMusicApp {
         }
     }
     
+    displayRecommendations(data) {
+        const recommendations = document.getElementById('recommendations');
+        if (!recommendations) return;
+        
+        if (data && data.tracks && data.tracks.length > 0) {
+            let html = '';
+            data.tracks.forEach(track => {
+                const artists = track.artists.map(artist => artist.name).join(', ');
+                
+                html += `
+                    <div class="track-card" data-uri="${track.uri}">
+                        <div class="track-cover">
+                            <img src="${track.album.images[0]?.url || '/static/images/default-album.png'}" alt="${track.name}">
+                            <div class="track-overlay">
+                                <button class="play-btn" onclick="app.playTrack('${track.uri}')">
+                                    <i class="fas fa-play"></i>
+                                </button>
+                            </div>
+                        </div>
+                        <div class="track-info">
+                            <h4 class="track-name">${track.name}</h4>
+                            <p class="track-artist">${artists}</p>
+                            <p class="track-album">${track.album.name}</p>
+                        </div>
+                    </div>
+                `;
+            });
+            recommendations.innerHTML = html;
+        } else {
+            recommendations.innerHTML = `
+                <div class="no-content">
+                    <i class="fas fa-lightbulb"></i>
+                    <p>Рекомендации появятся после прослушивания музыки</p>
+                </div>
+            `;
+        }
+    }
+    
     async loadLibraryStats() {
         try {
-            // Загружаем количество любимых треков
-            const likedResponse = await fetch('/api/liked-tracks');
-            if (likedResponse.ok) {
-                const likedData = await likedResponse.json();
-                const likedCount = likedData.total || 0;
-                document.getElementById('liked-tracks-count').textContent = likedCount;
-            }
+            // Количество любимых треков и плейлистов уже пришло в bootstrap,
+            // иначе запрашиваем оба счетчика параллельно
+            let likedData = this.bootstrapData?.liked_tracks;
+            let playlistsData = this.bootstrapData?.playlists;
             
-            // Загружаем количество плейлистов
-            const playlistsResponse = await fetch('/api/playlists');
-            if (playlistsResponse.ok) {
-                const playlistsData = await playlistsResponse.json();
-                const playlistsCount = playlistsData.total || 0;
-                document.getElementById('playlists-count').textContent = playlistsCount;
+            if (!likedData || !playlistsData) {
+                const [likedResponse, playlistsResponse] = await Promise.all([
+                    this.apiGet('/api/liked-tracks'),
+                    this.apiGet('/api/playlists')
+                ]);
+                likedData = likedResponse.ok ? await likedResponse.json() : {};
+                playlistsData = playlistsResponse.ok ? await playlistsResponse.json() : {};
             }
             
+            document.getElementById('liked-tracks-count').textContent = likedData.total || 0;
+            document.getElementById('playlists-count').textContent = playlistsData.total || 0;
+            
             // Заглушка для времени прослушивания (Spotify API не предоставляет эту информацию)
             document.getElementById('listening-time').textContent = '∞ мин';
             
@@ -612,40 +803,29 @@ class GoatMusicApp {
     }
     
     async loadFavorites() {
+        // Поток от предыдущего открытия раздела больше не нужен
+        const generation = ++this.favoritesGeneration;
         try {
-            const response = await fetch('/api/liked-tracks');
-            const data = await response.json();
+            let data = this.bootstrapData?.liked_tracks;
+            if (!data) {
+                const response = await this.apiGet('/api/liked-tracks');
+                data = response.ok ? await response.json() : null;
+            }
             
             const favoritesGrid = document.getElementById('favorites-grid');
             if (!favoritesGrid) return;
             
-            if (response.ok && data.items && data.items.length > 0) {
-                let html = '';
-                data.items.forEach(item => {
-                    const track = item.track;
-                    const artists = track.artists.map(artist => artist.name).join(', ');
-                    const duration = this.formatDuration(track.duration_ms);
-                    
-                    html += `
-                        <div class="track-card" data-uri="${track.uri}">
-                            <div class="track-cover">
-                                <img src="${track.album.images[0]?.url || '/static/images/default-album.png'}" alt="${track.name}">
-                                <div class="track-overlay">
-                                    <button class="play-btn" onclick="app.playTrack('${track.uri}')">
-                                        <i class="fas fa-play"></i>
-                                    </button>
-                                </div>
-                            </div>
-                            <div class="track-info">
-                                <h4 class="track-name">${track.name}</h4>
-                                <p class="track-artist">${artists}</p>
-                                <p class="track-album">${track.album.name}</p>
-                                <span class="track-duration">${duration}</span>
-                            </div>
-                        </div>
-                    `;
-                });
-                favoritesGrid.innerHTML = html;
+            if (data && data.items && data.items.length > 0) {
+                favoritesGrid.innerHTML = data.items.map(item => this.createTrackCard(item.track)).join('');
+                
+                // Остальные любимые треки догружаются потоком по мере получения страниц
+                if (data.total > data.items.length) {
+                    await this.streamItems(`/api/stream/liked-tracks?offset=${data.items.length}`, items => {
+                        if (generation !== this.favoritesGeneration) return false;
+                        favoritesGrid.insertAdjacentHTML('beforeend',
+                            items.map(item => this.createTrackCard(item.track)).join(''));
+                    });
+                }
             } else {
                 favoritesGrid.innerHTML = `
                     <div class="no-content">
@@ -668,19 +848,37 @@ class GoatMusicApp {
         }
     }
     
-    async playPlaylist(playlistUri) {
-        try {
-            const response = await fetch('/api/play', {
-                method: 'PUT',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ uri: playlistUri })
-            });
+    async streamItems(url, onItems) {
+        // Читает NDJSON поток: onItems получает элементы пачками, false - прекратить чтение
+        const response = await fetch(url);
+        if (!response.ok || !response.body) return;
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
             
-            if (response.ok) {
-                setTimeout(() => this.loadCurrentTrack(), 1000);
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            const items = lines.filter(line => line).map(line => JSON.parse(line));
+            const error = items.find(item => item.error);
+            if (error) {
+                console.error('Stream error:', error.error);
             }
+            const batch = items.filter(item => !item.error);
+            if (batch.length > 0 && onItems(batch) === false) {
+                reader.cancel();
+                break;
+            }
+        }
+    }
+    
+    async playPlaylist(playlistUri) {
+        try {
+            await this.sendPlayerCommand('/api/play', 'PUT', { uri: playlistUri });
         } catch (error) {
             console.error('Play playlist failed:', error);
         }
@@ -714,13 +912,7 @@ class GoatMusicApp {
     // Новые функции для управления плеером
     async setVolume(volume) {
         try {
-            const response = await fetch('/api/volume', {
-                method: 'PUT',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ volume: volume })
-            });
+            const response = await this.sendPlayerCommand('/api/volume', 'PUT', { volume: volume });
             
             if (response.ok) {
                 console.log(`Volume set to ${volume}%`);
@@ -732,13 +924,7 @@ class GoatMusicApp {
     
     async toggleShuffle(state) {
         try {
-            const response = await fetch('/api/shuffle', {
-                method: 'PUT',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ state: state })
-            });
+            const response = await this.sendPlayerCommand('/api/shuffle', 'PUT', { state: state });
             
             if (response.ok) {
                 console.log(`Shuffle ${state ? 'enabled' : 'disabled'}`);
@@ -750,13 +936,7 @@ class GoatMusicApp {
     
     async setRepeatMode(mode) {
         try {
-            const response = await fetch('/api/repeat', {
-                method: 'PUT',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ state: mode })
-            });
+            const response = await this.sendPlayerCommand('/api/repeat', 'PUT', { state: mode });
             
             if (response.ok) {
                 console.log(`Repeat mode set to ${mode}`);
@@ -768,7 +948,7 @@ class GoatMusicApp {
     
     async getPlayerState() {
         try {
-            const response = await fetch('/api/player-state');
+            const response = await this.apiGet('/api/player-state');
             if (response.ok) {
                 const data = await response.json();
                 return data;
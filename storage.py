@@ -0,0 +1,47 @@
+"""
+Локальное хранилище на SQLite (WAL)
+Общий для всех воркеров gunicorn на одном хосте, переживает их перезапуск
+"""
+
+import os
+import sqlite3
+
+try:
+    # Под gevent threading.local отдельный у каждого гринлета: соединение
+    # открывалось бы заново на каждый запрос. Исходный local - на поток ОС
+    from gevent.monkey import get_original
+    _ThreadLocal = get_original('_thread', '_local')
+except ImportError:
+    from threading import local as _ThreadLocal
+
+DATA_DIR = os.getenv('GOATMUSIC_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+
+class SQLiteDatabase:
+    """Файл SQLite с отдельным соединением на поток ОС и процесс
+
+    Гринлеты gevent одного потока делят его соединение: между BEGIN и COMMIT
+    не должно быть переключений (сетевых вызовов, sleep)
+    """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self._local = _ThreadLocal()
+
+    def connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.schema)
+            local.conn = conn
+            local.pid = os.getpid()
+        return local.conn
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
@@ -71,7 +71,19 @@ def main():
         "/api/currently-playing",
         "/api/recently-played",
         "/api/liked-tracks",
-        "/api/recommendations"
+        "/api/recommendations",
+        "/api/stream/player-state",
+        "/api/bootstrap",
+        "/api/stream/liked-tracks",
+        "/api/stream/playlists",
+        "/api/stream/playlist/test/tracks",
+        "/api/artists?ids=0TnOYISbd1XYRBk9myaseg",
+        "/api/albums?ids=4aawyAB9vmqN3uQ7FjRGTy",
+        "/api/page/artist/0TnOYISbd1XYRBk9myaseg",
+        "/api/page/album/4aawyAB9vmqN3uQ7FjRGTy",
+        "/api/stats/top-tracks",
+        "/api/stats/top-artists",
+        "/api/stats/listening"
     ]
     
     for endpoint in protected_endpoints:
@@ -0,0 +1,115 @@
+"""
+Управление токенами Spotify
+Хранит абсолютное время истечения, обновляет токен заранее и объединяет
+одновременные обновления одного пользователя в один запрос
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from spotify_client import get_client, SPOTIFY_TOKEN_URL
+from concurrency import SingleFlight
+from cache import response_cache
+
+SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
+
+# За сколько секунд до истечения обновлять токен
+REFRESH_MARGIN = int(os.getenv('TOKEN_REFRESH_MARGIN', '120'))
+# Сколько помнить результат обновления, чтобы другие вкладки и воркеры
+# с тем же refresh token получили новый токен без повторного запроса
+REFRESH_RESULT_TTL = 300
+
+_refresh_flight = SingleFlight()
+
+
+def token_from_response(token_info, refresh_token=None):
+    """Токены из ответа Spotify с абсолютным временем истечения"""
+    return {
+        'access_token': token_info['access_token'],
+        'refresh_token': token_info.get('refresh_token', refresh_token),
+        'expires_at': time.time() + token_info.get('expires_in', 3600),
+    }
+
+
+def refresh_tokens(refresh_token, rejected=None):
+    """Обновляет токены: один запрос к Spotify на все параллельные вызовы"""
+    key = 'token:' + hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+    def refresh():
+        cached = response_cache.backend.get(key)
+        if cached is not None:
+            token = json.loads(cached)
+            # Токен, который Spotify только что отклонил, повторно не раздаем
+            if token['access_token'] != rejected and token['expires_at'] - time.time() > REFRESH_MARGIN:
+                return token
+
+        token_data = {
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+            'client_id': SPOTIFY_CLIENT_ID
+        }
+        response = get_client().post(SPOTIFY_TOKEN_URL, data=token_data)
+        if response.status_code != 200:
+            return None
+
+        token = token_from_response(response.json(), refresh_token)
+        response_cache.backend.set(key, json.dumps(token).encode('utf-8'), REFRESH_RESULT_TTL)
+        return token
+
+    return _refresh_flight.do(key, refresh)
+
+
+class UserToken:
+    """Токены одного пользователя на время запроса (и фоновых задач)"""
+
+    def __init__(self, access_token, refresh_token=None, expires_at=0, user_id=None):
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at
+        # По user_id планировщик ведет лимит запросов пользователя
+        self.user_id = user_id
+        self.changed = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_session(cls, session):
+        expires_at = session.get('token_expires_at') or 0
+        # Старые сессии хранили относительный expires_in - считаем их истекшими
+        if expires_at < 10 ** 9:
+            expires_at = 0
+        return cls(session['access_token'], session.get('refresh_token'), expires_at,
+                   session.get('user_id'))
+
+    def save(self, session):
+        session['access_token'] = self.access_token
+        session['refresh_token'] = self.refresh_token
+        session['token_expires_at'] = self.expires_at
+
+    def get(self):
+        """Действующий access token, при необходимости обновленный заранее"""
+        if self.refresh_token and self.expires_at - time.time() < REFRESH_MARGIN:
+            with self._lock:
+                if self.expires_at - time.time() < REFRESH_MARGIN:
+                    self._apply(refresh_tokens(self.refresh_token))
+        return self.access_token
+
+    def refresh(self, rejected=None):
+        """Принудительное обновление после 401. True - можно повторить запрос"""
+        if not self.refresh_token:
+            return False
+        with self._lock:
+            if rejected is not None and rejected != self.access_token:
+                # Другой поток уже обновил токен
+                return True
+            return self._apply(refresh_tokens(self.refresh_token, rejected))
+
+    def _apply(self, token):
+        if token is None:
+            return False
+        self.access_token = token['access_token']
+        self.refresh_token = token['refresh_token']
+        self.expires_at = token['expires_at']
+        self.changed = True
+        return True